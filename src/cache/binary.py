@@ -0,0 +1,441 @@
+"""Memory-mapped binary cache with fixed-width repository records."""
+
+import mmap
+import os
+import struct
+import sys
+
+from collections.abc import Iterable, Iterator
+
+from cache.totals import ARCHIVED, row_counts, row_flags
+from utils.fileio import atomic_write
+
+MAGIC: bytes = b'LOCCACHE'
+VERSION: int = 1
+
+# magic, format version, record count
+HEADER = struct.Struct('<8sII')
+# repository digest, total commits, my commits, LOC added, LOC deleted, flags
+RECORD = struct.Struct('<32s5q')
+
+DIGEST_SIZE: int = 32
+FIELDS: tuple[str, ...] = ('total_commits', 'my_commits', 'added', 'deleted', 'flags')
+
+# Number of int64 words per record, the digest takes the first four of them.
+_WORDS: int = RECORD.size // 8
+_DIGEST_WORDS: int = DIGEST_SIZE // 8
+
+
+class BinaryCache:
+    """
+    Fixed-width repository records stored sorted by digest in a memory-mapped file.
+
+    Each record holds the sha256 digest of the repository name followed by the
+    total commit count, the commits authored by the user, the lines added, the
+    lines deleted and a flags word. Records are kept sorted by digest so lookups
+    are a binary search over the map and updates of existing rows are done in
+    place without rewriting the file. Inserting or removing records writes a
+    new file with `atomic_write`, so a crash never leaves the record count of
+    the header out of step with the file size.
+
+    Writers must hold `utils.fileio.locked` on the file, and readers a shared
+    lock, since inserting or removing records replaces the map.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+    ) -> None:
+        """
+        Open the binary cache, creating an empty one if it does not exist.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the binary cache file.
+
+        Raises
+        ------
+        ValueError
+            If the file exists but is not a binary cache of a supported version,
+            or its size does not match the record count of its header.
+        """
+        self.filename: str = filename
+        if not os.path.exists(filename):
+            atomic_write(filename, HEADER.pack(MAGIC, VERSION, 0))
+        self._file = open(filename, 'r+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER.size:
+            self._file.close()
+            raise ValueError(f'{filename} is not a version {VERSION} binary cache')
+        self._mm: mmap.mmap = mmap.mmap(self._file.fileno(), 0)
+
+        magic, version, count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{filename} is not a version {VERSION} binary cache')
+        if size != self._offset(count):
+            # a torn write: the records do not match the count in the header
+            self.close()
+            raise ValueError(f'{filename} holds {size} bytes, not the {count} records of its header')
+
+    def __enter__(self) -> 'BinaryCache':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return HEADER.unpack_from(self._mm, 0)[2]
+
+    def close(self) -> None:
+        """
+        Flush pending changes and release the map and the file handle.
+
+        Returns
+        -------
+        None
+        """
+        if not self._mm.closed:
+            self._mm.flush()
+            self._mm.close()
+        self._file.close()
+
+    def _offset(
+        self,
+        index: int,
+    ) -> int:
+        return HEADER.size + index * RECORD.size
+
+    def _digest_at(
+        self,
+        index: int,
+    ) -> bytes:
+        offset = self._offset(index)
+        return self._mm[offset:offset + DIGEST_SIZE]
+
+    def _bisect(
+        self,
+        digest: bytes,
+    ) -> int:
+        """
+        Return the index of the first record whose digest is not lower than `digest`.
+        """
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._digest_at(middle) < digest:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(
+        self,
+        digest: bytes,
+    ) -> int:
+        """
+        Find the record index of a repository digest.
+
+        Parameters
+        ----------
+        digest : bytes
+            Raw sha256 digest of the repository name.
+
+        Returns
+        -------
+        int
+            Index of the record, or -1 if the digest is not cached.
+        """
+        index = self._bisect(digest)
+        if index < len(self) and self._digest_at(index) == digest:
+            return index
+        return -1
+
+    def get(
+        self,
+        digest: bytes,
+    ) -> tuple[int, int, int, int, int] | None:
+        """
+        Return the counters stored for a repository digest.
+
+        Parameters
+        ----------
+        digest : bytes
+            Raw sha256 digest of the repository name.
+
+        Returns
+        -------
+        tuple[int, int, int, int, int] | None
+            Total commits, my commits, LOC added, LOC deleted and flags, or None
+            if the digest is not cached.
+        """
+        index = self.find(digest)
+        if index < 0:
+            return None
+        return RECORD.unpack_from(self._mm, self._offset(index))[1:]
+
+    def update(
+        self,
+        digest: bytes,
+        total_commits: int,
+        my_commits: int,
+        added: int,
+        deleted: int,
+        flags: int = 0,
+    ) -> None:
+        """
+        Store the counters of a repository, in place if it is already cached.
+
+        Parameters
+        ----------
+        digest : bytes
+            Raw sha256 digest of the repository name.
+        total_commits : int
+            Total commits in the default branch.
+        my_commits : int
+            Commits authored by the user.
+        added : int
+            Lines of code added by the user.
+        deleted : int
+            Lines of code deleted by the user.
+        flags : int, optional
+            Row flags (default: 0).
+
+        Returns
+        -------
+        None
+        """
+        record = RECORD.pack(digest, total_commits, my_commits, added, deleted, flags)
+        index = self._bisect(digest)
+        if index < len(self) and self._digest_at(index) == digest:
+            self._mm[self._offset(index):self._offset(index + 1)] = record
+            return
+        start, end = self._offset(index), self._offset(len(self))
+        self._rewrite(len(self) + 1, self._mm[HEADER.size:start] + record + self._mm[start:end])
+
+    def update_many(
+        self,
+        rows: Iterable[tuple[bytes, int, int, int, int, int]],
+    ) -> None:
+        """
+        Store the counters of several repositories, rewriting the file at most once.
+
+        Parameters
+        ----------
+        rows : Iterable[tuple[bytes, int, int, int, int, int]]
+            Digest, total commits, my commits, LOC added, LOC deleted and flags
+            of every repository.
+
+        Returns
+        -------
+        None
+        """
+        added = {}
+        for row in rows:
+            if self.find(row[0]) >= 0:
+                self.update(*row)
+            else:
+                added[row[0]] = RECORD.pack(*row)
+        if not added:
+            return
+        records = {self._digest_at(index): self._mm[self._offset(index):self._offset(index + 1)]
+                   for index in range(len(self))}
+        records.update(added)
+        self._rewrite(len(records), b''.join(records[digest] for digest in sorted(records)))
+
+    def remove(
+        self,
+        digest: bytes,
+    ) -> bool:
+        """
+        Remove the record of a repository digest.
+
+        Parameters
+        ----------
+        digest : bytes
+            Raw sha256 digest of the repository name.
+
+        Returns
+        -------
+        bool
+            True if a record was removed.
+        """
+        index = self.find(digest)
+        if index < 0:
+            return False
+        start, end = self._offset(index), self._offset(len(self))
+        self._rewrite(len(self) - 1, self._mm[HEADER.size:start] + self._mm[start + RECORD.size:end])
+        return True
+
+    def clear(self) -> None:
+        """
+        Remove every record.
+
+        Returns
+        -------
+        None
+        """
+        self._rewrite(0, b'')
+
+    def reconcile(
+        self,
+        digests: Iterable[bytes],
+    ) -> bool:
+        """
+        Keep only the given repositories, adding zeroed records for new ones.
+
+        Archived records are always kept, and a repository whose digest matches
+        an archived record is left to it.
+
+        Parameters
+        ----------
+        digests : Iterable[bytes]
+            Raw sha256 digests of every repository that should be cached.
+
+        Returns
+        -------
+        bool
+            True if the cached repositories already matched the given ones.
+        """
+        current = {}
+        records = {}
+        for index, (digest, *__, flags) in enumerate(self.rows()):
+            if flags & ARCHIVED:
+                offset = self._offset(index)
+                records[digest] = self._mm[offset:offset + RECORD.size]
+            else:
+                current[digest] = index
+
+        wanted = set(digests) - records.keys()
+        if wanted == current.keys():
+            return True
+
+        for digest in wanted:
+            if digest in current:
+                offset = self._offset(current[digest])
+                records[digest] = self._mm[offset:offset + RECORD.size]
+            else:
+                records[digest] = RECORD.pack(digest, 0, 0, 0, 0, 0)
+        self._rewrite(len(records), b''.join(records[digest] for digest in sorted(records)))
+        return False
+
+    def rows(self) -> Iterator[tuple[bytes, int, int, int, int, int]]:
+        """
+        Iterate over every record in digest order.
+
+        Returns
+        -------
+        Iterator[tuple[bytes, int, int, int, int, int]]
+            Digest, total commits, my commits, LOC added, LOC deleted and flags.
+        """
+        for index in range(len(self)):
+            yield RECORD.unpack_from(self._mm, self._offset(index))
+
+    def sum(
+        self,
+        field: str,
+    ) -> int:
+        """
+        Sum one counter over every record.
+
+        On little-endian hosts the map is viewed as an array of int64 words and
+        the column is summed through a strided view, without copying or
+        unpacking the records.
+
+        Parameters
+        ----------
+        field : str
+            One of `FIELDS`.
+
+        Returns
+        -------
+        int
+            The sum of the field over all records.
+        """
+        column = FIELDS.index(field)
+        count = len(self)
+        if sys.byteorder != 'little':
+            return sum(row[column + 1] for row in self.rows())
+
+        with memoryview(self._mm) as view:
+            with view[HEADER.size:self._offset(count)].cast('q') as words:
+                with words[_DIGEST_WORDS + column::_WORDS] as values:
+                    return sum(values)
+
+    def flagged(
+        self,
+        mask: int,
+    ) -> Iterator[tuple[bytes, int, int, int, int, int]]:
+        """
+        Iterate over the records whose flags have any of the bits of `mask` set.
+
+        On little-endian hosts only the flags column is read to find them, as
+        in `sum`, and the matching records alone are unpacked.
+
+        Parameters
+        ----------
+        mask : int
+            Flags to look for, e.g. `cache.totals.ARCHIVED`.
+
+        Returns
+        -------
+        Iterator[tuple[bytes, int, int, int, int, int]]
+            Digest, total commits, my commits, LOC added, LOC deleted and flags.
+        """
+        if sys.byteorder != 'little':
+            yield from (row for row in self.rows() if row[5] & mask)
+            return
+
+        with memoryview(self._mm) as view:
+            with view[HEADER.size:self._offset(len(self))].cast('q') as words:
+                with words[_DIGEST_WORDS + FIELDS.index('flags')::_WORDS] as flags:
+                    indices = [index for index, value in enumerate(flags) if value & mask]
+        for index in indices:
+            yield RECORD.unpack_from(self._mm, self._offset(index))
+
+    def _rewrite(
+        self,
+        count: int,
+        records: bytes,
+    ) -> None:
+        """Replace the file with `count` sorted records and map the new file."""
+        self._mm.flush()
+        atomic_write(self.filename, HEADER.pack(MAGIC, VERSION, count) + records)
+        self._mm.close()
+        self._file.close()
+        self._file = open(self.filename, 'r+b')
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+
+def convert_text_cache(
+    text_filename: str,
+    binary_filename: str,
+    comment_size: int,
+) -> None:
+    """
+    Build a binary cache from the rows of a text cache file.
+
+    Parameters
+    ----------
+    text_filename : str
+        Path to the text cache file.
+    binary_filename : str
+        Path to the binary cache file to create.
+    comment_size : int
+        Number of comment lines at the top of the text cache file.
+
+    Returns
+    -------
+    None
+    """
+    records = {}
+    with open(text_filename, 'r') as f:
+        for line in f.readlines()[comment_size:]:
+            digest = bytes.fromhex(line.split()[0])
+            records[digest] = RECORD.pack(digest, *row_counts(line), row_flags(line))
+
+    atomic_write(
+        binary_filename,
+        HEADER.pack(MAGIC, VERSION, len(records)) + b''.join(records[digest] for digest in sorted(records))
+    )
@@ -1,25 +1,59 @@
 """Cache management module for repository data storage and updates."""
 
 import hashlib
+import json
 import os
+import threading
 
+from cache import binary, tiered
+from cache.timeseries import TimeSeriesStore
+from cache.totals import ARCHIVED, ROW_TAGS, UNATTRIBUTED, Totals, row_counts, row_flags
+from utils import memory, trace
+from utils.fileio import atomic_write, locked
 from graphql import github
-from config.environment import EnvConfig
+from utils.lazy import lazy_import
 
-env = EnvConfig.from_env()
-USER_NAME: str = env.USER_NAME
+environment = lazy_import('config.environment')
 
+CRAWL_TTL: int = 30 * 24 * 60 * 60
+_SHARED_CACHE: tiered.TieredCache | None = None
+_SHARED_CACHE_LOCK = threading.Lock()
 
+
+def cache_filename(
+    extension: str = '.txt',
+) -> str:
+    """
+    Returns the path of the user's cache file.
+
+    Parameters
+    ----------
+    extension : str, optional
+        Extension of the cache file (default: '.txt')
+
+    Returns
+    -------
+    str
+        Path of the cache file, named after the hash of the username
+    """
+    return 'cache/' + hashlib.sha256(environment.settings().USER_NAME.encode('utf-8')).hexdigest() + extension
+
+
+@trace.span('cache_builder')
 def cache_builder(
     edges: list,
     comment_size: int,
     force_cache: bool,
     loc_add: int = 0,
     loc_del: int = 0,
+    owner_affiliation: list[str] | None = None,
 ) -> list[int | bool]:
     """
     Builds or updates the cache file with repository data.
 
+    The running totals stored next to the cache are updated with the difference
+    of every row that changes, so they never require a scan of the whole cache.
+
     Parameters
     ----------
     edges : list
@@ -32,6 +66,8 @@ def cache_builder(
         Lines of code added counter (default: 0)
     loc_del : int, optional
         Lines of code deleted counter (default: 0)
+    owner_affiliation : list[str] | None, optional
+        Affiliations the edges were queried with, recorded in the totals (default: None)
 
     Returns
     -------
@@ -47,36 +83,53 @@ def cache_builder(
     IOError
         If there is an issue reading or writing to the file
     """
+    # the edges of every repository were gathered by loc_query
+    memory.checkpoint('query repositories')
+    if environment.settings().CACHE_FORMAT == 'binary':
+        return binary_cache_builder(edges, comment_size, force_cache, loc_add, loc_del, owner_affiliation)
+
     cached = True
-    filename = 'cache/' + hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest() + '.txt'
+    filename = cache_filename()
 
-    try:
-        with open(filename, 'r') as f:
-            data = f.readlines()
-    except FileNotFoundError:
-        data = []
-        if comment_size > 0:
-            for _ in range(comment_size):
-                data.append('This line is a comment block. Write whatever you want here.\n')
-        with open(filename, 'w') as f:
-            f.writelines(data)
-
-    if len(data) - comment_size != len(edges) or force_cache:
-        cached = False
-        flush_cache(edges, filename, comment_size)
-        with open(filename, 'r') as f:
-            data = f.readlines()
+    with locked(filename):
+        try:
+            with open(filename, 'r') as f:
+                data = f.readlines()
+        except FileNotFoundError:
+            data = []
+            if comment_size > 0:
+                for _ in range(comment_size):
+                    data.append('This line is a comment block. Write whatever you want here.\n')
+            atomic_write(filename, ''.join(data))
 
-    cache_comment = data[:comment_size]
-    data = data[comment_size:]
+        if force_cache:
+            cached = False
+            flush_cache(edges, filename, comment_size)
+            with open(filename, 'r') as f:
+                data = f.readlines()
 
-    for index in range(len(edges)):
-        repo_hash, commit_count, *__ = data[index].split()
-        if repo_hash == hashlib.sha256(edges[index]['node']['nameWithOwner'].encode('utf-8')).hexdigest():
+        cache_comment = data[:comment_size]
+        data, reconciled = reconcile_rows(edges, data[comment_size:])
+        cached = cached and reconciled
+
+        running = Totals.load(totals_filename(), filename) if reconciled else None
+        if running is None:
+            running = Totals.from_rows([row_counts(line) + (row_flags(line),) for line in data])
+        memory.checkpoint('read cache')
+
+        for index in range(len(edges)):
+            if row_flags(data[index]) & ARCHIVED:
+                continue
+            repo_hash, commit_count, *__ = data[index].split()
+            old_row = row_counts(data[index])
             try:
                 if int(commit_count) != edges[index]['node']['defaultBranchRef']['target']['history']['totalCount']:
-                    owner, repo_name = edges[index]['node']['nameWithOwner'].split('/')
-                    loc = github.recursive_loc(owner, repo_name, data, cache_comment)
+                    loc = crawl_repository(
+                        edges[index]['node']['nameWithOwner'],
+                        edges[index]['node']['defaultBranchRef']['target']['history']['totalCount'],
+                        data,
+                        cache_comment
+                    )
                     data[index] = (
                         repo_hash + ' ' +
                         str(edges[index]['node']['defaultBranchRef']['target']['history']['totalCount']) + ' ' +
@@ -86,19 +139,535 @@ def cache_builder(
                     )
             except TypeError:
                 data[index] = repo_hash + ' 0 0 0 0\n'
+            running.replace_row(old_row, row_counts(data[index]))
+        memory.checkpoint('crawl repositories')
+
+        atomic_write(filename, ''.join(cache_comment + data))
+        running.archive_sha256 = previous_archive_sha256(running)
+
+        if owner_affiliation is not None:
+            running.affiliations[','.join(sorted(owner_affiliation))] = len(edges)
+        running.save(totals_filename(), filename)
+    memory.checkpoint('write cache')
+
+    record_history({
+        'loc_added': running.added,
+        'loc_deleted': running.deleted,
+        'loc_net': running.added - running.deleted,
+        'cached_repos': running.repos,
+        'cached_commits': running.my_commits,
+    })
+
+    loc_add += running.added
+    loc_del += running.deleted
+    return [loc_add, loc_del, loc_add - loc_del, cached]
+
+
+def previous_archive_sha256(
+    running: Totals,
+) -> str:
+    """
+    Returns the archive digest recorded in the stored totals.
+
+    The digest is not derived from the cache rows, so it has to be carried over
+    when the totals are recomputed from scratch.
+
+    Parameters
+    ----------
+    running : Totals
+        The totals being updated
+
+    Returns
+    -------
+    str
+        Digest of the imported archive file, empty if none was imported
+    """
+    if running.archive_sha256:
+        return running.archive_sha256
+    try:
+        with open(totals_filename(), 'r') as f:
+            return json.load(f).get('archive_sha256', '')
+    except (FileNotFoundError, ValueError):
+        return ''
+
+
+def load_totals(
+    comment_size: int,
+) -> Totals:
+    """
+    Returns the running totals of the user's cache, rebuilding them if they are stale.
+
+    Rebuilt totals are stored, so only the first read after the cache changed
+    without them scans the cache.
+
+    Parameters
+    ----------
+    comment_size : int
+        Number of comment lines in the text cache file
+
+    Returns
+    -------
+    Totals
+        Up to date totals of every cache row
+    """
+    source = cache_filename('.bin' if environment.settings().CACHE_FORMAT == 'binary' else '.txt')
+    with locked(source, shared=True):
+        running = Totals.load(totals_filename(), source)
+    if running is not None:
+        return running
+
+    # flock cannot upgrade a shared lock in place; another reader may have
+    # rebuilt the totals before the exclusive lock was granted
+    with locked(source):
+        running = Totals.load(totals_filename(), source)
+        if running is not None:
+            return running
+
+        if environment.settings().CACHE_FORMAT == 'binary':
+            store = open_binary_cache(comment_size, create=False)
+            if store is None:
+                return Totals(archive_sha256=previous_archive_sha256(Totals()))
+            with store:
+                running = binary_totals(store)
+        else:
+            with open(source, 'r') as f:
+                rows = f.readlines()[comment_size:]
+            running = Totals.from_rows([row_counts(line) + (row_flags(line),) for line in rows])
+        running.archive_sha256 = previous_archive_sha256(running)
+        running.save(totals_filename(), source)
+    return running
+
+
+def import_archive(
+    comment_size: int,
+    archive: str = 'cache/repository_archive.txt',
+    archive_comment_size: int = 7,
+    archive_footer_size: int = 3,
+) -> bool:
+    """
+    Imports the rows of archived repositories into the user's cache, once.
+
+    The rows are added as immutable rows tagged as archived: they are never
+    recrawled nor dropped when the repository list changes. The commits of
+    deleted repositories that the archive footer reports in aggregate are kept
+    as a single unattributed archived row. Their contribution is precomputed in
+    the running totals, so later runs never read the archive file again.
+
+    Parameters
+    ----------
+    comment_size : int
+        Number of comment lines in the text cache file
+    archive : str, optional
+        Path to the archive file (default: 'cache/repository_archive.txt')
+    archive_comment_size : int, optional
+        Number of header lines in the archive file (default: 7)
+    archive_footer_size : int, optional
+        Number of footer lines in the archive file (default: 3)
+
+    Returns
+    -------
+    bool
+        True if the archive was imported, False if it already had been
+
+    Raises
+    ------
+    IOError
+        If there is an issue reading the archive or writing the cache
+    """
+    with open(archive, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    if load_totals(comment_size).archive_sha256 == digest:
+        return False
+
+    lines = content.decode('utf-8').splitlines(keepends=True)
+    rows = {}
+    for line in lines[archive_comment_size:len(lines) - archive_footer_size]:
+        repo_hash, total_commits, my_commits, added, deleted, *__ = line.split()
+        rows[repo_hash] = (
+            int(total_commits),
+            int(my_commits) if my_commits.isdigit() else 0,
+            int(added),
+            int(deleted),
+            ARCHIVED,
+        )
+    unattributed = hashlib.sha256(('unattributed:' + digest).encode('utf-8')).hexdigest()
+    rows[unattributed] = (0, int(lines[-1].split()[4][:-1]), 0, 0, ARCHIVED | UNATTRIBUTED)
+
+    binary_format = environment.settings().CACHE_FORMAT == 'binary'
+    filename = cache_filename('.bin' if binary_format else '.txt')
+    # the totals are stamped with the cache file, so they are saved under the
+    # same lock as the rows they describe
+    with locked(filename):
+        previous = Totals.load(totals_filename(), filename)
+        if binary_format:
+            with open_binary_cache(comment_size) as store:
+                store.update_many(
+                    (bytes.fromhex(repo_hash), *row) for repo_hash, row in rows.items()
+                    if store.find(bytes.fromhex(repo_hash)) < 0
+                )
+                running = binary_totals(store)
+        else:
+            with open(filename, 'r') as f:
+                data = f.readlines()
+            present = {line.split()[0] for line in data[comment_size:] if line.strip()}
+            for repo_hash, row in rows.items():
+                if repo_hash not in present:
+                    data.append(' '.join([repo_hash, *map(str, row[:4]), ROW_TAGS[row[4]]]) + '\n')
+            atomic_write(filename, ''.join(data))
+            running = Totals.from_rows([row_counts(line) + (row_flags(line),) for line in data[comment_size:]])
+
+        running.affiliations = previous.affiliations if previous else {}
+        running.archive_sha256 = digest
+        running.save(totals_filename(), filename)
+    return True
+
+
+def record_history(
+    values: dict[str, int],
+) -> None:
+    """
+    Appends the given statistics to the user's history in output/history.
+
+    Parameters
+    ----------
+    values : dict[str, int]
+        Statistic name to value; values that are not integers are skipped. The
+        sample is dropped if the clock went back since the last one.
+    """
+    try:
+        TimeSeriesStore('output/history/' + environment.settings().USER_NAME + '.tsdb').append(values)
+    except ValueError as error:
+        print(f'Skipping history sample: {error}')
+
+
+def shared_cache() -> tiered.TieredCache:
+    """
+    Returns the cache shared by every worker on this host, creating it on first use.
+
+    The cache has an in-process LRU tier, a disk tier in cache/responses and,
+    if SHARED_CACHE_ADDRESS is set, a tier on the shared cache server.
+
+    Returns
+    -------
+    tiered.TieredCache
+        The process-wide cache instance
+    """
+    global _SHARED_CACHE
+    if _SHARED_CACHE is None:
+        # the refresh threads ask for it concurrently, only one may build it
+        with _SHARED_CACHE_LOCK:
+            if _SHARED_CACHE is None:
+                config = environment.settings()
+                _SHARED_CACHE = tiered.build_cache(
+                    'cache/responses',
+                    config.SHARED_CACHE_ADDRESS,
+                    config.SHARED_CACHE_AUTHKEY.encode('utf-8'),
+                    default_ttl=config.RESPONSE_CACHE_TTL,
+                )
+    return _SHARED_CACHE
+
+
+def crawl_repository(
+    name_with_owner: str,
+    total_count: int,
+    data: list[str] | None,
+    cache_comment: list[str],
+) -> tuple[int, int, int] | int | None:
+    """
+    Returns the LOC statistics of a repository, crawling it only if no worker has yet.
+
+    Crawl results are shared through `shared_cache`, keyed by the repository and
+    its commit count, so they stay valid until the repository gets new commits.
+
+    Parameters
+    ----------
+    name_with_owner : str
+        Repository name in the "owner/name" form
+    total_count : int
+        Current number of commits in the default branch
+    data : list[str] | None
+        The cache rows being processed, forwarded to recursive_loc
+    cache_comment : list[str]
+        The comment block of the cache, forwarded to recursive_loc
+
+    Returns
+    -------
+    tuple[int, int, int] | int | None
+        The result of recursive_loc: additions, deletions and my commits
+    """
+    key = f'crawl:{environment.settings().USER_NAME}:{name_with_owner}:{total_count}'
+    with trace.span('crawl', repo=name_with_owner, commits=total_count) as current:
+        loc = shared_cache().get(key)
+        if loc is not None:
+            if current is not None:
+                current.args['cached'] = True
+            return tuple(loc)
+
+        owner, repo_name = name_with_owner.split('/')
+        loc = github.recursive_loc(owner, repo_name, data, cache_comment)
+        if isinstance(loc, tuple):
+            shared_cache().set(key, list(loc), CRAWL_TTL)
+        return loc
+
+
+def totals_filename() -> str:
+    """
+    Returns the path of the running totals stored next to the user's cache.
+
+    Returns
+    -------
+    str
+        Path of the totals file
+    """
+    return cache_filename('.totals.json')
+
+
+def crawl_state_paths() -> list[str]:
+    """
+    Returns the files and directories holding the user's crawl state.
+
+    These are the LOC rows in either cache format, their running totals, the
+    last known statistics, the response and crawl cache, and the statistics
+    history used as metrics baseline.
+
+    Returns
+    -------
+    list[str]
+        Paths relative to the working directory, some of which may not exist
+    """
+    return [
+        cache_filename('.txt'),
+        cache_filename('.bin'),
+        totals_filename(),
+        cache_filename('.stats.json'),
+        'cache/responses',
+        'output/history/' + environment.settings().USER_NAME + '.tsdb',
+    ]
+
+
+def open_binary_cache(
+    comment_size: int,
+    create: bool = True,
+) -> binary.BinaryCache | None:
+    """
+    Opens the user's binary cache, building it from the text cache if needed.
+
+    The text cache is converted when the binary cache is missing, or when it
+    is unreadable, e.g. torn by a crash of a version that resized it in place.
+    The caller holds `locked` on the binary cache file.
+
+    Parameters
+    ----------
+    comment_size : int
+        Number of comment lines in the text cache file
+    create : bool, optional
+        Create an empty binary cache when there is no cache at all (default: True).
+        Read paths pass False, so they never leave an empty cache behind.
+
+    Returns
+    -------
+    binary.BinaryCache | None
+        The open cache, or None if there is none and `create` is False
+    """
+    filename = cache_filename('.bin')
+    if os.path.exists(filename):
+        try:
+            return binary.BinaryCache(filename)
+        except ValueError as e:
+            print(f'Rebuilding {filename}: {e}')
+            os.remove(filename)
+    if os.path.exists(cache_filename()):
+        binary.convert_text_cache(cache_filename(), filename, comment_size)
+    elif not create:
+        return None
+    return binary.BinaryCache(filename)
+
+
+def binary_totals(
+    store: binary.BinaryCache,
+) -> Totals:
+    """
+    Computes the totals of a binary cache without unpacking its records.
+
+    Every counter is summed over the whole map with `BinaryCache.sum`, then the
+    few archived records, found from the flags column alone, are moved to the
+    archived totals.
+
+    Parameters
+    ----------
+    store : binary.BinaryCache
+        The open binary cache
+
+    Returns
+    -------
+    Totals
+        The totals of every record, as `Totals.from_rows` would compute them
+    """
+    running = Totals(
+        total_commits=store.sum('total_commits'),
+        my_commits=store.sum('my_commits'),
+        added=store.sum('added'),
+        deleted=store.sum('deleted'),
+        repos=len(store),
+    )
+    if store.sum('flags'):
+        for _, *row, flags in store.flagged(ARCHIVED):
+            running.replace_row(tuple(row), (0, 0, 0, 0))
+            running.repos -= 1
+            running.add_row(tuple(row), flags)
+    return running
+
+
+@trace.span('binary_cache_builder')
+def binary_cache_builder(
+    edges: list,
+    comment_size: int,
+    force_cache: bool,
+    loc_add: int = 0,
+    loc_del: int = 0,
+    owner_affiliation: list[str] | None = None,
+) -> list[int | bool]:
+    """
+    Builds or updates the binary cache file with repository data.
 
-    with open(filename, 'w') as f:
-        f.writelines(cache_comment)
-        f.writelines(data)
+    Rows are looked up by repository digest and updated in place, so a change
+    in a single repository only touches its own record. The first run converts
+    the existing text cache, if there is one.
 
-    for line in data:
-        loc = line.split()
-        loc_add += int(loc[3])
-        loc_del += int(loc[4])
+    Parameters
+    ----------
+    edges : list
+        List of repository edges containing node information
+    comment_size : int
+        Number of comment lines in the text cache being converted
+    force_cache : bool
+        Flag to force cache recreation
+    loc_add : int, optional
+        Lines of code added counter (default: 0)
+    loc_del : int, optional
+        Lines of code deleted counter (default: 0)
+    owner_affiliation : list[str] | None, optional
+        Affiliations the edges were queried with, recorded in the totals (default: None)
 
+    Returns
+    -------
+    list[int | bool]
+        A list containing:
+        - Total lines added (int)
+        - Total lines deleted (int)
+        - Net change (int)
+        - Cache status (bool)
+
+    Raises
+    ------
+    IOError
+        If there is an issue reading or writing to the file
+    """
+    cached = True
+    filename = cache_filename('.bin')
+    with locked(filename):
+        with open_binary_cache(comment_size) as store:
+            if force_cache:
+                cached = False
+                store.reconcile([])
+
+            digests = [hashlib.sha256(edge['node']['nameWithOwner'].encode('utf-8')).digest() for edge in edges]
+            reconciled = store.reconcile(digests)
+            cached = cached and reconciled
+
+            running = Totals.load(totals_filename(), filename) if reconciled and not force_cache else None
+            if running is None:
+                running = binary_totals(store)
+            memory.checkpoint('read cache')
+
+            for edge, digest in zip(edges, digests):
+                old_row = store.get(digest)[:4]
+                if store.get(digest)[4] & ARCHIVED:
+                    continue
+                try:
+                    if old_row[0] != edge['node']['defaultBranchRef']['target']['history']['totalCount']:
+                        loc = crawl_repository(
+                            edge['node']['nameWithOwner'],
+                            edge['node']['defaultBranchRef']['target']['history']['totalCount'],
+                            None,
+                            []
+                        )
+                        store.update(
+                            digest,
+                            edge['node']['defaultBranchRef']['target']['history']['totalCount'],
+                            loc[2],
+                            loc[0],
+                            loc[1],
+                        )
+                except TypeError:
+                    store.update(digest, 0, 0, 0, 0)
+                running.replace_row(old_row, store.get(digest)[:4])
+            memory.checkpoint('crawl repositories')
+
+        running.archive_sha256 = previous_archive_sha256(running)
+        if owner_affiliation is not None:
+            running.affiliations[','.join(sorted(owner_affiliation))] = len(edges)
+        running.save(totals_filename(), filename)
+    memory.checkpoint('write cache')
+
+    record_history({
+        'loc_added': running.added,
+        'loc_deleted': running.deleted,
+        'loc_net': running.added - running.deleted,
+        'cached_repos': running.repos,
+        'cached_commits': running.my_commits,
+    })
+
+    loc_add += running.added
+    loc_del += running.deleted
     return [loc_add, loc_del, loc_add - loc_del, cached]
 
 
+def reconcile_rows(
+    edges: list,
+    rows: list[str],
+) -> tuple[list[str], bool]:
+    """
+    Aligns the cached rows with the repository edges by repository hash.
+
+    Rows of repositories that are still present are kept untouched, new
+    repositories get a zeroed row and rows of repositories that no longer
+    appear in the edges are dropped. The order of the edges is irrelevant.
+    Archived rows are always kept, after the rows of the edges, and a
+    repository that has an archived row is left to it, as in
+    `binary.BinaryCache.reconcile`.
+
+    Parameters
+    ----------
+    edges : list
+        List of repository edges containing node information
+    rows : list[str]
+        Cache rows, without the comment block
+
+    Returns
+    -------
+    tuple[list[str], bool]
+        A tuple containing:
+        - The rows in the same order as the edges, then the remaining archived
+          rows (list[str])
+        - Whether every repository already had a row and none was dropped (bool)
+    """
+    archived = {line.split()[0]: line for line in rows if line.strip() and row_flags(line) & ARCHIVED}
+    cached_rows = {line.split()[0]: line for line in rows if line.strip() and not row_flags(line) & ARCHIVED}
+    aligned = []
+    seen = set()
+    for edge in edges:
+        repo_hash = hashlib.sha256(edge['node']['nameWithOwner'].encode('utf-8')).hexdigest()
+        if repo_hash in archived:
+            aligned.append(archived.pop(repo_hash))
+            continue
+        aligned.append(cached_rows.get(repo_hash, repo_hash + ' 0 0 0 0\n'))
+        seen.add(repo_hash)
+    return aligned + list(archived.values()), seen == cached_rows.keys()
+
+
+@trace.span('flush_cache')
 def flush_cache(
     edges: list,
     filename: str,
@@ -107,6 +676,8 @@ def flush_cache(
     """
     Wipes the cache file and recreates it with fresh data.
 
+    Archived rows are immutable and are kept.
+
     Parameters
     ----------
     edges : list
@@ -121,12 +692,12 @@ def flush_cache(
     IOError
         If there is an issue writing to the file
     """
-    with open(filename, 'r') as f:
-        data = []
-        if comment_size > 0:
-            data = f.readlines()[:comment_size]
+    with locked(filename):
+        with open(filename, 'r') as f:
+            lines = f.readlines()
+        data = lines[:comment_size]
 
-    with open(filename, 'w') as f:
-        f.writelines(data)
         for node in edges:
-            f.write(hashlib.sha256(node['node']['nameWithOwner'].encode('utf-8')).hexdigest() + ' 0 0 0 0\n')
+            data.append(hashlib.sha256(node['node']['nameWithOwner'].encode('utf-8')).hexdigest() + ' 0 0 0 0\n')
+        data += [line for line in lines[comment_size:] if row_flags(line) & ARCHIVED]
+        atomic_write(filename, ''.join(data))
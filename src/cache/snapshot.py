@@ -0,0 +1,206 @@
+"""Portable bundle of the crawl state, used to start CI runs with a warm cache.
+
+Layout of a bundle::
+
+    header  := magic ("STATSNAP") version sha256(payload) payload-size
+    payload := zlib(entry*)
+    entry   := flags mtime path-length data-length path data
+
+Paths are relative to the working directory and use forward slashes. Files
+packed by name are read and restored under their lock; files found below a
+packed directory, such as response cache entries, are only ever replaced
+atomically and are copied without one. The checksum covers the compressed
+payload, so a truncated or corrupted bundle is rejected before anything is
+restored. Modification times are restored too, which keeps the running totals
+stamped with the cache file valid.
+"""
+
+import hashlib
+import os
+import struct
+import zlib
+
+from collections.abc import Iterable
+from contextlib import nullcontext
+
+from utils import trace
+from utils.fileio import atomic_write, locked
+
+MAGIC: bytes = b'STATSNAP'
+VERSION: int = 1
+
+# magic, format version, payload digest, payload size
+HEADER = struct.Struct('<8sI32sQ')
+# flags, modification time in ns, length of the path, length of the data
+ENTRY = struct.Struct('<BqHQ')
+
+LOCKED: int = 1     # the file is shared through `utils.fileio.locked`
+
+
+def _expand(
+    paths: Iterable[str],
+) -> dict[str, int]:
+    """Return the flags of the given files and of every file below the given directories."""
+    files = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                for name in names:
+                    if not name.endswith(('.tmp', '.lock')):
+                        files[os.path.join(directory, name)] = 0
+        elif os.path.isfile(path):
+            files[path] = LOCKED
+    return {os.path.normpath(path).replace(os.sep, '/'): flags for path, flags in sorted(files.items())}
+
+
+def _check_path(
+    path: str,
+) -> str:
+    """Reject paths that would be restored outside the working directory."""
+    parts = path.split('/')
+    if not path or path.startswith('/') or '..' in parts or ':' in parts[0]:
+        raise ValueError(f'Refusing to restore {path!r} outside the working directory')
+    return os.path.join(*parts)
+
+
+@trace.span('export_snapshot')
+def export_snapshot(
+    bundle: str,
+    paths: Iterable[str],
+    level: int = 6,
+) -> int:
+    """
+    Pack files and directories into a bundle.
+
+    Files given by name are read under their lock, so the bundle never holds a
+    file that was being rewritten. Missing paths are skipped.
+
+    Parameters
+    ----------
+    bundle : str
+        Path of the bundle to write.
+    paths : Iterable[str]
+        Relative paths of the files and directories to pack.
+    level : int, optional
+        zlib compression level (default: 6).
+
+    Returns
+    -------
+    int
+        Number of files packed.
+
+    Raises
+    ------
+    IOError
+        If a file cannot be read or the bundle cannot be written.
+    """
+    files = _expand(paths)
+    compressor = zlib.compressobj(level)
+    payload = bytearray()
+    for path, flags in files.items():
+        with locked(path, shared=True) if flags & LOCKED else nullcontext():
+            with open(path, 'rb') as f:
+                data = f.read()
+                mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+        encoded = path.encode('utf-8')
+        payload += compressor.compress(ENTRY.pack(flags, mtime_ns, len(encoded), len(data)) + encoded + data)
+    payload += compressor.flush()
+
+    os.makedirs(os.path.dirname(bundle) or '.', exist_ok=True)
+    header = HEADER.pack(MAGIC, VERSION, hashlib.sha256(payload).digest(), len(payload))
+    atomic_write(bundle, header + bytes(payload))
+    return len(files)
+
+
+def read_snapshot(
+    bundle: str,
+) -> dict[str, tuple[int, int, bytes]]:
+    """
+    Verify a bundle and return its files.
+
+    Parameters
+    ----------
+    bundle : str
+        Path of the bundle.
+
+    Returns
+    -------
+    dict[str, tuple[int, int, bytes]]
+        Relative path to flags, modification time in ns and contents of every
+        packed file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the bundle does not exist.
+    ValueError
+        If the bundle is not a snapshot of a supported version, is truncated,
+        fails its checksum, holds malformed entries or a path outside the
+        working directory.
+    """
+    with open(bundle, 'rb') as f:
+        raw = f.read()
+    if len(raw) < HEADER.size:
+        raise ValueError(f'{bundle} is not a snapshot bundle')
+    magic, version, digest, size = HEADER.unpack_from(raw, 0)
+    if magic != MAGIC:
+        raise ValueError(f'{bundle} is not a snapshot bundle')
+    if version != VERSION:
+        raise ValueError(f'{bundle} is a version {version} snapshot, expected version {VERSION}')
+    payload = raw[HEADER.size:]
+    if len(payload) != size or hashlib.sha256(payload).digest() != digest:
+        raise ValueError(f'{bundle} is corrupted: checksum mismatch')
+
+    files = {}
+    offset = 0
+    try:
+        data = zlib.decompress(payload)
+        while offset < len(data):
+            flags, mtime_ns, path_size, data_size = ENTRY.unpack_from(data, offset)
+            offset += ENTRY.size
+            if offset + path_size + data_size > len(data):
+                raise ValueError(f'{bundle} is corrupted: entry at {offset - ENTRY.size} runs past the payload')
+            path = data[offset:offset + path_size].decode('utf-8')
+            offset += path_size
+            files[_check_path(path)] = flags, mtime_ns, data[offset:offset + data_size]
+            offset += data_size
+    except (zlib.error, struct.error, UnicodeDecodeError) as e:
+        # a bundle written by another tool, since the checksum matched
+        raise ValueError(f'{bundle} is corrupted: {e}') from e
+    return files
+
+
+def import_snapshot(
+    bundle: str,
+) -> int:
+    """
+    Restore every file of a bundle, replacing the existing ones.
+
+    The whole bundle is verified before the first file is written. Each file is
+    replaced atomically, under its lock if it was packed under one, and gets
+    back its original modification time.
+
+    Parameters
+    ----------
+    bundle : str
+        Path of the bundle.
+
+    Returns
+    -------
+    int
+        Number of files restored.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the bundle does not exist.
+    ValueError
+        If the bundle fails verification, see `read_snapshot`.
+    """
+    files = read_snapshot(bundle)
+    for path, (flags, mtime_ns, data) in files.items():
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with locked(path) if flags & LOCKED else nullcontext():
+            atomic_write(path, data)
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+    return len(files)
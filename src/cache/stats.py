@@ -0,0 +1,99 @@
+"""Last known values of the GitHub statistics, used to render without waiting on the API."""
+
+import json
+import threading
+import time
+
+from typing import Any
+
+from utils.fileio import atomic_write, locked
+
+
+class StatsStore:
+    """
+    Persistent map of statistic name to its last fetched value and fetch time.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+    ) -> None:
+        """
+        Load the stored statistics, starting empty if there are none.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the JSON file holding the statistics.
+        """
+        self.filename:  str = filename
+        self._lock:     threading.Lock = threading.Lock()
+        try:
+            with open(filename, 'r') as f:
+                self._entries: dict[str, dict[str, Any]] = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    def values(self) -> dict[str, Any]:
+        """
+        Return the last known value of every statistic.
+
+        Returns
+        -------
+        dict[str, Any]
+            Statistic name to value.
+        """
+        with self._lock:
+            return {key: entry['value'] for key, entry in self._entries.items()}
+
+    def age(
+        self,
+        key: str,
+    ) -> float | None:
+        """
+        Return how long ago a statistic was fetched.
+
+        Parameters
+        ----------
+        key : str
+            Name of the statistic.
+
+        Returns
+        -------
+        float | None
+            Age in seconds, or None if the statistic was never fetched.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        return time.time() - entry['fetched_at'] if entry else None
+
+    def update(
+        self,
+        key: str,
+        value: Any,
+    ) -> None:
+        """
+        Record a freshly fetched value and persist the store.
+
+        The file is re-read under its lock before writing, so values stored by
+        other processes in the meantime are kept.
+
+        Parameters
+        ----------
+        key : str
+            Name of the statistic.
+        value : Any
+            JSON serializable value.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock, locked(self.filename):
+            try:
+                with open(self.filename, 'r') as f:
+                    self._entries.update(json.load(f))
+            except (FileNotFoundError, ValueError):
+                pass
+            self._entries[key] = {'value': value, 'fetched_at': time.time()}
+            atomic_write(self.filename, json.dumps(self._entries, indent=4, sort_keys=True))
@@ -0,0 +1,629 @@
+"""Tiered key-value cache shared by generator workers.
+
+Lookups go through an in-process LRU tier, then a local disk tier and finally
+an optional shared tier served by another process, so several workers on the
+same host can reuse each other's GitHub responses and crawl results. Values
+must be JSON serializable. Every entry carries an absolute expiry time which is
+kept when an entry is promoted to a faster tier.
+
+A stand-in key-value server for the shared tier can be started with::
+
+    python src/main.py --cache-server 127.0.0.1:50000
+
+or, from the src directory, ``python -m cache.tiered 127.0.0.1:50000``.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cache
+from typing import Any, Protocol
+
+from utils import trace
+from utils.fileio import atomic_write
+
+DEFAULT_AUTHKEY: bytes = b'github-profile-stats'
+
+# expiry timestamp (seconds since the epoch) and value
+Entry = tuple[float, Any]
+
+
+@dataclass
+class TierStats:
+    """
+    Lookup statistics of a single cache tier.
+
+    Attributes
+    ----------
+    hits : int
+        Number of lookups answered by the tier.
+    misses : int
+        Number of lookups the tier could not answer.
+    evictions : int
+        Number of entries dropped because of size limits or expiry.
+    """
+
+    hits:       int = 0
+    misses:     int = 0
+    evictions:  int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class Tier(Protocol):
+    """Interface implemented by every cache tier."""
+
+    name: str
+    stats: TierStats
+
+    def get(self, key: str) -> Entry | None: ...
+
+    def set(self, key: str, entry: Entry) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+
+class LRUTier:
+    """
+    In-process tier evicting the least recently used entry when full.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        max_entries : int, optional
+            Maximum number of entries kept in memory (default: 1024).
+        """
+        self.name:          str = 'memory'
+        self.stats:         TierStats = TierStats()
+        self.max_entries:   int = max_entries
+        self._entries:      OrderedDict[str, Entry] = OrderedDict()
+        self._lock:         threading.Lock = threading.Lock()
+
+    def get(
+        self,
+        key: str,
+    ) -> Entry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                self.stats.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(
+        self,
+        key: str,
+        entry: Entry,
+    ) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(
+        self,
+        key: str,
+    ) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def _unpack(stored) -> tuple[str, float, object]:
+    # raises KeyError or TypeError for anything `DiskTier.set` did not write
+    return stored['key'], float(stored['expires']), stored['value']
+
+
+class DiskTier:
+    """
+    Local disk tier storing one JSON file per entry.
+
+    Expired entries are removed when they are read, and `prune` drops expired
+    entries plus the least recently used ones beyond `max_entries` or
+    `max_bytes`. A hit touches the file, so its modification time is the time
+    of its last use.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 2**20,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        directory : str
+            Directory holding the entries, created if missing.
+        max_entries : int, optional
+            Maximum number of entries kept by `prune` (default: 10000).
+        max_bytes : int, optional
+            Maximum total size of the entries kept by `prune` (default: 64 MiB).
+        """
+        self.name:          str = 'disk'
+        self.stats:         TierStats = TierStats()
+        self.directory:     str = directory
+        self.max_entries:   int = max_entries
+        self.max_bytes:     int = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(
+        self,
+        key: str,
+    ) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(
+        self,
+        key: str,
+    ) -> Entry | None:
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                stored_key, expires, value = _unpack(json.load(f))
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            # missing, or not an entry written by `set`: a miss either way
+            return None
+        if stored_key != key:
+            return None
+        if expires <= time.time():
+            self.delete(key)
+            self.stats.evictions += 1
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return expires, value
+
+    def set(
+        self,
+        key: str,
+        entry: Entry,
+    ) -> None:
+        atomic_write(self._path(key), json.dumps({'key': key, 'expires': entry[0], 'value': entry[1]}))
+
+    def delete(
+        self,
+        key: str,
+    ) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def prune(self) -> int:
+        """
+        Remove expired and malformed entries, then the least recently used ones
+        until at most `max_entries` entries of at most `max_bytes` in total are left.
+
+        Returns
+        -------
+        int
+            Number of removed entries.
+        """
+        now = time.time()
+        entries = []
+        removed = 0
+        for item in os.scandir(self.directory):
+            if not item.name.endswith('.json'):
+                continue
+            try:
+                stat = item.stat()
+                with open(item.path, 'r') as f:
+                    stored = f.read()
+            except OSError:
+                continue
+            try:
+                _, expires, _ = _unpack(json.loads(stored))
+            except (ValueError, KeyError, TypeError):
+                expires = now     # malformed entries are never hits, drop them too
+            if expires <= now:
+                os.remove(item.path)
+                removed += 1
+            else:
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+
+        entries.sort(reverse=True)
+        # most recently used first, everything past the first entry over a limit goes
+        kept = size = 0
+        for _, entry_size, path in entries:
+            kept += 1
+            size += entry_size
+            if kept <= self.max_entries and size <= self.max_bytes:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+        self.stats.evictions += removed
+        return removed
+
+
+class _SharedStore:
+    """Dictionary served by the shared cache server."""
+
+    def __init__(self) -> None:
+        self._entries: dict[str, Entry] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(
+        self,
+        key: str,
+    ) -> Entry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            return entry
+
+    def set(
+        self,
+        key: str,
+        entry: Entry,
+    ) -> None:
+        with self._lock:
+            self._entries[key] = entry
+
+    def delete(
+        self,
+        key: str,
+    ) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+@cache
+@cache
+def _server_errors() -> tuple[type[BaseException], ...]:
+    """
+    Return the errors of an unreachable or refusing shared cache server.
+
+    A wrong authkey raises `multiprocessing.AuthenticationError`, which is not
+    an OSError. Only called once an error occurred, so multiprocessing is still
+    imported on first use.
+    """
+    from multiprocessing import AuthenticationError
+
+    return OSError, EOFError, AuthenticationError
+
+
+def _manager_class(
+    role: str,
+) -> type:
+    """Return the manager class of the server or client role, importing multiprocessing on first use."""
+    from multiprocessing.managers import BaseManager
+
+    return type(f'_Store{role}', (BaseManager,), {})
+
+
+def parse_address(
+    address: str,
+) -> tuple[str, int]:
+    """
+    Split a "host:port" address.
+
+    Parameters
+    ----------
+    address : str
+        Address of the shared cache server.
+
+    Returns
+    -------
+    tuple[str, int]
+        Host and port.
+
+    Raises
+    ------
+    ValueError
+        If the address has no port or the port is not a number.
+    """
+    host, separator, port = address.rpartition(':')
+    if not separator or not port.isdigit():
+        raise ValueError(f'Expected host:port, got {address!r}')
+    return host, int(port)
+
+
+def serve_shared_cache(
+    address: tuple[str, int],
+    authkey: bytes = DEFAULT_AUTHKEY,
+) -> None:
+    """
+    Run a local key-value server backing the shared tier, until interrupted.
+
+    Parameters
+    ----------
+    address : tuple[str, int]
+        Host and port to listen on.
+    authkey : bytes, optional
+        Key clients must present to connect (default: DEFAULT_AUTHKEY).
+
+    Returns
+    -------
+    None
+    """
+    store = _SharedStore()
+    server = _manager_class('Server')
+    server.register('store', callable=lambda: store)
+    server(address=address, authkey=authkey).get_server().serve_forever()
+
+
+class SharedTier:
+    """
+    Tier backed by a key-value server shared between processes.
+
+    Any object with `get`, `set` and `delete` methods can be used as the store.
+    By default the tier connects to the server started by `serve_shared_cache`.
+    If the server cannot be reached the tier turns itself off and every lookup
+    is a miss, so workers keep running without sharing.
+    """
+
+    def __init__(
+        self,
+        address: tuple[str, int] | None = None,
+        authkey: bytes = DEFAULT_AUTHKEY,
+        store: Any = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        address : tuple[str, int] | None, optional
+            Host and port of the shared cache server (default: None).
+        authkey : bytes, optional
+            Key presented to the server (default: DEFAULT_AUTHKEY).
+        store : Any, optional
+            Store to use instead of connecting to a server (default: None).
+        """
+        self.name:      str = 'shared'
+        self.stats:     TierStats = TierStats()
+        self._store:    Any = store
+        if store is None and address is not None:
+            client = _manager_class('Client')
+            client.register('store')
+            manager = client(address=address, authkey=authkey)
+            try:
+                manager.connect()
+                self._store = manager.store()
+            except _server_errors() as error:
+                print(f'Shared cache at {address[0]}:{address[1]} is unavailable: {error!r}')
+
+    def _call(
+        self,
+        method: str,
+        *args: Any,
+    ) -> Any:
+        if self._store is None:
+            return None
+        try:
+            return getattr(self._store, method)(*args)
+        except _server_errors() as error:
+            print(f'Shared cache disabled after an error: {error!r}')
+            self._store = None
+            return None
+
+    def get(
+        self,
+        key: str,
+    ) -> Entry | None:
+        entry = self._call('get', key)
+        return tuple(entry) if entry is not None else None
+
+    def set(
+        self,
+        key: str,
+        entry: Entry,
+    ) -> None:
+        self._call('set', key, entry)
+
+    def delete(
+        self,
+        key: str,
+    ) -> None:
+        self._call('delete', key)
+
+
+class TieredCache:
+    """
+    Cache looking keys up in each tier in order, fastest first.
+
+    A hit in a slower tier is copied into every faster tier with the remaining
+    time to live of the entry. Writes go to every tier.
+    """
+
+    def __init__(
+        self,
+        tiers: list[Tier],
+        default_ttl: float = 600,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        tiers : list[Tier]
+            Tiers ordered from fastest to slowest.
+        default_ttl : float, optional
+            Time to live in seconds used when `set` is given none (default: 600).
+        """
+        self.tiers:         list[Tier] = tiers
+        self.default_ttl:   float = default_ttl
+        self.lookups:       int = 0
+        self.hits:          int = 0
+
+    @trace.span('cache_get')
+    def get(
+        self,
+        key: str,
+        default: Any = None,
+    ) -> Any:
+        """
+        Look a key up in every tier.
+
+        Parameters
+        ----------
+        key : str
+            Key to look up.
+        default : Any, optional
+            Value returned on a miss (default: None).
+
+        Returns
+        -------
+        Any
+            The cached value, or `default` if no tier holds a live entry.
+        """
+        self.lookups += 1
+        for depth, tier in enumerate(self.tiers):
+            entry = tier.get(key)
+            if entry is None:
+                tier.stats.misses += 1
+                continue
+            tier.stats.hits += 1
+            self.hits += 1
+            for faster in self.tiers[:depth]:
+                faster.set(key, entry)
+            return entry[1]
+        return default
+
+    @trace.span('cache_set')
+    def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: float | None = None,
+    ) -> None:
+        """
+        Store a value in every tier.
+
+        Parameters
+        ----------
+        key : str
+            Key to store the value under.
+        value : Any
+            JSON serializable value.
+        ttl : float | None, optional
+            Time to live in seconds, `default_ttl` if None (default: None).
+
+        Returns
+        -------
+        None
+        """
+        entry = (time.time() + (self.default_ttl if ttl is None else ttl), value)
+        for tier in self.tiers:
+            tier.set(key, entry)
+
+    def delete(
+        self,
+        key: str,
+    ) -> None:
+        """
+        Remove a key from every tier.
+
+        Parameters
+        ----------
+        key : str
+            Key to remove.
+
+        Returns
+        -------
+        None
+        """
+        for tier in self.tiers:
+            tier.delete(key)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def prune(self) -> int:
+        """
+        Remove expired and least recently used entries from the tiers that keep them.
+
+        Returns
+        -------
+        int
+            Number of removed entries.
+        """
+        return sum(tier.prune() for tier in self.tiers if hasattr(tier, 'prune'))
+
+    def report(self) -> str:
+        """
+        Format the hit rate of the cache and of each tier.
+
+        Returns
+        -------
+        str
+            One line for the whole cache followed by one line per tier.
+        """
+        lines = [f'Cache hit rate: {self.hit_rate:.1%} ({self.hits}/{self.lookups} lookups)']
+        for tier in self.tiers:
+            stats = tier.stats
+            lines.append(
+                f'   {tier.name + ":":<10}{stats.hit_rate:>7.1%}  '
+                f'hits {stats.hits}, misses {stats.misses}, evictions {stats.evictions}'
+            )
+        return '\n'.join(lines)
+
+
+def build_cache(
+    directory: str,
+    shared_address: str | None = None,
+    authkey: bytes = DEFAULT_AUTHKEY,
+    max_entries: int = 1024,
+    default_ttl: float = 600,
+    disk_entries: int = 10_000,
+    disk_bytes: int = 64 * 2**20,
+) -> TieredCache:
+    """
+    Build the memory, disk and (optionally) shared tiers of a cache.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the disk tier.
+    shared_address : str | None, optional
+        "host:port" of the shared cache server, None to skip the tier (default: None).
+    authkey : bytes, optional
+        Key presented to the shared cache server (default: DEFAULT_AUTHKEY).
+    max_entries : int, optional
+        Size of the in-process LRU tier (default: 1024).
+    default_ttl : float, optional
+        Default time to live in seconds (default: 600).
+    disk_entries : int, optional
+        Entries the disk tier keeps when pruned (default: 10000).
+    disk_bytes : int, optional
+        Total size the disk tier keeps when pruned (default: 64 MiB).
+
+    Returns
+    -------
+    TieredCache
+        The assembled cache.
+    """
+    tiers: list[Tier] = [LRUTier(max_entries), DiskTier(directory, disk_entries, disk_bytes)]
+    if shared_address:
+        tiers.append(SharedTier(parse_address(shared_address), authkey))
+    return TieredCache(tiers, default_ttl)
+
+
+if __name__ == '__main__':
+    address = sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1:50000'
+    print(f'Serving shared cache on {address}')
+    serve_shared_cache(parse_address(address), os.environ.get('SHARED_CACHE_AUTHKEY', DEFAULT_AUTHKEY.decode()).encode())
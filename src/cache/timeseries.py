@@ -0,0 +1,344 @@
+"""Append-only, delta-encoded history of the generated statistics.
+
+Layout of a history file::
+
+    magic ("STATSTS1")
+    frame*
+
+    frame  := 0x00 series-id name-length name        (series definition)
+            | 0x01 time-delta count (series-id value-delta){count}
+                                                      (samples of one run)
+
+Every integer is a varint. Time deltas are relative to the previous sample
+frame and value deltas to the previous value of the same series, both zigzag
+encoded, so a daily run usually costs a couple of bytes per statistic.
+"""
+
+import bisect
+import os
+import time
+
+from array import array
+from collections.abc import Callable
+
+from utils.fileio import locked
+
+MAGIC: bytes = b'STATSTS1'
+_DEFINE: int = 0
+_SAMPLES: int = 1
+
+AGGREGATES: dict[str, Callable[[list[int]], int]] = {
+    'last':     lambda values: values[-1],
+    'first':    lambda values: values[0],
+    'min':      min,
+    'max':      max,
+    'mean':     lambda values: round(sum(values) / len(values)),
+}
+
+
+def encode_varint(
+    value: int,
+) -> bytes:
+    """
+    Encode a non-negative integer as a LEB128 varint.
+
+    Parameters
+    ----------
+    value : int
+        Integer to encode.
+
+    Returns
+    -------
+    bytes
+        The varint bytes.
+    """
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(
+    data: bytes,
+    offset: int,
+) -> tuple[int, int]:
+    """
+    Decode a LEB128 varint.
+
+    Parameters
+    ----------
+    data : bytes
+        Buffer holding the varint.
+    offset : int
+        Position of the first byte of the varint.
+
+    Returns
+    -------
+    tuple[int, int]
+        The decoded integer and the position right after it.
+
+    Raises
+    ------
+    IndexError
+        If the buffer ends in the middle of the varint.
+    """
+    value, shift = 0, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def zigzag(
+    value: int,
+) -> int:
+    """Map a signed integer to a non-negative one, keeping small magnitudes small."""
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(
+    value: int,
+) -> int:
+    """Invert `zigzag`."""
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+class TimeSeriesStore:
+    """
+    History of integer statistics of one user, one sample frame per run.
+
+    The whole file is decoded into per-series arrays when the store is opened,
+    so range queries are binary searches over the timestamps.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+    ) -> None:
+        """
+        Open a history file, which is created on the first append.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the history file.
+        """
+        self.filename:      str = filename
+        self._ids:          dict[str, int] = {}
+        self._times:        dict[str, array] = {}
+        self._values:       dict[str, array] = {}
+        self._last_time:    int = 0
+        self._size:         int = 0
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        if not data:
+            return
+        if not data.startswith(MAGIC):
+            raise ValueError(f'{self.filename} is not a statistics history file')
+
+        names: dict[int, str] = {}
+        offset = good = len(MAGIC)
+        try:
+            while offset < len(data):
+                kind, offset = decode_varint(data, offset)
+                if kind == _DEFINE:
+                    series_id, offset = decode_varint(data, offset)
+                    length, offset = decode_varint(data, offset)
+                    if offset + length > len(data):
+                        break
+                    names[series_id] = data[offset:offset + length].decode('utf-8')
+                    offset += length
+                    self._define(names[series_id], series_id)
+                else:
+                    delta, offset = decode_varint(data, offset)
+                    timestamp = self._last_time + unzigzag(delta)
+                    count, offset = decode_varint(data, offset)
+                    samples = []
+                    for _ in range(count):
+                        series_id, offset = decode_varint(data, offset)
+                        delta, offset = decode_varint(data, offset)
+                        samples.append((names[series_id], unzigzag(delta)))
+                    for name, delta in samples:
+                        previous = self._values[name][-1] if self._values[name] else 0
+                        self._times[name].append(timestamp)
+                        self._values[name].append(previous + delta)
+                    self._last_time = timestamp
+                good = offset
+        except IndexError:
+            pass  # a run was interrupted while appending, ignore the partial frame
+        self._size = good
+
+    def _define(
+        self,
+        name: str,
+        series_id: int,
+    ) -> None:
+        self._ids[name] = series_id
+        self._times[name] = array('q')
+        self._values[name] = array('q')
+
+    def series(self) -> list[str]:
+        """
+        Return the names of every recorded statistic.
+
+        Returns
+        -------
+        list[str]
+            Series names in the order they were first recorded.
+        """
+        return list(self._ids)
+
+    def append(
+        self,
+        values: dict[str, int],
+        timestamp: int | None = None,
+    ) -> None:
+        """
+        Append one sample of several statistics.
+
+        Parameters
+        ----------
+        values : dict[str, int]
+            Statistic name to value. Non-integer values, booleans included, are
+            skipped.
+        timestamp : int | None, optional
+            Unix time of the sample, now if None (default: None).
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError
+            If the timestamp is earlier than the last sample, which would break
+            the ordering `range` searches on.
+        """
+        timestamp = int(time.time()) if timestamp is None else int(timestamp)
+        values = {
+            name: value for name, value in values.items()
+            if isinstance(value, int) and not isinstance(value, bool)
+        }
+        if not values:
+            return
+
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        with locked(self.filename):
+            if (os.path.getsize(self.filename) if os.path.exists(self.filename) else 0) != self._size:
+                self._reload()
+            if timestamp < self._last_time:
+                raise ValueError(f'Sample at {timestamp} is earlier than the last one at {self._last_time}')
+            frame = self._encode(values, timestamp)
+            with open(self.filename, 'ab') as f:
+                if self._size == 0:
+                    f.write(MAGIC)
+                    self._size = len(MAGIC)
+                f.truncate(self._size)
+                f.write(frame)
+            self._size += len(frame)
+
+    def _reload(self) -> None:
+        """Decode the file again, after another process appended to it."""
+        self._ids.clear()
+        self._times.clear()
+        self._values.clear()
+        self._last_time = 0
+        self._size = 0
+        self._load()
+
+    def _encode(
+        self,
+        values: dict[str, int],
+        timestamp: int,
+    ) -> bytes:
+        """Encode a sample frame, preceded by the definitions of new series."""
+        frame = bytearray()
+        samples = bytearray()
+        for name, value in values.items():
+            if name not in self._ids:
+                self._define(name, len(self._ids))
+                encoded = name.encode('utf-8')
+                frame += encode_varint(_DEFINE) + encode_varint(self._ids[name])
+                frame += encode_varint(len(encoded)) + encoded
+            previous = self._values[name][-1] if self._values[name] else 0
+            samples += encode_varint(self._ids[name]) + encode_varint(zigzag(value - previous))
+            self._times[name].append(timestamp)
+            self._values[name].append(value)
+        frame += encode_varint(_SAMPLES) + encode_varint(zigzag(timestamp - self._last_time))
+        frame += encode_varint(len(values)) + samples
+        self._last_time = timestamp
+        return bytes(frame)
+
+    def range(
+        self,
+        name: str,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> list[tuple[int, int]]:
+        """
+        Return the samples of a statistic within a time range.
+
+        Parameters
+        ----------
+        name : str
+            Name of the statistic.
+        start : int | None, optional
+            First Unix time included, unbounded if None (default: None).
+        end : int | None, optional
+            Last Unix time included, unbounded if None (default: None).
+
+        Returns
+        -------
+        list[tuple[int, int]]
+            (timestamp, value) pairs in time order.
+        """
+        times = self._times.get(name, array('q'))
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = len(times) if end is None else bisect.bisect_right(times, end)
+        return list(zip(times[first:last], self._values[name][first:last])) if name in self._values else []
+
+    def downsample(
+        self,
+        name: str,
+        bucket: int,
+        aggregate: str = 'last',
+        start: int | None = None,
+        end: int | None = None,
+    ) -> list[tuple[int, int]]:
+        """
+        Aggregate the samples of a statistic into fixed-width time buckets.
+
+        Parameters
+        ----------
+        name : str
+            Name of the statistic.
+        bucket : int
+            Width of each bucket in seconds, e.g. 86400 for daily values.
+        aggregate : str, optional
+            One of `AGGREGATES` (default: 'last').
+        start : int | None, optional
+            First Unix time included, unbounded if None (default: None).
+        end : int | None, optional
+            Last Unix time included, unbounded if None (default: None).
+
+        Returns
+        -------
+        list[tuple[int, int]]
+            (bucket start, aggregated value) pairs for every non-empty bucket.
+        """
+        reduce = AGGREGATES[aggregate]
+        buckets: dict[int, list[int]] = {}
+        for timestamp, value in self.range(name, start, end):
+            buckets.setdefault(timestamp - timestamp % bucket, []).append(value)
+        return [(bucket_start, reduce(values)) for bucket_start, values in buckets.items()]
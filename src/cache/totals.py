@@ -0,0 +1,268 @@
+"""Materialized running totals of the repository cache."""
+
+import json
+import os
+
+from dataclasses import asdict, dataclass, field
+
+from utils.fileio import atomic_write
+
+# Row flags, stored in the flags word of binary records and as a trailing tag in text rows.
+ARCHIVED: int = 1       # imported from the repository archive, never recrawled nor dropped
+UNATTRIBUTED: int = 2   # archived commits that belong to no known repository
+ROW_TAGS: dict[int, str] = {
+    ARCHIVED: 'archived',
+    ARCHIVED | UNATTRIBUTED: 'archived-unattributed',
+}
+
+
+@dataclass
+class Totals:
+    """
+    Running totals over every row of a repository cache.
+
+    The totals are updated incrementally as rows change and stored next to the
+    cache, so the headline numbers can be read without scanning the cache.
+
+    Attributes
+    ----------
+    total_commits : int
+        Sum of the total commit count of every repository.
+    my_commits : int
+        Sum of the commits authored by the user.
+    added : int
+        Sum of the lines of code added by the user.
+    deleted : int
+        Sum of the lines of code deleted by the user.
+    repos : int
+        Number of cached repositories.
+    affiliations : dict[str, int]
+        Number of repositories found for each queried owner affiliation set.
+    archived_commits : int
+        Commits authored by the user in archived repositories.
+    archived_added : int
+        Lines of code added by the user in archived repositories.
+    archived_deleted : int
+        Lines of code deleted by the user in archived repositories.
+    archived_repos : int
+        Number of archived repositories.
+    archive_sha256 : str
+        Digest of the archive file that was imported, empty if none was.
+    source_size : int
+        Size in bytes of the cache file the totals were computed from.
+    source_mtime_ns : int
+        Modification time of the cache file the totals were computed from.
+    """
+
+    total_commits:      int = 0
+    my_commits:         int = 0
+    added:              int = 0
+    deleted:            int = 0
+    repos:              int = 0
+    affiliations:       dict[str, int] = field(default_factory=dict)
+    archived_commits:   int = 0
+    archived_added:     int = 0
+    archived_deleted:   int = 0
+    archived_repos:     int = 0
+    archive_sha256:     str = ''
+    source_size:        int = 0
+    source_mtime_ns:    int = 0
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: list[tuple[int, ...]],
+    ) -> 'Totals':
+        """
+        Compute the totals with a full scan of the cache rows.
+
+        Parameters
+        ----------
+        rows : list[tuple[int, ...]]
+            Total commits, my commits, LOC added, LOC deleted and, optionally,
+            the row flags of every row.
+
+        Returns
+        -------
+        Totals
+            The totals of the given rows.
+        """
+        totals = cls()
+        for row in rows:
+            totals.add_row(row[:4], row[4] if len(row) > 4 else 0)
+        return totals
+
+    def add_row(
+        self,
+        row: tuple[int, int, int, int],
+        flags: int = 0,
+    ) -> None:
+        """
+        Account for a new cache row.
+
+        Archived rows only count towards the archived totals.
+
+        Parameters
+        ----------
+        row : tuple[int, int, int, int]
+            Total commits, my commits, LOC added and LOC deleted.
+        flags : int, optional
+            Row flags (default: 0).
+
+        Returns
+        -------
+        None
+        """
+        if flags & ARCHIVED:
+            self.archived_commits += row[1]
+            self.archived_added += row[2]
+            self.archived_deleted += row[3]
+            self.archived_repos += 0 if flags & UNATTRIBUTED else 1
+            return
+
+        self.total_commits += row[0]
+        self.my_commits += row[1]
+        self.added += row[2]
+        self.deleted += row[3]
+        self.repos += 1
+
+    def replace_row(
+        self,
+        old: tuple[int, int, int, int],
+        new: tuple[int, int, int, int],
+    ) -> None:
+        """
+        Apply the difference between the old and the new values of a row.
+
+        Parameters
+        ----------
+        old : tuple[int, int, int, int]
+            Previous total commits, my commits, LOC added and LOC deleted.
+        new : tuple[int, int, int, int]
+            Updated total commits, my commits, LOC added and LOC deleted.
+
+        Returns
+        -------
+        None
+        """
+        self.total_commits += new[0] - old[0]
+        self.my_commits += new[1] - old[1]
+        self.added += new[2] - old[2]
+        self.deleted += new[3] - old[3]
+
+    def matches(
+        self,
+        source: str,
+    ) -> bool:
+        """
+        Check whether the totals still describe the given cache file.
+
+        Parameters
+        ----------
+        source : str
+            Path to the cache file.
+
+        Returns
+        -------
+        bool
+            True if the cache file has not changed since the totals were saved.
+        """
+        try:
+            stat = os.stat(source)
+        except FileNotFoundError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (self.source_size, self.source_mtime_ns)
+
+    def save(
+        self,
+        filename: str,
+        source: str,
+    ) -> None:
+        """
+        Store the totals, stamped with the current state of the cache file.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the totals file.
+        source : str
+            Path to the cache file the totals describe.
+
+        Returns
+        -------
+        None
+        """
+        stat = os.stat(source)
+        self.source_size = stat.st_size
+        self.source_mtime_ns = stat.st_mtime_ns
+        atomic_write(filename, json.dumps(asdict(self), indent=4, sort_keys=True))
+
+    @classmethod
+    def load(
+        cls,
+        filename: str,
+        source: str,
+    ) -> 'Totals | None':
+        """
+        Load the stored totals if they are up to date with the cache file.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the totals file.
+        source : str
+            Path to the cache file the totals describe.
+
+        Returns
+        -------
+        Totals | None
+            The stored totals, or None if they are missing or stale.
+        """
+        try:
+            with open(filename, 'r') as f:
+                totals = cls(**json.load(f))
+        except (FileNotFoundError, TypeError, ValueError):
+            return None
+        return totals if totals.matches(source) else None
+
+
+def row_counts(
+    line: str,
+) -> tuple[int, int, int, int]:
+    """
+    Parse the counters of a text cache row.
+
+    Parameters
+    ----------
+    line : str
+        A cache row: hash, total commits, my commits, LOC added and LOC deleted.
+
+    Returns
+    -------
+    tuple[int, int, int, int]
+        Total commits, my commits, LOC added and LOC deleted.
+    """
+    _, total_commits, my_commits, added, deleted, *__ = line.split()
+    return int(total_commits), int(my_commits), int(added), int(deleted)
+
+
+def row_flags(
+    line: str,
+) -> int:
+    """
+    Parse the flags of a text cache row from its optional trailing tag.
+
+    Parameters
+    ----------
+    line : str
+        A cache row, optionally followed by one of the `ROW_TAGS`.
+
+    Returns
+    -------
+    int
+        The row flags, 0 for untagged rows.
+    """
+    tokens = line.split()
+    if len(tokens) < 6:
+        return 0
+    return next((flags for flags, tag in ROW_TAGS.items() if tag == tokens[5]), 0)
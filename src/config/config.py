@@ -2,8 +2,7 @@
 
 from datetime import datetime
 from dataclasses import dataclass, field
-
-from dataclass_wizard import YAMLWizard
+from pathlib import Path
 
 
 @dataclass
@@ -111,11 +110,12 @@ class Contact:
 
 
 @dataclass
-class ConfigParser(YAMLWizard):
+class ConfigParser:
     """
     A dataclass for parsing and storing configuration data.
 
-    Inherits from YAMLWizard to enable YAML serialization/deserialization.
+    YAML is deserialized with dataclass_wizard, which is only imported when a
+    file is actually parsed: configurations loaded from snapshots never need it.
 
     Attributes
     ----------
@@ -133,3 +133,46 @@ class ConfigParser(YAMLWizard):
     languages:  Languages
     activities: Activities
     contact:    Contact
+
+    @classmethod
+    def from_yaml(
+        cls,
+        text: str,
+    ) -> 'ConfigParser':
+        """
+        Parse a YAML document into a configuration.
+
+        Parameters
+        ----------
+        text : str
+            The YAML document.
+
+        Returns
+        -------
+        ConfigParser
+            The parsed configuration.
+        """
+        import yaml
+        from dataclass_wizard import fromdict
+
+        return fromdict(cls, yaml.safe_load(text))
+
+    @classmethod
+    def from_yaml_file(
+        cls,
+        file: str | Path,
+    ) -> 'ConfigParser':
+        """
+        Parse a YAML file into a configuration.
+
+        Parameters
+        ----------
+        file : str | Path
+            Path of the YAML file.
+
+        Returns
+        -------
+        ConfigParser
+            The parsed configuration.
+        """
+        return cls.from_yaml(Path(file).read_text())
@@ -1,11 +1,17 @@
 """Environment configuration module using pydantic-settings for validation and loading."""
 
-from typing import Literal
+import threading
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Literal
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 EnvType = Literal["development", "production"]
+CacheFormat = Literal["text", "binary"]
 
 
 class EnvConfig(BaseSettings):
@@ -35,6 +41,22 @@ class EnvConfig(BaseSettings):
         default="production",
         description="Runtime environment",
     )
+    CACHE_FORMAT: CacheFormat = Field(
+        default="text",
+        description="Storage format of the repository LOC cache",
+    )
+    SHARED_CACHE_ADDRESS: str | None = Field(
+        default=None,
+        description="host:port of the shared cache server used by all workers",
+    )
+    SHARED_CACHE_AUTHKEY: str = Field(
+        default="github-profile-stats",
+        description="Key presented to the shared cache server",
+    )
+    RESPONSE_CACHE_TTL: int = Field(
+        default=600,
+        description="Seconds GitHub GraphQL responses are reused for",
+    )
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -71,3 +93,91 @@ class EnvConfig(BaseSettings):
             Dictionary representation of the configuration.
         """
         return self.model_dump()
+
+
+_settings: EnvConfig | None = None
+_settings_lock = threading.Lock()
+_override: ContextVar[EnvConfig | None] = ContextVar('settings_override', default=None)
+
+
+def settings() -> EnvConfig:
+    """
+    Return the settings in effect for the caller.
+
+    Inside an `override_settings` block these are the overriding settings.
+    Otherwise they are the process-wide settings, read from the environment
+    and the `.env` file on the first call only.
+
+    Returns
+    -------
+    EnvConfig
+        The current settings.
+
+    Raises
+    ------
+    ValidationError
+        If the environment is read and required values are missing or invalid.
+    """
+    override = _override.get()
+    if override is not None:
+        return override
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = EnvConfig.from_env()
+    return _settings
+
+
+def configure(
+    config: EnvConfig | None,
+) -> None:
+    """
+    Replace the process-wide settings.
+
+    Parameters
+    ----------
+    config : EnvConfig | None
+        The new settings, or None to read the environment again on next use.
+
+    Returns
+    -------
+    None
+    """
+    global _settings
+    with _settings_lock:
+        _settings = config
+
+
+@contextmanager
+def override_settings(
+    config: EnvConfig | None = None,
+    **values: Any,
+) -> Iterator[EnvConfig]:
+    """
+    Use other settings for the duration of the block, e.g. to serve another user.
+
+    The override is bound to the current thread or task only, so concurrent
+    runs can each use their own credentials. Work handed to an executor keeps
+    it when submitted through `contextvars.copy_context().run`.
+
+    Parameters
+    ----------
+    config : EnvConfig | None, optional
+        The settings to use, the current ones if None (default: None).
+    **values : Any
+        Fields replaced in those settings, e.g. USER_NAME and ACCESS_TOKEN.
+
+    Returns
+    -------
+    Iterator[EnvConfig]
+        Context manager yielding the settings in effect in the block.
+    """
+    config = config or settings()
+    if values:
+        config = config.model_copy(update=values)
+    token = _override.set(config)
+    try:
+        yield config
+    finally:
+        _override.reset(token)
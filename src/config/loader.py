@@ -0,0 +1,163 @@
+"""Configuration loader keeping compiled snapshots of the parsed YAML files."""
+
+import dataclasses
+import hashlib
+import os
+import pickle
+
+from pathlib import Path
+
+from config.config import Activities, ConfigParser, Contact, Languages, User
+from utils import trace
+from utils.fileio import atomic_write, locked
+
+CONFIG_CACHE_DIR = 'cache/config'
+# Bumped whenever snapshots must not be reused, beyond changes to the dataclasses
+SNAPSHOT_VERSION = 1
+
+
+def _schema() -> str:
+    """Return a description of the configuration dataclasses, part of every snapshot."""
+    return repr([
+        (cls.__name__, [(field.name, str(field.type)) for field in dataclasses.fields(cls)])
+        for cls in (ConfigParser, User, Languages, Activities, Contact)
+    ])
+
+
+def snapshot_filename(
+    path: str | Path,
+    directory: str = CONFIG_CACHE_DIR,
+) -> str:
+    """
+    Return the path of the snapshot of a configuration file.
+
+    Parameters
+    ----------
+    path : str | Path
+        Path of the YAML configuration file.
+    directory : str, optional
+        Directory of the snapshots (default: 'cache/config').
+
+    Returns
+    -------
+    str
+        Snapshot path, named after the hash of the absolute path of the file.
+    """
+    digest = hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(directory, digest[:16] + '.pickle')
+
+
+@trace.span('load_config')
+def load_config(
+    path: str | Path,
+    directory: str = CONFIG_CACHE_DIR,
+) -> ConfigParser:
+    """
+    Load a configuration file, from its snapshot when the YAML did not change.
+
+    The snapshot of a file holds its path, modification time and SHA-256 along
+    with the pickled `ConfigParser`. It is used as is while the modification
+    time matches, and after checking the hash otherwise, e.g. in a fresh
+    checkout. Anything else parses the YAML and stores a new snapshot.
+
+    Parameters
+    ----------
+    path : str | Path
+        Path of the YAML configuration file.
+    directory : str, optional
+        Directory of the snapshots (default: 'cache/config').
+
+    Returns
+    -------
+    ConfigParser
+        The parsed configuration.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the configuration file does not exist.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    filename = snapshot_filename(path, directory)
+    stored = None
+    try:
+        with open(filename, 'rb') as f:
+            stored = pickle.load(f)
+        version, schema, stored_path, mtime_ns, digest, config = stored
+        if version == SNAPSHOT_VERSION and schema == _schema() and stored_path == path:
+            if mtime_ns == stat.st_mtime_ns:
+                return config
+        else:
+            stored = None
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError):
+        stored = None
+
+    data = Path(path).read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    if stored is not None and stored[4] == digest:
+        config = stored[5]
+    else:
+        config = ConfigParser.from_yaml(data.decode('utf-8'))
+
+    os.makedirs(directory, exist_ok=True)
+    with locked(filename):
+        atomic_write(filename, pickle.dumps((SNAPSHOT_VERSION, _schema(), path, stat.st_mtime_ns, digest, config)))
+    return config
+
+
+def load_configs(
+    paths: list[str | Path],
+    directory: str = CONFIG_CACHE_DIR,
+    max_workers: int | None = None,
+) -> list[ConfigParser]:
+    """
+    Load many configuration files, parsing the changed ones in parallel.
+
+    Files with an up-to-date snapshot are loaded in this process. The others
+    are parsed by a pool of processes, since YAML parsing is CPU-bound.
+
+    Parameters
+    ----------
+    paths : list[str | Path]
+        Paths of the YAML configuration files.
+    directory : str, optional
+        Directory of the snapshots (default: 'cache/config').
+    max_workers : int | None, optional
+        Size of the process pool, the number of CPUs if None (default: None).
+
+    Returns
+    -------
+    list[ConfigParser]
+        The configurations, in the order of `paths`.
+
+    Raises
+    ------
+    FileNotFoundError
+        If a configuration file does not exist.
+    """
+    configs: list[ConfigParser | None] = [None] * len(paths)
+    stale = []
+    for i, path in enumerate(paths):
+        try:
+            with open(snapshot_filename(path, directory), 'rb') as f:
+                version, schema, stored_path, mtime_ns, _, config = pickle.load(f)
+            if (version, schema, stored_path, mtime_ns) == (
+                SNAPSHOT_VERSION, _schema(), os.path.abspath(path), os.stat(path).st_mtime_ns
+            ):
+                configs[i] = config
+                continue
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError):
+            pass
+        stale.append(i)
+
+    if len(stale) == 1:
+        configs[stale[0]] = load_config(paths[stale[0]], directory)
+    elif stale:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for i, config in zip(stale, executor.map(load_config, [paths[i] for i in stale],
+                                                     [directory] * len(stale))):
+                configs[i] = config
+    return configs
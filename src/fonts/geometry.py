@@ -0,0 +1,170 @@
+"""Geometry of the characters the bundled JetBrains Mono lacks, shared by the outline and subset modes."""
+
+import re
+
+# Bumped whenever a shape changes, so cached outlines and subsets are rebuilt
+GEOMETRY_VERSION = 1
+
+# Box-drawing characters the bundled font lacks, drawn as geometry instead.
+# Weight of the left, right, up and down arms: 0 none, 1 light, 2 double.
+BOX_ARMS: dict[int, tuple[int, int, int, int]] = {
+    0x2500: (1, 1, 0, 0),   # ─
+    0x2502: (0, 0, 1, 1),   # │
+    0x250C: (0, 1, 0, 1),   # ┌
+    0x2510: (1, 0, 0, 1),   # ┐
+    0x2514: (0, 1, 1, 0),   # └
+    0x2518: (1, 0, 1, 0),   # ┘
+    0x251C: (0, 1, 1, 1),   # ├
+    0x2524: (1, 0, 1, 1),   # ┤
+    0x252C: (1, 1, 0, 1),   # ┬
+    0x2534: (1, 1, 1, 0),   # ┴
+    0x253C: (1, 1, 1, 1),   # ┼
+    0x2550: (2, 2, 0, 0),   # ═
+    0x2551: (0, 0, 2, 2),   # ║
+    0x2554: (0, 2, 0, 2),   # ╔
+    0x2557: (2, 0, 0, 2),   # ╗
+    0x255A: (0, 2, 2, 0),   # ╚
+    0x255D: (2, 0, 2, 0),   # ╝
+}
+# Block elements: left, bottom, right and top of the filled area as fractions of the cell.
+BLOCKS: dict[int, tuple[float, float, float, float]] = {
+    0x2580: (0.0, 0.5, 1.0, 1.0),   # ▀
+    0x2584: (0.0, 0.0, 1.0, 0.5),   # ▄
+    0x2588: (0.0, 0.0, 1.0, 1.0),   # █
+    0x258C: (0.0, 0.0, 0.5, 1.0),   # ▌
+    0x2590: (0.5, 0.0, 1.0, 1.0),   # ▐
+}
+# Chevrons: outline as (x, y) fractions of the advance and of the em around the middle of the cell.
+CHEVRONS: dict[int, tuple[tuple[float, float], ...]] = {
+    0x276F: ((0.18, 0.3), (0.58, 0.0), (0.18, -0.3), (0.42, -0.3), (0.82, 0.0), (0.42, 0.3)),   # ❯
+}
+
+_COMMAND = re.compile(r'([MLHVZ])([^MLHVZ]*)')
+
+
+def _rect(
+    left: float,
+    bottom: float,
+    right: float,
+    top: float,
+) -> str:
+    """Return the path of a rectangle, in font units."""
+    return f'M{left:g} {bottom:g}H{right:g}V{top:g}H{left:g}Z'
+
+
+def _box(
+    metrics: dict[str, int],
+    left: int,
+    right: int,
+    up: int,
+    down: int,
+) -> str:
+    """Draw a box-drawing character from the weights of its arms."""
+    width = metrics['advance']
+    low, high = metrics['descender'], metrics['ascender']
+    cx, cy = width / 2, (low + high) / 2
+    half = metrics['units_per_em'] * 0.04     # half of the stroke width
+    gap = metrics['units_per_em'] * 0.12      # offset of the strokes of double lines
+
+    if 2 in (left, right, up, down):
+        if not (up or down):
+            return _rect(0, cy - gap - half, width, cy - gap + half) + _rect(0, cy + gap - half, width, cy + gap + half)
+        if not (left or right):
+            return _rect(cx - gap - half, low, cx - gap + half, high) + _rect(cx + gap - half, low, cx + gap + half, high)
+        # double corner: the outer stroke wraps around the inner one
+        hx = 1 if right else -1
+        vy = 1 if up else -1
+        edge_x = width if right else 0
+        edge_y = high if up else low
+        paths = []
+        for offset in (-gap, gap):
+            x, y = cx + hx * offset, cy + vy * offset
+            paths.append(_rect(min(x - hx * half, edge_x), y - half, max(x - hx * half, edge_x), y + half))
+            paths.append(_rect(x - half, min(y - vy * half, edge_y), x + half, max(y - vy * half, edge_y)))
+        return ''.join(paths)
+
+    paths = []
+    if left:
+        paths.append(_rect(0, cy - half, cx + half, cy + half))
+    if right:
+        paths.append(_rect(cx - half, cy - half, width, cy + half))
+    if up:
+        paths.append(_rect(cx - half, cy - half, cx + half, high))
+    if down:
+        paths.append(_rect(cx - half, low, cx + half, cy + half))
+    return ''.join(paths)
+
+
+def synthetic_outline(
+    codepoint: int,
+    metrics: dict[str, int],
+) -> str | None:
+    """
+    Return the outline drawn for a character the font lacks.
+
+    Box-drawing and block characters fill the whole line cell, so they join
+    up across lines.
+
+    Parameters
+    ----------
+    codepoint : int
+        The character
+    metrics : dict[str, int]
+        'units_per_em', 'ascender', 'descender' and 'advance' of the font
+
+    Returns
+    -------
+    str | None
+        SVG path data in font units, y axis up, with counter-clockwise
+        contours, or None if the character has no synthetic shape
+    """
+    if codepoint in BOX_ARMS:
+        return _box(metrics, *BOX_ARMS[codepoint])
+    width = metrics['advance']
+    low, high = metrics['descender'], metrics['ascender']
+    if codepoint in BLOCKS:
+        left, bottom, right, top = BLOCKS[codepoint]
+        return _rect(left * width, low + bottom * (high - low), right * width, low + top * (high - low))
+    if codepoint in CHEVRONS:
+        cy = (low + high) / 2
+        em = metrics['units_per_em']
+        points = [f'{x * width:g} {cy + y * em:g}' for x, y in CHEVRONS[codepoint]]
+        return 'M' + 'L'.join(points) + 'Z'
+    return None
+
+
+def draw_path(
+    path: str,
+    pen,
+) -> None:
+    """
+    Draw path data made of M, L, H, V and Z commands with a fontTools pen.
+
+    Parameters
+    ----------
+    path : str
+        Absolute path data, as returned by `synthetic_outline`
+    pen : fontTools.pens.basePen.AbstractPen
+        Pen receiving the contours
+
+    Returns
+    -------
+    None
+    """
+    x = y = 0.0
+    for command, operands in _COMMAND.findall(path):
+        values = [float(value) for value in operands.replace(',', ' ').split()]
+        if command == 'M':
+            x, y = values
+            pen.moveTo((x, y))
+        elif command == 'L':
+            x, y = values
+            pen.lineTo((x, y))
+        elif command == 'H':
+            x = values[0]
+            pen.lineTo((x, y))
+        elif command == 'V':
+            y = values[0]
+            pen.lineTo((x, y))
+        else:
+            pen.closePath()
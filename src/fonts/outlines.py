@@ -0,0 +1,123 @@
+"""Glyph outlines of the bundled JetBrains Mono font, for drawing text as paths."""
+
+import io
+import json
+import os
+
+from fonts.geometry import GEOMETRY_VERSION, synthetic_outline
+from fonts.subset import font_data, font_digest
+from utils.fileio import atomic_write, locked
+
+OUTLINE_CACHE_DIR = 'cache/fonts'
+
+
+class GlyphOutlines:
+    """
+    Outlines and advances of the glyphs of the bundled JetBrains Mono.
+
+    Paths are in font units with the y axis pointing up and the origin on the
+    baseline. Outlines are extracted with fontTools on first use and kept in a
+    persistent per-glyph cache, so fontTools is only imported for glyphs that
+    were never drawn before.
+    """
+
+    def __init__(
+        self,
+        directory: str = OUTLINE_CACHE_DIR,
+    ) -> None:
+        """
+        Load the outline cache of the bundled font.
+
+        Parameters
+        ----------
+        directory : str, optional
+            Directory of the outline cache (default is 'cache/fonts')
+        """
+        self.filename:  str = os.path.join(directory, f'outlines-{font_digest()[:16]}-{GEOMETRY_VERSION}.json')
+        self._font = None
+        self._dirty:    bool = False
+        try:
+            with open(self.filename, 'r') as f:
+                stored = json.load(f)
+            self.metrics:   dict[str, int] = stored['metrics']
+            self._glyphs:   dict[str, list | None] = stored['glyphs']
+        except (FileNotFoundError, ValueError, KeyError):
+            font = self._load_font()
+            self.metrics = {
+                'units_per_em': font['head'].unitsPerEm,
+                'ascender': font['hhea'].ascent,
+                'descender': font['hhea'].descent,
+                'advance': font['hmtx'][font.getBestCmap()[ord('M')]][0],
+            }
+            self._glyphs = {}
+            self._dirty = True
+
+    def _load_font(self):
+        if self._font is None:
+            from fontTools.ttLib import TTFont
+            self._font = TTFont(io.BytesIO(font_data()))
+        return self._font
+
+    def glyph(
+        self,
+        char: str,
+    ) -> tuple[int, str] | None:
+        """
+        Return the advance and outline of a character.
+
+        Box-drawing, block and chevron characters missing from the font are
+        drawn as geometry, see `fonts.geometry`.
+
+        Parameters
+        ----------
+        char : str
+            A single character
+
+        Returns
+        -------
+        tuple[int, str] | None
+            Advance width and SVG path data, empty for blank glyphs, or None if
+            the character cannot be drawn
+        """
+        key = str(ord(char))
+        if key not in self._glyphs:
+            self._glyphs[key] = self._extract(ord(char))
+            self._dirty = True
+        glyph = self._glyphs[key]
+        return None if glyph is None else (glyph[0], glyph[1])
+
+    def _extract(
+        self,
+        codepoint: int,
+    ) -> list | None:
+        font = self._load_font()
+        name = font.getBestCmap().get(codepoint)
+        if name is not None:
+            from fontTools.pens.svgPathPen import SVGPathPen
+            glyph_set = font.getGlyphSet()
+            pen = SVGPathPen(glyph_set, ntos=lambda value: f'{value:g}')
+            glyph_set[name].draw(pen)
+            return [font['hmtx'][name][0], pen.getCommands()]
+        path = synthetic_outline(codepoint, self.metrics)
+        return None if path is None else [self.metrics['advance'], path]
+
+    def save(self) -> None:
+        """
+        Store the outlines extracted since the cache was loaded.
+
+        Returns
+        -------
+        None
+        """
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        with locked(self.filename):
+            try:
+                with open(self.filename, 'r') as f:
+                    stored = json.load(f)['glyphs']
+            except (FileNotFoundError, ValueError, KeyError):
+                stored = {}
+            stored.update(self._glyphs)
+            atomic_write(self.filename, json.dumps({'metrics': self.metrics, 'glyphs': stored}))
+        self._dirty = False
@@ -0,0 +1,266 @@
+"""Glyph subsets of the bundled JetBrains Mono font, embedded in the generated SVGs."""
+
+import base64
+import hashlib
+import html
+import io
+import json
+import os
+import re
+
+from collections.abc import Iterable
+from dataclasses import dataclass
+from functools import cache
+
+from fonts.geometry import GEOMETRY_VERSION, draw_path, synthetic_outline
+from utils.fileio import atomic_write, locked
+
+FONT_CACHE_DIR = 'cache/fonts'
+# Not the family name of the real font, so a locally installed JetBrains Mono,
+# which covers more characters, is never replaced by the subset
+FONT_FAMILY = 'JetBrains Mono Subset'
+
+_TEXT = re.compile(r'<text\b.*?</text>', re.S)
+_TAG = re.compile(r'<[^>]*>')
+
+
+@cache
+def font_data() -> bytes:
+    """
+    Return the bundled JetBrains Mono font file.
+
+    The module holding it is only imported on the first call, since it is a
+    large string literal most runs never need.
+
+    Returns
+    -------
+    bytes
+        The font file
+    """
+    from fonts.jetbrainsmono import JETBRAINS_MONO_WOFF2_BASE64
+
+    return base64.b64decode(JETBRAINS_MONO_WOFF2_BASE64)
+
+
+@cache
+def font_digest() -> str:
+    """Return the hex SHA-256 of the base64 text of the bundled font, identifying it in cache keys."""
+    from fonts.jetbrainsmono import JETBRAINS_MONO_WOFF2_BASE64
+
+    return hashlib.sha256(JETBRAINS_MONO_WOFF2_BASE64.encode('ascii')).hexdigest()
+
+
+def used_codepoints(
+    document: str,
+) -> set[int]:
+    """
+    Collect the codepoints of the text drawn by an SVG document or element.
+
+    Only the content of text elements is considered. Control characters,
+    including line breaks, are left out since they are never drawn.
+
+    Parameters
+    ----------
+    document : str
+        SVG document, or any sequence of complete SVG elements
+
+    Returns
+    -------
+    set[int]
+        Codepoints of every drawn character
+    """
+    codepoints = set()
+    for text in _TEXT.findall(document):
+        codepoints.update(map(ord, html.unescape(_TAG.sub('', text))))
+    return {codepoint for codepoint in codepoints if codepoint >= 0x20}
+
+
+@dataclass(frozen=True)
+class FontSubset:
+    """
+    A font holding only the glyphs of a set of codepoints.
+
+    Attributes
+    ----------
+    data : bytes
+        The subset font file
+    flavor : str
+        'woff2' or 'woff', the format of `data`
+    codepoints : frozenset[int]
+        Codepoints covered by the subset
+    missing : frozenset[int]
+        Requested codepoints the font has no glyph for
+    """
+
+    data:       bytes
+    flavor:     str
+    codepoints: frozenset[int]
+    missing:    frozenset[int]
+
+    def css(
+        self,
+        family: str = FONT_FAMILY,
+    ) -> str:
+        """
+        Return the @font-face rule embedding the subset.
+
+        Parameters
+        ----------
+        family : str, optional
+            Font family name the rule declares (default is 'JetBrains Mono Subset')
+
+        Returns
+        -------
+        str
+            The CSS rule, with the font inlined as a data URL
+        """
+        encoded = base64.b64encode(self.data).decode('ascii')
+        return (f"@font-face{{font-family:'{family}';"
+                f"src:url(data:font/{self.flavor};base64,{encoded}) format('{self.flavor}')}}")
+
+
+def _flavor() -> str:
+    """Return the best web font format that can be written here."""
+    try:
+        import brotli  # noqa: F401, needed by fontTools to write WOFF2
+    except ImportError:
+        try:
+            import brotlicffi  # noqa: F401
+        except ImportError:
+            return 'woff'
+    return 'woff2'
+
+
+def _add_synthetic_glyphs(
+    font,
+    outlines: dict[int, str],
+    advance: int,
+) -> None:
+    """
+    Add glyphs drawn from path data to a TrueType font and map them in its cmap.
+
+    Parameters
+    ----------
+    font : fontTools.ttLib.TTFont
+        The font, modified in place
+    outlines : dict[int, str]
+        Codepoint to path data in font units, as returned by `synthetic_outline`
+    advance : int
+        Advance width of the glyphs, the cell width of the monospaced font
+
+    Returns
+    -------
+    None
+    """
+    from fontTools.pens.reverseContourPen import ReverseContourPen
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    order = font.getGlyphOrder()
+    for codepoint, path in sorted(outlines.items()):
+        name = f'uni{codepoint:04X}'
+        pen = TTGlyphPen(None)
+        # the paths wind counter-clockwise, TrueType outer contours go clockwise
+        draw_path(path, ReverseContourPen(pen))
+        glyph = pen.glyph()
+        glyph.recalcBounds(font['glyf'])
+        order.append(name)
+        font['glyf'].glyphs[name] = glyph
+        font['hmtx'][name] = (advance, glyph.xMin)
+        for table in font['cmap'].tables:
+            if table.isUnicode():
+                table.cmap[codepoint] = name
+    font.setGlyphOrder(order)
+
+
+def subset_font(
+    codepoints: Iterable[int],
+    directory: str = FONT_CACHE_DIR,
+) -> FontSubset:
+    """
+    Build a subset of the bundled JetBrains Mono for the given codepoints.
+
+    Subsets are cached in `directory` by the hash of the glyph set, the font
+    and the output format, so each set of glyphs is only subset once and
+    fontTools is only imported on a cache miss. Box-drawing, block and chevron
+    characters the font lacks are added as the shapes of `fonts.geometry`.
+
+    Parameters
+    ----------
+    codepoints : Iterable[int]
+        Codepoints that must be drawn with the font
+    directory : str, optional
+        Directory of the cached subsets (default is 'cache/fonts')
+
+    Returns
+    -------
+    FontSubset
+        The subset, whose `missing` lists the codepoints the font cannot draw
+
+    Raises
+    ------
+    ImportError
+        If fontTools is not installed
+    """
+    requested = sorted(set(codepoints))
+    flavor = _flavor()
+    key = hashlib.sha256('|'.join([
+        font_digest(),
+        str(GEOMETRY_VERSION),
+        flavor,
+        ','.join(map(str, requested)),
+    ]).encode('ascii')).hexdigest()
+    filename = os.path.join(directory, key + '.json')
+    try:
+        with open(filename, 'r') as f:
+            stored = json.load(f)
+        return FontSubset(
+            base64.b64decode(stored['data']), stored['flavor'],
+            frozenset(stored['codepoints']), frozenset(stored['missing'])
+        )
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    # keep the timestamp of the bundled font, so a subset is the same bytes on every run
+    font = TTFont(io.BytesIO(font_data()), recalcTimestamp=False)
+    cmap = font.getBestCmap()
+    metrics = {
+        'units_per_em': font['head'].unitsPerEm,
+        'ascender': font['hhea'].ascent,
+        'descender': font['hhea'].descent,
+        'advance': font['hmtx'][cmap[ord('M')]][0],
+    }
+    synthetic = {}
+    for code in requested:
+        if code not in cmap and (path := synthetic_outline(code, metrics)) is not None:
+            synthetic[code] = path
+    _add_synthetic_glyphs(font, synthetic, metrics['advance'])
+    available = set(font.getBestCmap())
+    covered = frozenset(code for code in requested if code in available)
+    missing = frozenset(code for code in requested if code not in available)
+
+    options = subset.Options()
+    options.flavor = flavor
+    options.layout_features = []    # no ligatures nor alternates, the text is drawn as is
+    options.name_IDs = [1, 2]       # family and style names only
+    options.hinting = False
+    options.notdef_outline = True
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=covered)
+    subsetter.subset(font)
+    output = io.BytesIO()
+    font.flavor = flavor
+    font.save(output)
+    result = FontSubset(output.getvalue(), flavor, covered, missing)
+
+    os.makedirs(directory, exist_ok=True)
+    with locked(filename):
+        atomic_write(filename, json.dumps({
+            'flavor': flavor,
+            'codepoints': sorted(covered),
+            'missing': sorted(missing),
+            'data': base64.b64encode(result.data).decode('ascii'),
+        }))
+    return result
@@ -1,20 +1,24 @@
 """GitHub API query module for fetching user statistics and repository data."""
 
 import hashlib
-import requests
+import json
+import threading
 
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import Any
 
 from cache import cache
-from config.environment import EnvConfig
+from utils import trace
+from utils.fileio import atomic_write, locked
+from utils.lazy import lazy_import
 
-env = EnvConfig.from_env()
+# loaded on the first request, importing them costs more than most cached runs take
+environment = lazy_import('config.environment')
+requests = lazy_import('requests')
 
-HEADERS: dict[str, str] = {
-    'Authorization': 'token ' + env.ACCESS_TOKEN,
-    'User-Agent': 'github-profile-stats/1.0'
-}
-USER_NAME: str = env.USER_NAME
+USER_AGENT: str = 'github-profile-stats/1.0'
 OUTPUT_PATH: str = "output/"
 QUERY_COUNT: dict[str, int] = {
     'user_getter': 0,
@@ -24,9 +28,28 @@ QUERY_COUNT: dict[str, int] = {
     'graph_commits': 0,
     'loc_query': 0
 }
-OWNER_ID: str = ''
+# GitHub node id of every user name seen, see `owner_id`
+_OWNER_IDS: dict[str, dict[str, str]] = {}
+_OWNER_IDS_LOCK = threading.Lock()
 
 REQUEST_TIMEOUT: tuple[int, int] = (5, 30)  # connect, read
+# False while revalidating: responses are fetched from GitHub, then cached
+_USE_RESPONSE_CACHE: ContextVar[bool] = ContextVar('use_response_cache', default=True)
+
+
+def headers() -> dict[str, str]:
+    """
+    Returns the headers of a GitHub API request for the current settings.
+
+    Returns
+    -------
+    dict[str, str]
+        Authorization and User-Agent headers
+    """
+    return {
+        'Authorization': 'token ' + environment.settings().ACCESS_TOKEN,
+        'User-Agent': USER_AGENT
+    }
 
 
 def get_query_count() -> dict[str, int]:
@@ -41,19 +64,25 @@ def get_query_count() -> dict[str, int]:
     return QUERY_COUNT
 
 
-def set_owner_id(
-    new_OWNER_ID: str,
-) -> None:
+def owner_id() -> dict[str, str]:
     """
-    Sets the global OWNER_ID variable to the specified user ID.
+    Returns the GitHub id of the user of the current settings.
 
-    Parameters
-    ----------
-    new_OWNER_ID : str
-        The user ID to set as the global OWNER_ID.
+    The id is looked up once per USER_NAME and kept for the process, so runs
+    for several users under `override_settings` each count their own commits.
+
+    Returns
+    -------
+    dict[str, str]
+        The user id as it appears in the author of a commit: {'id': ...}
     """
-    global OWNER_ID
-    OWNER_ID = new_OWNER_ID
+    user_name = environment.settings().USER_NAME
+    with _OWNER_IDS_LOCK:
+        if user_name in _OWNER_IDS:
+            return _OWNER_IDS[user_name]
+    user_id, _ = user_getter(user_name)
+    with _OWNER_IDS_LOCK:
+        return _OWNER_IDS.setdefault(user_name, user_id)
 
 
 def query_count(
@@ -87,21 +116,88 @@ def force_close_file(
     cache_comment : list[str]
         The comment block to prepend to the data.
     """
-    filename = 'cache/' + hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest() + '.txt'
-    with open(filename, 'w') as f:
-        f.writelines(cache_comment)
-        f.writelines(data)
+    filename = cache.cache_filename()
+    with locked(filename):
+        atomic_write(filename, ''.join(cache_comment + data))
     print('There was an error while writing to the cache file. The file,', filename, 'has had the partial data saved and closed.')
 
 
+class CachedResponse:
+    """
+    Successful GraphQL response replayed from the shared cache.
+
+    Provides the subset of `requests.Response` used by the query functions.
+    """
+
+    status_code: int = 200
+
+    def __init__(
+        self,
+        payload: dict[str, Any],
+    ) -> None:
+        self._payload: dict[str, Any] = payload
+        self.text: str = json.dumps(payload)
+
+    def json(self) -> dict[str, Any]:
+        return self._payload
+
+
+@contextmanager
+def response_cache_bypassed() -> Iterator[None]:
+    """
+    Send the GraphQL requests made in the block to GitHub, even if a response is cached.
+
+    The fresh responses still replace the cached ones. The setting follows the
+    context, so it also applies to workers started with a copy of it.
+
+    Returns
+    -------
+    Iterator[None]
+        Context manager bypassing the response cache
+    """
+    token = _USE_RESPONSE_CACHE.set(False)
+    try:
+        yield
+    finally:
+        _USE_RESPONSE_CACHE.reset(token)
+
+
+def revalidate(
+    func: Callable[..., Any],
+    *args: Any,
+) -> Any:
+    """
+    Call a query function with the response cache bypassed, see `response_cache_bypassed`.
+
+    Parameters
+    ----------
+    func : Callable[..., Any]
+        The query function, e.g. follower_getter.
+    *args : Any
+        Arguments passed to `func`.
+
+    Returns
+    -------
+    Any
+        The result of `func`.
+    """
+    with response_cache_bypassed():
+        return func(*args)
+
+
 def simple_request(
     func_name: str,
     query: str,
     variables: dict[str, str | None],
-) -> requests.Response:
+    use_cache: bool | None = None,
+) -> 'requests.Response | CachedResponse':
     """
     Sends a GraphQL request to the GitHub API and returns the response.
 
+    Successful responses are stored in the shared cache for RESPONSE_CACHE_TTL
+    seconds, so identical queries from any worker on the host are answered
+    without contacting GitHub.
+
     Parameters
     ----------
     func_name : str
@@ -110,10 +206,13 @@ def simple_request(
         The GraphQL query to send.
     variables : dict[str, str | None]
         The variables to include with the query.
+    use_cache : bool | None, optional
+        Whether a cached response may be returned, False to always ask GitHub.
+        None follows `response_cache_bypassed` (default: None).
 
     Returns
     -------
-    requests.Response
+    requests.Response | CachedResponse
         The response from the GitHub API.
 
     Raises
@@ -121,13 +220,28 @@ def simple_request(
     Exception
         If the request fails with a non-200 status code.
     """
-    request = requests.post(
-        'https://api.github.com/graphql',
-        json={'query': query, 'variables': variables},
-        headers=HEADERS,
-        timeout=REQUEST_TIMEOUT
-    )
+    # responses depend on what the token may see, so each token has its own entries
+    token = hashlib.sha256(environment.settings().ACCESS_TOKEN.encode('utf-8')).hexdigest()
+    key = 'graphql:' + hashlib.sha256(
+        json.dumps({'query': query, 'variables': variables, 'token': token}, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+    if use_cache is None:
+        use_cache = _USE_RESPONSE_CACHE.get()
+    with trace.span('graphql', query=func_name) as current:
+        payload = cache.shared_cache().get(key) if use_cache else None
+        if payload is not None:
+            if current is not None:
+                current.args['cached'] = True
+            return CachedResponse(payload)
+
+        request = requests.post(
+            'https://api.github.com/graphql',
+            json={'query': query, 'variables': variables},
+            headers=headers(),
+            timeout=REQUEST_TIMEOUT
+        )
     if request.status_code == 200:
+        cache.shared_cache().set(key, request.json())
         return request
     raise Exception(func_name, ' has failed with a', request.status_code, request.text, QUERY_COUNT)
 
@@ -162,7 +276,7 @@ def graph_commits(
             }
         }
     }'''
-    variables = {'start_date': start_date, 'end_date': end_date, 'login': USER_NAME}
+    variables = {'start_date': start_date, 'end_date': end_date, 'login': environment.settings().USER_NAME}
     request = simple_request(graph_commits.__name__, query, variables)
     return int(request.json()['data']['user']['contributionsCollection']['contributionCalendar']['totalContributions'])
 
@@ -218,7 +332,7 @@ def graph_repos_stars(
             }
         }
     }'''
-    variables = {'owner_affiliation': owner_affiliation, 'login': USER_NAME, 'cursor': cursor}
+    variables = {'owner_affiliation': owner_affiliation, 'login': environment.settings().USER_NAME, 'cursor': cursor}
     request = simple_request(graph_repos_stars.__name__, query, variables)
     if request.status_code == 200:
         if count_type == 'repos':
@@ -231,12 +345,13 @@ def graph_repos_stars(
 def recursive_loc(
     owner: str,
     repo_name: str,
-    data: list[str],
+    data: list[str] | None,
     cache_comment: list[str],
     addition_total: int = 0,
     deletion_total: int = 0,
     my_commits: int = 0,
     cursor: str | None = None,
+    author: dict[str, str] | None = None,
 ) -> tuple[int, int, int] | None:
     """
     Uses GitHub's GraphQL v4 API and cursor pagination to fetch 100 commits from a repository at a time.
@@ -247,8 +362,8 @@ def recursive_loc(
         The owner of the repository.
     repo_name : str
         The name of the repository.
-    data : list[str]
-        The data being processed.
+    data : list[str] | None
+        The cache rows being processed, or None if there is no text cache to save on failure.
     cache_comment : list[str]
         The comment block to prepend to the data.
     addition_total : int, optional
@@ -259,12 +374,17 @@ def recursive_loc(
         Number of commits authored by the user (default: 0).
     cursor : str | None, optional
         Cursor for pagination (default: None).
+    author : dict[str, str] | None, optional
+        Id of the user whose commits are counted, the user of the current
+        settings if None, see `owner_id` (default: None).
 
     Returns
     -------
     tuple[int, int, int] | None
         A tuple containing the total additions, deletions, and commits authored by the user, or None if the request fails.
     """
+    if author is None:
+        author = owner_id()
     query_count('recursive_loc')
     query = '''
     query ($repo_name: String!, $owner: String!, $cursor: String) {
@@ -299,12 +419,13 @@ def recursive_loc(
         }
     }'''
     variables = {'repo_name': repo_name, 'owner': owner, 'cursor': cursor}
-    request = requests.post(
-        'https://api.github.com/graphql',
-        json={'query': query, 'variables': variables},
-        headers=HEADERS,
-        timeout=REQUEST_TIMEOUT
-    )
+    with trace.span('graphql', query='recursive_loc', repo=f'{owner}/{repo_name}'):
+        request = requests.post(
+            'https://api.github.com/graphql',
+            json={'query': query, 'variables': variables},
+            headers=headers(),
+            timeout=REQUEST_TIMEOUT
+        )
     if request.status_code == 200:
         if request.json()['data']['repository']['defaultBranchRef'] is not None:
             return loc_counter_one_repo(
@@ -315,12 +436,14 @@ def recursive_loc(
                 request.json()['data']['repository']['defaultBranchRef']['target']['history'],
                 addition_total,
                 deletion_total,
-                my_commits
+                my_commits,
+                author
             )
         else:
             return 0
 
-    force_close_file(data, cache_comment)
+    if data is not None:
+        force_close_file(data, cache_comment)
     if request.status_code == 403:
         raise Exception('Too many requests in a short amount of time!\nYou\'ve hit the non-documented anti-abuse limit!')
     raise Exception('recursive_loc() has failed with a', request.status_code, request.text, QUERY_COUNT)
@@ -329,12 +452,13 @@ def recursive_loc(
 def loc_counter_one_repo(
     owner: str,
     repo_name: str,
-    data: list[str],
+    data: list[str] | None,
     cache_comment: list[str],
     history: dict[str, Any],
     addition_total: int,
     deletion_total: int,
     my_commits: int,
+    author: dict[str, str],
 ) -> tuple[int, int, int]:
     """
     Recursively calls recursive_loc to fetch commit history and calculate LOC statistics.
@@ -357,6 +481,8 @@ def loc_counter_one_repo(
         Lines of code deleted counter.
     my_commits : int
         Number of commits authored by the user.
+    author : dict[str, str]
+        Id of the user whose commits are counted, see `owner_id`.
 
     Returns
     -------
@@ -364,7 +490,7 @@ def loc_counter_one_repo(
         A tuple containing the total additions, deletions, and commits authored by the user.
     """
     for node in history['edges']:
-        if node['node']['author']['user'] == OWNER_ID:
+        if node['node']['author']['user'] == author:
             my_commits += 1
             addition_total += node['node']['additions']
             deletion_total += node['node']['deletions']
@@ -380,7 +506,8 @@ def loc_counter_one_repo(
             addition_total,
             deletion_total,
             my_commits,
-            history['pageInfo']['endCursor']
+            history['pageInfo']['endCursor'],
+            author
         )
 
 
@@ -444,7 +571,7 @@ def loc_query(
             }
         }
     }'''
-    variables = {'owner_affiliation': owner_affiliation, 'login': USER_NAME, 'cursor': cursor}
+    variables = {'owner_affiliation': owner_affiliation, 'login': environment.settings().USER_NAME, 'cursor': cursor}
     request = simple_request(loc_query.__name__, query, variables)
     if request.json()['data']['user']['repositories']['pageInfo']['hasNextPage']:
         edges += request.json()['data']['user']['repositories']['edges']
@@ -459,16 +586,25 @@ def loc_query(
         return cache.cache_builder(
             edges + request.json()['data']['user']['repositories']['edges'],
             comment_size,
-            force_cache
+            force_cache,
+            owner_affiliation=owner_affiliation
         )
 
 
-def add_archive() -> list[int]:
+def add_archive(
+    comment_size: int = 7,
+) -> list[int]:
     """
     Adds statistics for archived repositories that have been deleted.
 
-    Several repositories I have contributed to have since been deleted.
-    This function adds them using their last known data from a cache file.
+    Several repositories I have contributed to have since been deleted. Their
+    last known data is imported once into the cache by `cache.import_archive`,
+    and this function reads their precomputed totals.
+
+    Parameters
+    ----------
+    comment_size : int, optional
+        Number of lines in the comment block of the cache file (default: 7)
 
     Returns
     -------
@@ -485,20 +621,14 @@ def add_archive() -> list[int]:
         - contributed_repos : int
             Number of repositories contributed to
     """
-    with open('cache/repository_archive.txt', 'r') as f:
-        data = f.readlines()
-    old_data = data
-    data = data[7:len(data)-3]
-    added_loc, deleted_loc, added_commits = 0, 0, 0
-    contributed_repos = len(data)
-    for line in data:
-        repo_hash, total_commits, my_commits, *loc = line.split()
-        added_loc += int(loc[0])
-        deleted_loc += int(loc[1])
-        if my_commits.isdigit():
-            added_commits += int(my_commits)
-    added_commits += int(old_data[-1].split()[4][:-1])
-    return [added_loc, deleted_loc, added_loc - deleted_loc, added_commits, contributed_repos]
+    running = cache.load_totals(comment_size)
+    return [
+        running.archived_added,
+        running.archived_deleted,
+        running.archived_added - running.archived_deleted,
+        running.archived_commits,
+        running.archived_repos,
+    ]
 
 
 def stars_counter(
@@ -532,6 +662,10 @@ def commit_counter(
     """
     Counts total commits using cached repository data.
 
+    The running totals stored next to the cache are used when they are up to
+    date, otherwise the cache is scanned. Archived repositories are counted
+    separately, see `add_archive`.
+
     Parameters
     ----------
     comment_size : int
@@ -542,15 +676,7 @@ def commit_counter(
     int
         Total number of commits
     """
-    total_commits = 0
-    filename = 'cache/' + hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest() + '.txt'
-    with open(filename, 'r') as f:
-        data = f.readlines()
-    cache_comment = data[:comment_size]
-    data = data[comment_size:]
-    for line in data:
-        total_commits += int(line.split()[2])
-    return total_commits
+    return cache.load_totals(comment_size).my_commits
 
 
 def user_getter(
@@ -589,8 +715,6 @@ def user_getter(
         }
     }'''
     variables = {'login': username}
-    print(env)
-    print(env.ACCESS_TOKEN)
     request = simple_request(user_getter.__name__, query, variables)
     return {'id': request.json()['data']['user']['id']}, request.json()['data']['user']['createdAt']
 
@@ -1,25 +1,68 @@
 """Main entry point for generating the riced shell SVG profile."""
 
+import argparse
+import contextvars
+import io
+import os
+import string
+import sys
+import threading
+import time as clock
+
+from concurrent.futures import Future, wait
 from pathlib import Path
 
 #from ascii.logos import LOGOS, DEFAULT_LOGO
 from ascii.banner import BANNERS, DEFAULT_BANNER
 from config.config import ConfigParser
-from svg.svg_generator import SvgGenerator
-from graphql.github import *
-from utils import format, time, timer
+from config.loader import load_config
+from svg.fragments import FragmentCache
+from svg.svg_generator import SvgGenerator, Variant
+from svg.optimizer import optimize_svg
+from svg.template import CompiledTemplate, load_or_compile, placeholder, template_key
+from style.themes import ColorScheme, Theme
+from graphql.github import commit_counter, follower_getter, graph_repos_stars, revalidate
+from cache.cache import cache_filename, crawl_state_paths, import_archive, record_history, shared_cache
+from cache.snapshot import export_snapshot, import_snapshot
+from cache.stats import StatsStore
+from cache.tiered import DEFAULT_AUTHKEY, parse_address, serve_shared_cache
+from utils import format, memory, time, timer, trace
+from utils.fileio import write_if_changed
+from utils.publish import publish
+from utils.startup import format_report, import_times, startup_time
 
 # Constants
 LINE_HEIGHT = 18
 SECTION_SPACING = LINE_HEIGHT * 2
 START_X = 40
 START_Y = 40
-
-def fetch_github_stats(
+REFRESH_DEADLINE = 20.0
+OUTPUT_FILE = "output/profile.svg"
+# Exit status of a run that left every output unchanged
+EXIT_UNCHANGED = 3
+CONFIG_FILE = "config/ItsShunya.yaml"
+TEMPLATE_DIR = "cache/templates"
+FRAGMENT_FILE = "cache/fragments.json"
+PROFILE_THEME = Theme.CATPPUCCIN_MOCHA
+PROFILE_VALUES = ("uptime", "repos", "contrib", "commits", "stars", "followers")
+# Every character the placeholder values may use, so the embedded font covers them
+VALUE_CHARACTERS = string.digits + " ,()+-ymd"
+FONT_MODES = ("subset", "system", "outline")
+# Seconds between the stacks sampled by --profile-sampling
+SAMPLE_INTERVAL = 0.005
+LAYOUT_MODULES = (
+    "fonts.geometry", "fonts.subset",
+    "ascii.banner", "style.themes", "svg.optimizer", "svg.svg_generator", "svg.template", "utils.format", __name__
+)
+
+_FRAGMENTS: FragmentCache | None = None
+
+
+def github_queries(
     cfg: ConfigParser
 ) -> dict:
-    """Fetch all GitHub statistics and return as a dictionary."""
-    github_queries = {
+    """Return the query function and arguments of every GitHub statistic."""
+    return {
         'commits':      (commit_counter, 7),
         'stars':        (graph_repos_stars, 'stars', ['OWNER']),
         'repos':        (graph_repos_stars, 'repos', ['OWNER']),
@@ -27,15 +70,77 @@ def fetch_github_stats(
         'followers':    (follower_getter, cfg.user.username),
     }
 
+
+@trace.span("fetch_github_stats")
+def fetch_github_stats(
+    cfg: ConfigParser
+) -> dict:
+    """Fetch all GitHub statistics and return as a dictionary."""
     github_data = {}
     total_time = 0
 
-    for key, args in github_queries.items():
+    for key, args in github_queries(cfg).items():
         func, *params = args
         github_data[key], query_time = timer.perf_counter(func, *params)
         total_time += query_time
 
     print(f"Total Github GraphQL query time: {total_time:.4f} s")
+    print(shared_cache().report())
+    record_history(github_data)
+    return github_data
+
+
+def refresh_github_stats(
+    cfg: ConfigParser,
+    store: StatsStore
+) -> dict[str, Future]:
+    """
+    Start fetching every GitHub statistic in the background.
+
+    Each result is written to the store as soon as it arrives, even after the
+    caller stopped waiting for it, so the next run starts from it. The queries
+    run on daemon threads, so they never delay the exit of the process: a
+    result that has not arrived by then is lost.
+    """
+    futures = {}
+
+    for key, (func, *params) in github_queries(cfg).items():
+        future = futures[key] = Future()
+
+        def remember(future: Future, key: str = key) -> None:
+            if future.exception() is None:
+                store.update(key, future.result())
+
+        # the workers see the settings of the caller, overrides included, and
+        # skip cached responses, which may predate the stored values
+        def run(future: Future = future, context: contextvars.Context = contextvars.copy_context(),
+                func=func, params=params) -> None:
+            future.set_running_or_notify_cancel()
+            try:
+                result = context.run(revalidate, func, *params)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        future.add_done_callback(remember)
+        threading.Thread(target=run, name=f"refresh-{key}", daemon=True).start()
+
+    return futures
+
+
+def collect_github_stats(
+    futures: dict[str, Future],
+    timeout: float
+) -> dict:
+    """Wait up to timeout seconds and return the statistics fetched successfully."""
+    wait(futures.values(), timeout=max(0.0, timeout))
+    github_data = {}
+    for key, future in futures.items():
+        if future.done() and future.exception() is None:
+            github_data[key] = future.result()
+        elif future.done():
+            print(f"Refreshing {key} failed: {future.exception()}")
     return github_data
 
 
@@ -124,13 +229,14 @@ def create_banner(
 
 def build_sections_data(
     cfg: ConfigParser,
-    github_data: dict
+    github_data: dict,
+    uptime: str | None = None
 ) -> dict:
-    """Build the data structure for all profile sections."""
+    """Build the data structure for all profile sections, computing the uptime if not given."""
     return {
         "system": [
             ("os", cfg.user.operative_system or "unknown"),
-            ("uptime", time.human_uptime(cfg.user.birthday)),
+            ("uptime", uptime if uptime is not None else time.human_uptime(cfg.user.birthday)),
             ("kernel", cfg.user.position or "unknown"),
             ("host", cfg.user.company or "unknown"),
         ],
@@ -154,46 +260,459 @@ def build_sections_data(
     }
 
 
+def render_section(
+    svg: SvgGenerator,
+    x: int,
+    y: int,
+    section_name: str,
+    items: list
+) -> int:
+    """Render one profile section and return new y position."""
+    y += LINE_HEIGHT  # spacing between sections
+    y = add_section_header(svg, x, y, section_name)
+    for label, value in items:
+        y = add_info_line(svg, x, y, label, value)
+    return y
+
+
 def render_sections(
     svg: SvgGenerator,
     x: int,
     y: int,
-    sections: tuple
+    sections: tuple,
+    fragments: FragmentCache | None = None
 ) -> int:
-    """Render all profile sections and return final y position."""
+    """
+    Render all profile sections and return final y position.
+
+    With a fragment cache, a section whose items and position did not change
+    is spliced from the cache instead of being laid out again.
+    """
     for section_name, items in sections.items():
-        y += LINE_HEIGHT  # spacing between sections
-        y = add_section_header(svg, x, y, section_name)
-        for label, value in items:
-            y = add_info_line(svg, x, y, label, value)
+        if fragments is None:
+            y = render_section(svg, x, y, section_name, items)
+        else:
+            y = fragments.draw(
+                svg, (LINE_HEIGHT, x, y, section_name, items),
+                lambda y=y, section_name=section_name, items=items: render_section(svg, x, y, section_name, items)
+            )
 
     return y
 
 
-def main() -> None:
-    """
-    Generate the riced shell SVG profile.
-    """
-    # Load configuration
-    cfg = ConfigParser.from_yaml_file(Path("config/ItsShunya.yaml"))
+def profile_fragments() -> FragmentCache:
+    """Return the section fragment cache of this process, loading it on first use."""
+    global _FRAGMENTS
+    if _FRAGMENTS is None:
+        modules = LAYOUT_MODULES + ("fonts.outlines", "svg.fragments")
+        sources = [Path(sys.modules[name].__file__).read_bytes() for name in modules]
+        _FRAGMENTS = FragmentCache(FRAGMENT_FILE, template_key(*sources))
+    return _FRAGMENTS
 
-    # Fetch GitHub stats
-    github_data = fetch_github_stats(cfg)
 
-    # Initialize SVG
-    svg = SvgGenerator(width=560, height=700)
+@trace.span("draw_profile")
+def draw_profile(
+    svg: SvgGenerator,
+    cfg: ConfigParser,
+    github_data: dict,
+    uptime: str | None = None,
+    font: str = "system",
+    fragments: FragmentCache | None = None
+) -> None:
+    """
+    Lay out the whole profile on the given SVG generator.
 
-    # Build the profile
+    With the "subset" font mode, the glyphs of the bundled JetBrains Mono that
+    the profile uses are embedded, and a character the font cannot draw is an
+    error.
+    """
     y = START_Y
     y = create_profile_header(svg, START_X, y, cfg)
     y = create_banner(svg, START_X, y)
 
-    sections = build_sections_data(cfg, github_data)
-    y = render_sections(svg, START_X, y, sections)
+    sections = build_sections_data(cfg, github_data, uptime)
+    y = render_sections(svg, START_X, y, sections, fragments)
 
-    # Save SVG
-    svg.save("output/profile.svg")
+    if font == "subset":
+        svg.embed_font(VALUE_CHARACTERS)
+
+
+@trace.span("render_profile")
+def render_profile(
+    cfg: ConfigParser,
+    github_data: dict,
+    font: str = "system"
+) -> SvgGenerator:
+    """Lay out the whole profile and return the SVG generator holding it."""
+    svg = SvgGenerator(width=560, height=700, theme=PROFILE_THEME, outlines=font == "outline")
+    fragments = profile_fragments()
+    draw_profile(svg, cfg, github_data, font=font, fragments=fragments)
+    fragments.save()
+    return svg
+
+
+def theme_by_name(
+    name: str
+) -> ColorScheme:
+    """Return the predefined theme with the given name, case-insensitive, e.g. tokyo-night."""
+    themes = Theme.all()
+    key = name.upper().replace("-", "_")
+    if key not in themes:
+        raise ValueError(f"Unknown theme {name!r}, expected one of {', '.join(themes)}")
+    return themes[key]
+
+
+def color_schemes(
+    light_theme: ColorScheme | None
+) -> dict[str, ColorScheme] | None:
+    """Return the schemes selected by prefers-color-scheme for an optional light theme."""
+    return {"light": light_theme} if light_theme is not None else None
+
+
+def profile_variants(
+    specs: list[str]
+) -> list[Variant]:
+    """
+    Turn THEME[:WIDTH] variant specifications into output variants.
+
+    THEME is a name of `Theme.all()`, case-insensitive, or "all" for every
+    theme. Each variant is written next to OUTPUT_FILE, named after the theme
+    and the width if given, e.g. profile-tokyo-night-480.svg.
+    """
+    stem = Path(OUTPUT_FILE).with_suffix("")
+    variants = []
+    for spec in specs:
+        name, _, width = spec.partition(":")
+        names = list(Theme.all()) if name.lower() == "all" else [name]
+        for theme_name in names:
+            suffix = theme_name.lower().replace("_", "-") + (f"-{int(width)}" if width else "")
+            variants.append(Variant(f"{stem}-{suffix}.svg", theme_by_name(theme_name), int(width) if width else None))
+    return variants
+
+
+@trace.span("save_profile_variants")
+def save_profile_variants(
+    cfg: ConfigParser,
+    github_data: dict,
+    variants: list[Variant],
+    font: str = "subset"
+) -> int:
+    """Lay out the profile once and write it in every variant, returning how many files changed."""
+    written = render_profile(cfg, github_data, font).save_variants(variants)
+    print(f"Wrote {written} of {len(variants)} variants: {', '.join(Path(v.filename).name for v in variants)}")
+    return written
+
+
+@trace.span("profile_template")
+def profile_template(
+    cfg: ConfigParser,
+    optimize: bool = True,
+    font: str = "subset",
+    light_theme: ColorScheme | None = None
+) -> CompiledTemplate:
+    """
+    Return the compiled profile layout, compiling it on the first run.
+
+    The template is keyed by the configuration file, the themes, the optimizer
+    and font settings and the source of the layout code, so any change to them
+    compiles it again.
+    """
+    sources = [Path(CONFIG_FILE).read_bytes(), repr(PROFILE_THEME), repr(light_theme), str(optimize), font]
+    sources += [Path(sys.modules[name].__file__).read_bytes() for name in LAYOUT_MODULES]
+    values = {key: placeholder(key) for key in PROFILE_VALUES}
+    return load_or_compile(
+        TEMPLATE_DIR, template_key(*sources),
+        lambda svg: draw_profile(svg, cfg, values, values["uptime"], font),
+        width=560, height=700, theme=PROFILE_THEME, optimize=optimize, schemes=color_schemes(light_theme)
+    )
+
+
+@trace.span("save_profile")
+def save_profile(
+    cfg: ConfigParser,
+    github_data: dict,
+    optimize: bool = True,
+    font: str = "subset",
+    light_theme: ColorScheme | None = None
+) -> bool:
+    """
+    Fill the compiled profile template with the statistics and write it.
+
+    Outlines depend on every character of the values, so in "outline" font
+    mode the profile is laid out again instead of filling a template. With a
+    light theme, the profile switches to it when the viewer prefers light mode.
+    Returns False, without writing, if the profile would not change.
+    """
+    if font == "outline":
+        buffer = io.StringIO()
+        svg = SvgGenerator(width=560, height=700, theme=PROFILE_THEME, sink=buffer, outlines=True,
+                           schemes=color_schemes(light_theme))
+        fragments = profile_fragments()
+        draw_profile(svg, cfg, github_data, font=font, fragments=fragments)
+        svg.close()
+        fragments.save()
+        print(fragments.report())
+        document = buffer.getvalue()
+        if optimize:
+            document, report = optimize_svg(document)
+            print(report)
+        return write_if_changed(OUTPUT_FILE, document)
+
+    values = {key: github_data.get(key, "-") for key in PROFILE_VALUES}
+    values["uptime"] = time.human_uptime(cfg.user.birthday)
+    template = profile_template(cfg, optimize, font, light_theme)
+    if template.report is not None:
+        print(template.report)
+    return write_if_changed(OUTPUT_FILE, template.render(values))
+
+
+@trace.span("render_stale_while_revalidate")
+def render_stale_while_revalidate(
+    cfg: ConfigParser,
+    deadline: float,
+    optimize: bool = True,
+    font: str = "subset",
+    light_theme: ColorScheme | None = None
+) -> tuple[dict, bool]:
+    """
+    Render from the last known statistics, then refresh them under a deadline.
+
+    The profile is written right away from the stored values. Statistics that
+    were never fetched are waited for, within the deadline. The profile is
+    rendered again only if the refresh finished in time and changed a value.
+    Returns the statistics the profile was last rendered with, and whether
+    the profile file changed.
+    """
+    start = clock.monotonic()
+    store = StatsStore(cache_filename('.stats.json'))
+    github_data = store.values()
+    for key in github_queries(cfg):
+        age = store.age(key)
+        print(f"   {key + ':':<12}{github_data.get(key, '-')!s:>10}  "
+              + (f"({age:.0f} s old)" if age is not None else "(never fetched)"))
+
+    futures = refresh_github_stats(cfg, store)
+    missing = {key: future for key, future in futures.items() if key not in github_data}
+    if missing:
+        github_data.update(collect_github_stats(missing, deadline - (clock.monotonic() - start)))
+    rendered = {key: github_data.get(key, '-') for key in futures}
+    changed = save_profile(cfg, rendered, optimize, font, light_theme)
+
+    fresh = dict(rendered)
+    revalidated = {key: future for key, future in futures.items() if key not in missing}
+    fresh.update(collect_github_stats(revalidated, deadline - (clock.monotonic() - start)))
+    record_history({key: fresh[key] for key, future in futures.items() if future.done() and key in fresh})
+    if fresh != rendered:
+        print("Statistics changed while revalidating, rendering again.")
+        changed = save_profile(cfg, fresh, optimize, font, light_theme) or changed
+
+    pending = [key for key, future in futures.items() if not future.done()]
+    if pending:
+        print(f"Refresh of {', '.join(pending)} missed the {deadline:.0f} s deadline; "
+              "their results are stored only if they arrive before the run ends.")
+    return fresh, changed
+
+
+def parse_args(
+    argv: list[str] | None = None
+) -> argparse.Namespace:
+    """Parse the command line options."""
+    parser = argparse.ArgumentParser(description="Generate the riced shell SVG profile.")
+    parser.add_argument(
+        "--stale-while-revalidate", action="store_true",
+        help="render immediately from the last known statistics and refresh them in the background"
+    )
+    parser.add_argument(
+        "--deadline", type=float, default=REFRESH_DEADLINE,
+        help=f"seconds to wait for the background refresh (default: {REFRESH_DEADLINE:.0f})"
+    )
+    parser.add_argument(
+        "--no-optimize", dest="optimize", action="store_false",
+        help="write the profile without the SVG optimizer pass"
+    )
+    parser.add_argument(
+        "--font", choices=FONT_MODES, default="subset",
+        help="embed the used glyphs of JetBrains Mono (subset), rely on the viewer's fonts (system) "
+             "or draw the text as glyph outlines (outline)"
+    )
+    parser.add_argument(
+        "--import-archive", metavar="FILE",
+        help="import the statistics of deleted repositories from an archive file into the cache, once"
+    )
+    parser.add_argument(
+        "--import-snapshot", metavar="FILE",
+        help="restore the crawl state from a snapshot bundle before running, if it exists"
+    )
+    parser.add_argument(
+        "--export-snapshot", metavar="FILE",
+        help="pack the crawl state into a snapshot bundle after running"
+    )
+    parser.add_argument(
+        "--light-theme", metavar="THEME",
+        help="switch the profile to this theme when the viewer prefers light mode, e.g. catppuccin-latte"
+    )
+    parser.add_argument(
+        "--variant", dest="variants", action="append", default=[], metavar="THEME[:WIDTH]",
+        help="also write the profile with another theme and width, laid out once for every variant; "
+             "THEME is a theme name such as tokyo-night, or all"
+    )
+    parser.add_argument(
+        "--cache-server", metavar="HOST:PORT",
+        help="serve the shared response cache on this address until interrupted, instead of rendering; "
+             "clients connect with SHARED_CACHE_ADDRESS and the same SHARED_CACHE_AUTHKEY"
+    )
+    parser.add_argument(
+        "--import-report", action="store_true",
+        help="print the modules that take the longest to import at startup, then exit"
+    )
+    parser.add_argument(
+        "--startup-budget", type=float, metavar="MS",
+        help="check that importing this program in a fresh interpreter takes at most MS milliseconds "
+             "(median of 5 runs), then exit with status 1 if it does not"
+    )
+    parser.add_argument(
+        "--trace", metavar="FILE",
+        help="record nested timing spans of the run and write them as a Chrome trace (chrome://tracing, Perfetto)"
+    )
+    parser.add_argument(
+        "--folded", metavar="FILE",
+        help="write the recorded spans as folded stacks, the input of flamegraph.pl and speedscope"
+    )
+    parser.add_argument(
+        "--profile-sampling", action="store_true",
+        help=f"also sample the Python stacks every {SAMPLE_INTERVAL * 1000:g} ms; "
+             "--folded then holds the sampled stacks instead of the spans"
+    )
+    parser.add_argument(
+        "--memory-profile", action="store_true",
+        help="trace allocations and report the memory use and largest allocation sites of every stage"
+    )
+    parser.add_argument(
+        "--precompress", action="store_true",
+        help="also write gzip and brotli siblings and content-hashed copies of the profile, "
+             "listed in a manifest next to it"
+    )
+    return parser.parse_args(argv)
+
+
+def main(
+    argv: list[str] | None = None
+) -> int:
+    """
+    Generate the riced shell SVG profile.
+
+    Returns 0, or EXIT_UNCHANGED if every output already held the rendered
+    bytes and nothing was written.
+    """
+    args = parse_args(argv)
+    try:
+        variants = profile_variants(args.variants)
+        light_theme = theme_by_name(args.light_theme) if args.light_theme else None
+    except ValueError as e:
+        sys.exit(f"Invalid theme: {e}")
+
+    if args.cache_server:
+        try:
+            address = parse_address(args.cache_server)
+        except ValueError as e:
+            sys.exit(f"Invalid cache server address: {e}")
+        print(f"Serving shared cache on {args.cache_server}")
+        serve_shared_cache(address, os.environ.get("SHARED_CACHE_AUTHKEY", DEFAULT_AUTHKEY.decode()).encode())
+        return 0
+    if args.import_report:
+        print(format_report(import_times("main", str(Path(__file__).parent)), "main"))
+        return 0
+    if args.startup_budget is not None:
+        elapsed = startup_time("main", str(Path(__file__).parent)) * 1000
+        print(f"Importing main takes {elapsed:.1f} ms (budget {args.startup_budget:.0f} ms)")
+        return 0 if elapsed <= args.startup_budget else 1
+
+    tracer = None
+    if args.trace or args.folded or args.profile_sampling:
+        tracer = trace.start_tracing(SAMPLE_INTERVAL if args.profile_sampling else None)
+    profiler = memory.start_memory_profile() if args.memory_profile else None
+    try:
+        return generate(args, variants, light_theme)
+    finally:
+        if profiler is not None:
+            memory.stop_memory_profile()
+            print(profiler.report())
+        if tracer is not None:
+            trace.stop_tracing()
+            tracer.save(args.trace, args.folded)
+            print(tracer.report())
+
+
+@trace.span("generate")
+def generate(
+    args: argparse.Namespace,
+    variants: list[Variant],
+    light_theme: ColorScheme | None = None
+) -> int:
+    """
+    Render and write every requested output.
+
+    Returns 0, or EXIT_UNCHANGED if every output already held the rendered
+    bytes and nothing was written.
+    """
+    # Load configuration
+    cfg = load_config(CONFIG_FILE)
+    memory.checkpoint("load config")
+
+    if args.import_snapshot:
+        try:
+            restored, restore_time = timer.perf_counter(import_snapshot, args.import_snapshot)
+            print(f"Restored {restored} files from {args.import_snapshot} in {restore_time:.4f} s")
+        except FileNotFoundError:
+            print(f"No snapshot at {args.import_snapshot}, starting cold.")
+        except ValueError as e:
+            print(f"Ignoring snapshot: {e}")
+        memory.checkpoint("import snapshot")
+
+    if args.import_archive:
+        if not import_archive(7, args.import_archive):
+            print(f"{args.import_archive} was already imported.")
+        memory.checkpoint("import archive")
+
+    if args.stale_while_revalidate:
+        github_data, changed = render_stale_while_revalidate(
+            cfg, args.deadline, args.optimize, args.font, light_theme
+        )
+        memory.checkpoint("fetch and render")
+    else:
+        # Fetch GitHub stats
+        github_data = fetch_github_stats(cfg)
+        memory.checkpoint("fetch")
+
+        # Fill the compiled profile layout and save it
+        changed = save_profile(cfg, github_data, args.optimize, args.font, light_theme)
+        memory.checkpoint("render")
+
+    if args.variants:
+        changed = save_profile_variants(cfg, github_data, variants, args.font) > 0 or changed
+        memory.checkpoint("variants")
+
+    if args.precompress:
+        entry = publish(OUTPUT_FILE)
+        sizes = ", ".join(f"{encoding} {size}" for encoding, size in entry["sizes"].items())
+        print(f"Published {entry['file']} ({sizes} bytes)")
+        memory.checkpoint("publish")
+
+    # bound cache/responses, crawl entries of repositories with newer commits are never read again
+    pruned = shared_cache().prune()
+    if pruned:
+        print(f"Pruned {pruned} expired or least recently used cache entries")
+
+    if args.export_snapshot:
+        packed = export_snapshot(args.export_snapshot, crawl_state_paths())
+        print(f"Packed {packed} files into {args.export_snapshot}")
+        memory.checkpoint("export snapshot")
+
+    if not changed:
+        print(f"{OUTPUT_FILE} is unchanged.")
+        return EXIT_UNCHANGED
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -197,3 +197,36 @@ class Theme:
         accent3 =       "#94e2d5",
         separator =     "#585b70",
     )
+
+    CATPPUCCIN_LATTE: ClassVar[ColorScheme] = ColorScheme(
+        background =    "#eff1f5",
+        ascii =         "#4c4f69",
+        key =           "#1e66f5",
+        value =         "#8839ef",
+        cc =            "#9ca0b0",
+        prompt =        "#179299",
+        command =       "#40a02b",
+        string =        "#df8e1d",
+        comment =       "#9ca0b0",
+        error =         "#d20f39",
+        success =       "#40a02b",
+        warning =       "#fe640b",
+        highlight =     "#ea76cb",
+        dim =           "#bcc0cc",
+        accent1 =       "#04a5e5",
+        accent2 =       "#ea76cb",
+        accent3 =       "#179299",
+        separator =     "#acb0be",
+    )
+
+    @classmethod
+    def all(cls) -> dict[str, ColorScheme]:
+        """
+        Return every predefined theme.
+
+        Returns
+        -------
+        dict[str, ColorScheme]
+            Theme name, e.g. 'CATPPUCCIN_MOCHA', to its color scheme
+        """
+        return {name: value for name, value in vars(cls).items() if isinstance(value, ColorScheme)}
@@ -0,0 +1,144 @@
+"""Cache of rendered SVG fragments, keyed by the inputs they were drawn from."""
+
+import hashlib
+import json
+import os
+
+from collections.abc import Callable
+
+from svg.svg_generator import SvgGenerator
+from utils.fileio import atomic_write, locked
+
+
+class FragmentCache:
+    """
+    Elements drawn by a layout function, reused while its inputs do not change.
+
+    A fragment is keyed by a hash of its inputs, which must include everything
+    the drawing depends on, positions included. On a hit the stored elements
+    are spliced into the generator and the stored end position is returned, so
+    the layout continues exactly as if the fragment had been drawn again.
+    Fragments drawn as outlines only store the codepoints of their glyphs, the
+    paths are kept once in the outline cache.
+
+    Attributes
+    ----------
+    filename : str | None
+        Path of the persistent cache, None to keep fragments in memory only
+    salt : str
+        Identifies the layout code; fragments stored with another salt are
+        discarded
+    hits : int
+        Fragments spliced from the cache
+    misses : int
+        Fragments drawn
+    """
+
+    def __init__(
+        self,
+        filename: str | None = None,
+        salt: str = '',
+    ) -> None:
+        """
+        Load the stored fragments.
+
+        Parameters
+        ----------
+        filename : str, optional
+            Path of the persistent cache (default is None, in memory only)
+        salt : str, optional
+            Identifies the layout code, e.g. a hash of its source (default is '')
+        """
+        self.filename:      str | None = filename
+        self.salt:          str = salt
+        self.hits:          int = 0
+        self.misses:        int = 0
+        self._fragments:    dict[str, dict] = {}
+        self._used:         set[str] = set()
+        if filename is not None:
+            try:
+                with open(filename, 'r') as f:
+                    stored = json.load(f)
+                if stored['salt'] == salt:
+                    self._fragments = stored['fragments']
+            except (FileNotFoundError, ValueError, KeyError, TypeError):
+                pass
+
+    def key(
+        self,
+        svg: SvgGenerator,
+        inputs: tuple,
+    ) -> str:
+        """
+        Return the key of a fragment drawn on a generator from the given inputs.
+
+        Parameters
+        ----------
+        svg : SvgGenerator
+            The generator, whose kind and text mode change the elements
+        inputs : tuple
+            Everything else the fragment depends on, with a stable repr()
+
+        Returns
+        -------
+        str
+            Hex digest identifying the fragment
+        """
+        identity = (self.salt, type(svg).__qualname__, svg.outlines is not None, inputs)
+        return hashlib.sha256(repr(identity).encode('utf-8')).hexdigest()
+
+    def draw(
+        self,
+        svg: SvgGenerator,
+        inputs: tuple,
+        draw: Callable[[], int],
+    ) -> int:
+        """
+        Splice the fragment for the inputs, or draw and store it.
+
+        Parameters
+        ----------
+        svg : SvgGenerator
+            Generator the fragment is drawn on
+        inputs : tuple
+            Everything the fragment depends on besides the generator, see `key`
+        draw : Callable[[], int]
+            Draws the fragment on `svg` and returns the y position after it
+
+        Returns
+        -------
+        int
+            The y position after the fragment
+        """
+        key = self.key(svg, inputs)
+        self._used.add(key)
+        fragment = self._fragments.get(key)
+        if fragment is not None:
+            svg.splice(fragment['elements'], fragment['glyphs'])
+            self.hits += 1
+            return fragment['y']
+
+        with svg.recording() as elements:
+            y = draw()
+        self._fragments[key] = {'elements': elements, 'glyphs': svg.used_glyphs(elements), 'y': y}
+        self.misses += 1
+        return y
+
+    def save(self) -> None:
+        """
+        Store the fragments used since the cache was loaded, dropping the others.
+
+        Returns
+        -------
+        None
+        """
+        if self.filename is None or (not self.misses and self._used == self._fragments.keys()):
+            return
+        fragments = {key: self._fragments[key] for key in sorted(self._used)}
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        with locked(self.filename):
+            atomic_write(self.filename, json.dumps({'salt': self.salt, 'fragments': fragments}))
+
+    def report(self) -> str:
+        """Return a one-line summary of the reuse."""
+        return f"Fragments: {self.hits} reused, {self.misses} drawn"
@@ -0,0 +1,222 @@
+"""Optimizer pass shrinking the generated SVG documents."""
+
+import re
+
+from collections import Counter
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+from utils import trace
+
+_STYLE = re.compile(r'<style>(.*?)</style>', re.S)
+_RULE = re.compile(r'\.([\w-]+)\s*\{([^}]*)\}')
+_CLASS = re.compile(r'class="([\w-]+)"')
+_TEXT = re.compile(r'<text\b.*?</text>', re.S)
+_BETWEEN_TAGS = re.compile(r'>\s+<')
+_SAME_CLASS_TSPANS = re.compile(r'<tspan class="([\w-]+)">([^<]*)</tspan><tspan class="\1">([^<]*)</tspan>')
+_NODE = re.compile(r'<[A-Za-z]')
+_PROPERTIES = re.compile(r'@media[^{]*\{\s*:root\s*\{[^}]*\}\s*\}|:root\s*\{[^}]*\}')
+_CSS_SPACE = re.compile(r'\s*([{};:])\s*')
+
+
+@dataclass
+class OptimizationReport:
+    """
+    Size of a document before and after optimization.
+
+    Attributes
+    ----------
+    bytes_before : int
+        UTF-8 size of the original document
+    bytes_after : int
+        UTF-8 size of the optimized document
+    nodes_before : int
+        Number of elements in the original document
+    nodes_after : int
+        Number of elements in the optimized document
+    """
+
+    bytes_before:   int = 0
+    bytes_after:    int = 0
+    nodes_before:   int = 0
+    nodes_after:    int = 0
+
+    def __str__(self) -> str:
+        saved = self.bytes_before - self.bytes_after
+        percent = 100 * saved / self.bytes_before if self.bytes_before else 0.0
+        return (f"SVG optimizer: {self.bytes_before} -> {self.bytes_after} bytes ({percent:.1f}% saved), "
+                f"{self.nodes_before} -> {self.nodes_after} nodes")
+
+
+def short_names() -> Iterator[str]:
+    """Yield a, b, ..., z, aa, ab, ... as replacement class names."""
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    length = 1
+    while True:
+        for index in range(len(letters) ** length):
+            name = ''
+            for _ in range(length):
+                index, letter = divmod(index, len(letters))
+                name = letters[letter] + name
+            yield name
+        length += 1
+
+
+def parse_rules(
+    css: str,
+) -> dict[str, dict[str, str]]:
+    """
+    Parse the class rules of a style block.
+
+    Parameters
+    ----------
+    css : str
+        Contents of the style block, made of `.class { property: value; }` rules
+
+    Returns
+    -------
+    dict[str, dict[str, str]]
+        Class name to its declarations, in document order
+    """
+    rules = {}
+    for name, body in _RULE.findall(css):
+        declarations = {}
+        for declaration in body.split(';'):
+            if ':' in declaration:
+                prop, value = declaration.split(':', 1)
+                declarations[prop.strip()] = ' '.join(value.split())
+        rules[name] = declarations
+    return rules
+
+
+def hoist_rules(
+    rules: dict[str, dict[str, str]],
+) -> tuple[dict[str, str], dict[str, dict[str, str]]]:
+    """
+    Move the declarations shared by every class rule to a single `text` rule.
+
+    Only declarations present with the same value in every rule are hoisted:
+    a tspan without the declaration then inherits it from its text element,
+    which either has one of the classes or matches the `text` rule.
+
+    Parameters
+    ----------
+    rules : dict[str, dict[str, str]]
+        Class name to its declarations
+
+    Returns
+    -------
+    tuple[dict[str, str], dict[str, dict[str, str]]]
+        The hoisted declarations and the remaining declarations of each class
+    """
+    if not rules:
+        return {}, rules
+    shared = {
+        prop: value for prop, value in next(iter(rules.values())).items()
+        if all(declarations.get(prop) == value for declarations in rules.values())
+    }
+    remaining = {
+        name: {prop: value for prop, value in declarations.items() if prop not in shared}
+        for name, declarations in rules.items()
+    }
+    return shared, remaining
+
+
+def format_rule(
+    selector: str,
+    declarations: dict[str, str],
+) -> str:
+    """Return a rule without any optional whitespace."""
+    return selector + '{' + ';'.join(f'{prop}:{value}' for prop, value in declarations.items()) + '}'
+
+
+def merge_tspans(
+    text: str,
+) -> str:
+    """
+    Merge adjacent tspans that only set the same class.
+
+    Parameters
+    ----------
+    text : str
+        A text element
+
+    Returns
+    -------
+    str
+        The text element with the runs of same-class tspans merged
+    """
+    merged = None
+    while merged != text:
+        merged = text
+        text = _SAME_CLASS_TSPANS.sub(r'<tspan class="\1">\2\3</tspan>', text)
+    return text
+
+
+@trace.span('optimize_svg')
+def optimize_svg(
+    document: str,
+) -> tuple[str, OptimizationReport]:
+    """
+    Shrink an SVG document produced by `SvgGenerator` without changing how it renders.
+
+    The pass hoists the CSS declarations shared by every class into one rule,
+    merges the classes left with identical declarations, renames them by
+    frequency of use to the shortest names, collapses the whitespace of the
+    style block and between elements, and merges adjacent tspans with the same
+    class. Whitespace inside text elements is kept, since they preserve it.
+
+    Parameters
+    ----------
+    document : str
+        The SVG document
+
+    Returns
+    -------
+    tuple[str, OptimizationReport]
+        The optimized document and the savings
+    """
+    report = OptimizationReport(
+        bytes_before=len(document.encode('utf-8')),
+        nodes_before=len(_NODE.findall(document)),
+    )
+
+    style = _STYLE.search(document)
+    rules = parse_rules(style.group(1)) if style else {}
+    shared, remaining = hoist_rules(rules)
+
+    # classes left with the same declarations are merged into one
+    groups: dict[tuple[tuple[str, str], ...], list[str]] = {}
+    for name, declarations in remaining.items():
+        groups.setdefault(tuple(declarations.items()), []).append(name)
+    usage = Counter(name for name in _CLASS.findall(document) if name in rules)
+    ranked = sorted(
+        (group for group in groups.items() if any(usage[name] for name in group[1])),
+        key=lambda group: -sum(usage[name] for name in group[1])
+    )
+    renames = {}
+    # custom properties of adaptive documents are kept, minified
+    css = ''.join(_CSS_SPACE.sub(r'\1', block).replace(';}', '}')
+                  for block in _PROPERTIES.findall(style.group(1))) if style else ''
+    css += format_rule('text', shared) if shared else ''
+    for (declarations, names), short_name in zip(ranked, short_names()):
+        renames.update(dict.fromkeys(names, short_name))
+        if declarations:
+            css += format_rule('.' + short_name, dict(declarations))
+
+    document = _CLASS.sub(lambda match: f'class="{renames.get(match.group(1), match.group(1))}"', document)
+    if style:
+        document = _STYLE.sub(lambda match: f'<style>{css}</style>', document, count=1)
+
+    parts = []
+    position = 0
+    for text in _TEXT.finditer(document):
+        parts.append(_BETWEEN_TAGS.sub('><', document[position:text.start()]).strip())
+        parts.append(merge_tspans(text.group(0)))
+        position = text.end()
+    parts.append(_BETWEEN_TAGS.sub('><', document[position:]).strip())
+    document = ''.join(parts)
+
+    report.bytes_after = len(document.encode('utf-8'))
+    report.nodes_after = len(_NODE.findall(document))
+    return document, report
@@ -1,6 +1,58 @@
 """SVG generator module for creating SVG documents with text elements and styling."""
 
+import hashlib
+import re
+
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from typing import TextIO
+
+from fonts.outlines import GlyphOutlines
+from fonts.subset import FONT_FAMILY, FontSubset, subset_font, used_codepoints
 from style.themes import ColorScheme, Theme
+from utils import trace
+from utils.fileio import content_unchanged, record_content_hash
+
+# The embedded subset first, then a locally installed JetBrains Mono
+FONT_STACK = f"'{FONT_FAMILY}', JetBrains Mono, monospace"
+# Buffer size of the files opened by SvgGenerator.to_file
+STREAM_BUFFER_SIZE = 1 << 16
+# Font size of the classes whose style does not set one, in pixels
+DEFAULT_FONT_SIZE = 14
+
+_GLYPH_USE = re.compile(r'href="#g([0-9a-f]+)"')
+_FONT_SIZE = re.compile(r'\.([\w-]+) \{[^}]*?font-size: (\d+(?:\.\d+)?)px')
+
+
+def _number(
+    value: float,
+) -> str:
+    """Format a coordinate with at most three decimals."""
+    return f'{value:.3f}'.rstrip('0').rstrip('.')
+
+
+@dataclass(frozen=True)
+class Variant:
+    """
+    An output of `SvgGenerator.save_variants`.
+
+    Attributes
+    ----------
+    filename : str
+        Output filename for the SVG file
+    theme : ColorScheme
+        Color scheme of the variant
+    width : int | None
+        Width of the canvas in pixels, the generator's width if None
+    height : int | None
+        Height of the canvas in pixels, the generator's height if None
+    """
+
+    filename:   str
+    theme:      ColorScheme
+    width:      int | None = None
+    height:     int | None = None
 
 
 class SvgGenerator:
@@ -9,6 +61,9 @@ class SvgGenerator:
         width:  int = 1000,
         height: int = 600,
         theme:  ColorScheme = Theme.CATPPUCCIN_MOCHA,
+        sink:   TextIO | None = None,
+        outlines: bool = False,
+        schemes: dict[str, ColorScheme] | None = None,
     ) -> None:
         """
         Initialize the SVG generator with specified dimensions.
@@ -21,12 +76,202 @@ class SvgGenerator:
             Height of the SVG canvas in pixels (default is 600)
         theme : ColorScheme, optional
             Color scheme to use for styling (default is Theme.TOKYO_NIGHT)
+        sink : TextIO, optional
+            Text stream the elements are written to as they are created,
+            instead of being kept in `content` until `save` (default is None).
+            The document is completed by `close`.
+        outlines : bool, optional
+            Draw text as outlines of the bundled JetBrains Mono instead of text
+            elements, so it renders the same whatever fonts the viewer has
+            (default is False). Each glyph is defined once and reused with
+            `<use>`; characters without an outline are kept as text.
+        schemes : dict[str, ColorScheme], optional
+            Color schemes selected by the viewer's `prefers-color-scheme`,
+            e.g. {'light': Theme.CATPPUCCIN_LATTE} (default is None). The
+            colors are then emitted as CSS custom properties, with `theme`
+            as the default, so one document follows the viewer's preference.
         """
         self.width:     int = width
         self.height:    int = height
         self.theme:     ColorScheme = theme
+        self.schemes:   dict[str, ColorScheme] = dict(schemes or {})
         self.content:   list[str] = []
+        self._sink:     TextIO | None = sink
+        self._owns_sink: bool = False
+        self._started:  bool = False
+        self.codepoints: set[int] = set()
+        self.font_sizes: dict[str, float] = {}
+        self.outlines:  GlyphOutlines | None = GlyphOutlines() if outlines else None
+        self._glyph_paths: dict[int, str] = {}
+        self._recordings: list[list[str]] = []
         self._init_svg()
+        # number of elements emitted by _init_svg, the ones save_variants replaces
+        self._header_size: int = len(self.content)
+
+    @classmethod
+    def to_file(
+        cls,
+        filename: str,
+        width: int = 1000,
+        height: int = 600,
+        theme: ColorScheme = Theme.CATPPUCCIN_MOCHA,
+    ) -> 'SvgGenerator':
+        """
+        Create a generator streaming the document straight to a buffered file.
+
+        Use it as a context manager, or call `close` once every element was
+        created.
+
+        Parameters
+        ----------
+        filename : str
+            Output filename for the SVG file
+        width : int, optional
+            Width of the SVG canvas in pixels (default is 1000)
+        height : int, optional
+            Height of the SVG canvas in pixels (default is 600)
+        theme : ColorScheme, optional
+            Color scheme to use for styling (default is Theme.CATPPUCCIN_MOCHA)
+
+        Returns
+        -------
+        SvgGenerator
+            A generator writing to the file
+
+        Raises
+        ------
+        IOError
+            If the file cannot be opened
+        """
+        svg = cls(width, height, theme, open(filename, 'w', buffering=STREAM_BUFFER_SIZE))
+        svg._owns_sink = True
+        return svg
+
+    def __enter__(self) -> 'SvgGenerator':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _emit(
+        self,
+        element: str,
+    ) -> None:
+        """
+        Add an element to the document, writing it out when streaming.
+
+        Parameters
+        ----------
+        element : str
+            The element as an SVG string
+
+        Returns
+        -------
+        None
+        """
+        if '<text' in element:
+            self.codepoints |= used_codepoints(element)
+        for recording in self._recordings:
+            recording.append(element)
+        if self._sink is None:
+            self.content.append(element)
+            return
+        if self._started:
+            self._sink.write('\n')
+        self._sink.write(element)
+        self._started = True
+
+    @contextmanager
+    def recording(self) -> Iterator[list[str]]:
+        """
+        Collect the elements created in the block, which are still emitted.
+
+        Returns
+        -------
+        Iterator[list[str]]
+            Context manager yielding the list the elements are appended to
+        """
+        elements: list[str] = []
+        self._recordings.append(elements)
+        try:
+            yield elements
+        finally:
+            self._recordings.remove(elements)
+
+    def used_glyphs(
+        self,
+        elements: Iterable[str],
+    ) -> list[str]:
+        """
+        Return the glyphs referenced by elements of this generator.
+
+        Parameters
+        ----------
+        elements : Iterable[str]
+            Elements created by the generator, e.g. by a `recording` block
+
+        Returns
+        -------
+        list[str]
+            Sorted hex codepoints of every referenced glyph, empty unless text
+            is drawn as outlines
+        """
+        return sorted({code for element in elements for code in _GLYPH_USE.findall(element)})
+
+    def splice(
+        self,
+        elements: Iterable[str],
+        glyphs: Iterable[str] = (),
+    ) -> None:
+        """
+        Emit elements recorded earlier instead of creating them again.
+
+        Parameters
+        ----------
+        elements : Iterable[str]
+            The recorded elements
+        glyphs : Iterable[str], optional
+            Hex codepoints of the glyphs the elements reference, as returned
+            by `used_glyphs`; their outlines come from the outline cache
+            (default is none)
+
+        Returns
+        -------
+        None
+        """
+        for code in glyphs:
+            glyph = self.outlines.glyph(chr(int(code, 16)))
+            if glyph is not None and glyph[1]:
+                self._glyph_paths[int(code, 16)] = glyph[1]
+        for element in elements:
+            self._emit(element)
+
+    def close(self) -> None:
+        """
+        Complete a streamed document and flush it.
+
+        The sink is closed if it was opened by `to_file`. Does nothing when the
+        generator is not streaming or was already closed.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        IOError
+            If there is an error writing to the sink
+        """
+        if self._sink is None:
+            return
+        if self._glyph_paths:
+            self._emit(self._glyph_defs())
+        sink, self._sink = self._sink, None
+        sink.write('\n</svg>')
+        if self._owns_sink:
+            sink.close()
+        else:
+            sink.flush()
 
     def _init_svg(self) -> None:
         """
@@ -49,7 +294,7 @@ class SvgGenerator:
         -------
         None
         """
-        self.content.append('<?xml version="1.0" encoding="UTF-8"?>')
+        self._emit('<?xml version="1.0" encoding="UTF-8"?>')
 
     def _create_svg_tag(self) -> None:
         """
@@ -59,8 +304,15 @@ class SvgGenerator:
         -------
         None
         """
-        svg_tag = f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {self.width} {self.height}">'
-        self.content.append(svg_tag)
+        self._emit(self._svg_tag(self.width, self.height))
+
+    @staticmethod
+    def _svg_tag(
+        width: int,
+        height: int,
+    ) -> str:
+        """Return the SVG root tag for the given dimensions."""
+        return f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}">'
 
     def _create_style_tag(self) -> None:
         """
@@ -70,109 +322,141 @@ class SvgGenerator:
         -------
         None
         """
-        t = self.theme
-        style = f'''<style>
+        style = self._style_tag(self.theme, self.schemes)
+        self.font_sizes = {name: float(size) for name, size in _FONT_SIZE.findall(style)}
+        self._emit(style)
+
+    @staticmethod
+    def _custom_properties(
+        theme: ColorScheme,
+    ) -> str:
+        """Return the `:root` rule declaring the colors of a scheme as custom properties."""
+        declarations = ''.join(
+            f'\n                    --{field.name}: {getattr(theme, field.name)};' for field in fields(ColorScheme)
+        )
+        return f':root {{{declarations}\n                }}'
+
+    @staticmethod
+    def _style_tag(
+        t: ColorScheme,
+        schemes: dict[str, ColorScheme] | None = None,
+    ) -> str:
+        """
+        Return the style tag of a color scheme.
+
+        With `schemes`, the colors are declared as custom properties, those of
+        `t` by default and those of each scheme under its
+        `prefers-color-scheme` media query, and the rules refer to them.
+        """
+        properties = ''
+        if schemes:
+            properties = '\n                ' + SvgGenerator._custom_properties(t) + ''.join(
+                f'\n                @media (prefers-color-scheme: {preference}) {{\n                '
+                + SvgGenerator._custom_properties(scheme) + '\n                }'
+                for preference, scheme in schemes.items()
+            )
+            t = ColorScheme(**{field.name: f'var(--{field.name})' for field in fields(ColorScheme)})
+        return f'''<style>{properties}
                 .ascii {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.ascii};
                     font-weight: normal;
                 }}
                 .key {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 12px;
                     fill: {t.key};
                     font-weight: normal;
                 }}
                 .value {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 12px;
                     fill: {t.value};
                     font-weight: normal;
                 }}
                 .cc {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 12px;
                     fill: {t.cc};
                     font-weight: normal;
                 }}
                 .prompt {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.prompt};
                     font-weight: normal;
                 }}
                 .command {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.command};
                     font-weight: normal;
                 }}
                 .string {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.string};
                     font-weight: normal;
                 }}
                 .comment {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.comment};
                     font-style: normal;
                 }}
                 .error {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.error};
                     font-weight: normal;
                 }}
                 .success {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.success};
                 }}
                 .warning {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.warning};
                     font-weight: normal;
                 }}
                 .highlight {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.highlight};
                     font-weight: normal;
                 }}
                 .dim {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.dim};
                 }}
                 .accent1 {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.accent1};
                     font-weight: normal;
                 }}
                 .accent2 {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.accent2};
                     font-weight: normal;
                 }}
                 .accent3 {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 14px;
                     fill: {t.accent3};
                     font-weight: normal;
                 }}
                 .separator {{
-                    font-family: JetBrains Mono, monospace;
+                    font-family: {FONT_STACK};
                     font-size: 12px;
                     fill: {t.separator};
                 }}
             </style>'''
-        self.content.append(style)
 
     def _create_rect_tag(self) -> None:
         """
@@ -182,7 +466,125 @@ class SvgGenerator:
         -------
         None
         """
-        self.content.append(f'<rect width="100%" height="100%" fill="{self.theme.background}"/>')
+        self._emit(self._rect_tag(self.theme, self.schemes))
+
+    @staticmethod
+    def _rect_tag(
+        theme: ColorScheme,
+        schemes: dict[str, ColorScheme] | None = None,
+    ) -> str:
+        """Return the background rectangle of a color scheme."""
+        if schemes:
+            # presentation attributes do not resolve var(), a style attribute does
+            return '<rect width="100%" height="100%" style="fill: var(--background)"/>'
+        return f'<rect width="100%" height="100%" fill="{theme.background}"/>'
+
+    def _outline_run(
+        self,
+        x: int | float,
+        y: int | float,
+        text: str,
+        text_class: str,
+        id: str | None = None,
+    ) -> tuple[str, float]:
+        """
+        Draw a run of text as references to glyph outlines.
+
+        Parameters
+        ----------
+        x : int or float
+            X-coordinate of the start of the run
+        y : int or float
+            Y-coordinate of the baseline
+        text : str
+            Text of the run
+        text_class : str
+            CSS class of the run, which sets its fill and font size
+        id : str, optional
+            Identificator of the group holding the run
+
+        Returns
+        -------
+        tuple[str, float]
+            The SVG elements of the run and its width in pixels
+        """
+        metrics = self.outlines.metrics
+        scale = self.font_sizes.get(text_class, DEFAULT_FONT_SIZE) / metrics['units_per_em']
+        uses = []
+        fallback = []
+        advance = 0
+        for char in text:
+            glyph = self.outlines.glyph(char)
+            if glyph is None:
+                fallback.append(
+                    f'<text x="{_number(x + advance * scale)}" y="{_number(y)}" class="{text_class}">{char}</text>'
+                )
+                advance += metrics['advance']
+                continue
+            width, path = glyph
+            if path:
+                self._glyph_paths[ord(char)] = path
+                uses.append(f'<use href="#g{ord(char):x}" x="{advance}"/>')
+            advance += width
+
+        id_str = f' id="{id}"' if id else ''
+        group = (
+            f'<g class="{text_class}"{id_str} '
+            f'transform="translate({_number(x)} {_number(y)}) scale({_number(scale)} {_number(-scale)})">'
+            f'{"".join(uses)}</g>'
+        ) if uses or id else ''
+        return group + ''.join(fallback), advance * scale
+
+    def _glyph_defs(self) -> str:
+        """
+        Define every glyph outline referenced so far, and persist the outline cache.
+
+        Returns
+        -------
+        str
+            The defs element
+        """
+        self.outlines.save()
+        paths = ''.join(f'<path id="g{codepoint:x}" d="{path}"/>' for codepoint, path in sorted(self._glyph_paths.items()))
+        return f'<defs>{paths}</defs>'
+
+    def embed_font(
+        self,
+        text: str = '',
+    ) -> FontSubset:
+        """
+        Embed a subset of the bundled JetBrains Mono holding the glyphs drawn so far.
+
+        The font is added as a second style element, which applies to the whole
+        document, so it must be called after the last text element is created.
+
+        Parameters
+        ----------
+        text : str, optional
+            Characters to include on top of the drawn ones, e.g. every character
+            a value filled in later may use (default is '')
+
+        Returns
+        -------
+        FontSubset
+            The embedded subset
+
+        Raises
+        ------
+        ValueError
+            If the bundled font has no glyph for a drawn character, which
+            would then be drawn with whatever monospace font the viewer has
+        ImportError
+            If fontTools is needed to build the subset and is not installed
+        """
+        font = subset_font(self.codepoints | {ord(char) for char in text})
+        if font.missing:
+            raise ValueError(
+                f"JetBrains Mono has no glyph for {''.join(map(chr, sorted(font.missing)))!r}; "
+                "add a shape to fonts.geometry or use another font mode"
+            )
+        self._emit(f'<style>{font.css()}</style>')
+        return font
 
     def create_text_element(
         self,
@@ -213,13 +615,18 @@ class SvgGenerator:
         str
             The generated text element as an SVG string
         """
-        id_str = ' id="{id}" ' if id else ''
+        if self.outlines is not None:
+            text_element, _ = self._outline_run(x, y, text, text_class, id)
+            self._emit(text_element)
+            return text_element
+
+        id_str = f' id="{id}"' if id else ''
         text_element = (
-            f'<text x="{x}" y="{y}" class="{text_class}"{id_str} xml:space="preserve">'
-            f'<tspan>{text}</tspan>'
+            f'<text x="{x}" y="{y}" class="{text_class}" xml:space="preserve">'
+            f'<tspan{id_str}>{text}</tspan>'
             f'</text>'
         )
-        self.content.append(text_element)
+        self._emit(text_element)
         return text_element
 
     def create_colored_text(
@@ -245,13 +652,22 @@ class SvgGenerator:
         str
             The generated text element as an SVG string
         """
-        text_element = f'<text x="{x}" y="{y}" xml:space="preserve">'
-
-        for text, class_name in segments:
-            text_element += f'<tspan class="{class_name}">{text}</tspan>'
-
-        text_element += '</text>'
-        self.content.append(text_element)
+        if self.outlines is not None:
+            runs = []
+            for text, class_name in segments:
+                run, width = self._outline_run(x, y, text, class_name)
+                runs.append(run)
+                x += width
+            text_element = ''.join(runs)
+            self._emit(text_element)
+            return text_element
+
+        text_element = ''.join([
+            f'<text x="{x}" y="{y}" xml:space="preserve">',
+            *(f'<tspan class="{class_name}">{text}</tspan>' for text, class_name in segments),
+            '</text>',
+        ])
+        self._emit(text_element)
         return text_element
 
     def create_multiple_tspan(
@@ -283,14 +699,23 @@ class SvgGenerator:
         str
             The generated text element with multiple tspan as an SVG string
         """
-        text_element = f'<text x="{x}" y="{y}" class="{text_class}" xml:space="preserve">'
-
-        for i, line in enumerate(text_lines):
-            dy = 0 if i == 0 else line_height
-            text_element += f'<tspan x="{x}" dy="{dy}">{line}</tspan>\n'
-
-        text_element += '</text>'
-        self.content.append(text_element)
+        if self.outlines is not None:
+            text_element = ''.join(
+                self._outline_run(x, y + i * line_height, line, text_class)[0]
+                for i, line in enumerate(text_lines)
+            )
+            self._emit(text_element)
+            return text_element
+
+        text_element = ''.join([
+            f'<text x="{x}" y="{y}" class="{text_class}" xml:space="preserve">',
+            *(
+                f'<tspan x="{x}" dy="{0 if i == 0 else line_height}">{line}</tspan>\n'
+                for i, line in enumerate(text_lines)
+            ),
+            '</text>',
+        ])
+        self._emit(text_element)
         return text_element
 
     def create_ascii_logo(
@@ -321,12 +746,30 @@ class SvgGenerator:
         for i, (line, color_class) in enumerate(logo_lines):
             self.create_text_element(x, y + (i * line_height), line, color_class)
 
+    def _document(
+        self,
+        defs: str | None,
+    ) -> Iterator[str]:
+        """Yield the pieces of the complete document, in order."""
+        for i, element in enumerate(self.content):
+            if i:
+                yield '\n'
+            yield element
+        if defs:
+            yield '\n' + defs
+        yield '\n</svg>'
+
+    @trace.span('save')
     def save(
         self,
         filename: str = "output.svg",
-    ) -> None:
+    ) -> bool:
         """
-        Save the SVG content to a file.
+        Save the SVG content to a file, unless it already holds the same document.
+
+        The elements are hashed, then written one by one if the file changed,
+        rather than joined into a single string first. Streaming generators
+        write to their sink instead, see `close`.
 
         Parameters
         ----------
@@ -335,13 +778,86 @@ class SvgGenerator:
 
         Returns
         -------
-        None
+        bool
+            True if the file was written, False if its contents were identical
 
         Raises
         ------
         IOError
             If there is an error writing to the file
+        ValueError
+            If the generator is streaming to a sink
+        """
+        if self._sink is not None:
+            raise ValueError('A streaming SvgGenerator writes to its sink, call close() instead')
+
+        defs = self._glyph_defs() if self._glyph_paths else None
+        digest = hashlib.sha256()
+        for piece in self._document(defs):
+            digest.update(piece.encode('utf-8'))
+        if content_unchanged(filename, digest.hexdigest()):
+            return False
+
+        with open(filename, 'w', encoding='utf-8', newline='', buffering=STREAM_BUFFER_SIZE) as f:
+            for piece in self._document(defs):
+                f.write(piece)
+        record_content_hash(filename, digest.hexdigest())
+        return True
+
+    @trace.span('save_variants')
+    def save_variants(
+        self,
+        variants: Iterable[Variant],
+    ) -> int:
+        """
+        Save the document once per variant, with the variant's theme and size.
+
+        The layout is computed once: every variant shares the same element
+        stream, joined and encoded a single time, and only the root tag, style
+        block and background differ. Text laid out by the generator keeps its
+        positions, so a smaller size crops the canvas and a larger one extends
+        its background. Files already holding their variant are left untouched.
+
+        Parameters
+        ----------
+        variants : Iterable[Variant]
+            The outputs to write
+
+        Returns
+        -------
+        int
+            Number of files written
+
+        Raises
+        ------
+        IOError
+            If there is an error writing to a file
+        ValueError
+            If the generator is streaming to a sink
         """
-        with open(filename, 'w') as f:
-            f.write('\n'.join(self.content))
-            f.write('\n</svg>')
+        if self._sink is not None:
+            raise ValueError('A streaming SvgGenerator writes to its sink, call close() instead')
+
+        body = self.content[self._header_size:]
+        if self._glyph_paths:
+            body.append(self._glyph_defs())
+        body.append('</svg>')
+        encoded = ('\n' + '\n'.join(body)).encode('utf-8')
+        written = 0
+        for variant in variants:
+            header = '\n'.join([
+                self.content[0],
+                self._svg_tag(variant.width or self.width, variant.height or self.height),
+                self._style_tag(variant.theme),
+                self._rect_tag(variant.theme),
+            ]).encode('utf-8')
+            digest = hashlib.sha256(header)
+            digest.update(encoded)
+            if content_unchanged(variant.filename, digest.hexdigest()):
+                continue
+            with open(variant.filename, 'wb', buffering=STREAM_BUFFER_SIZE) as f:
+                f.write(header)
+                f.write(encoded)
+            record_content_hash(variant.filename, digest.hexdigest())
+            written += 1
+        return written
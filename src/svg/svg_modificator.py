@@ -1,7 +1,18 @@
 """SVG modification module for parsing and updating SVG elements with data."""
 
+import json
+import os
+
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
 from lxml import etree
 
+from utils.fileio import atomic_write, locked
+
+# Bumped whenever the layout of the index files changes.
+INDEX_VERSION = 1
+
 
 def svg_overwrite(
     filename: str,
@@ -16,8 +27,8 @@ def svg_overwrite(
     """
     Parse SVG files and update elements with specified data.
 
-    This function reads an SVG file, updates various elements with provided data,
-    and writes the modified content back to the file.
+    This function updates various elements of an SVG file with provided data.
+    Only the text of the changed elements is rewritten, see `patch_svg`.
 
     Parameters
     ----------
@@ -44,25 +55,264 @@ def svg_overwrite(
 
     Raises
     ------
-    etree.XMLSyntaxError
+    expat.ExpatError
         If the SVG file cannot be parsed.
     IOError
         If there is an error writing to the file.
     """
-    tree = etree.parse(filename)
-    root = tree.getroot()
+    updates = {}
+    for element_id, new_text, length in [
+        ('commit_data', commit_data, 22),
+        ('age_data', age_data, 49),
+        ('star_data', star_data, 14),
+        ('repo_data', repo_data, 7),
+        ('contrib_data', contrib_data, 0),
+        ('follower_data', follower_data, 10),
+        #('loc_data', loc_data[2], 9),
+        #('loc_add', loc_data[0], 0),
+        #('loc_del', loc_data[1], 6),
+    ]:
+        updates[element_id], updates[f"{element_id}_dots"] = justify_text(new_text, length)
+
+    patch_svg(filename, updates)
+
+
+def justify_text(
+    new_text: int | str,
+    length: int = 0,
+) -> tuple[str, str]:
+    """
+    Format the text of an SVG element and the dots that justify it.
+
+    Parameters
+    ----------
+    new_text : int or str
+        The new text to be set. If an integer, it will be formatted with commas.
+    length : int, optional
+        The target length for justification. If the new text is shorter, dots
+        will be added to fill the space (default is 0).
+
+    Returns
+    -------
+    tuple[str, str]
+        The formatted text and the text of its `_dots` element.
+    """
+    if isinstance(new_text, int):
+        new_text = f"{new_text:,}"
+
+    new_text = str(new_text)
+    just_len = max(0, length - len(new_text))
+
+    if just_len <= 2:
+        dot_map = {0: '', 1: ' ', 2: '. '}
+        dot_string = dot_map[just_len]
+    else:
+        dot_string = ' ' + ('.' * just_len) + ' '
+
+    return new_text, dot_string
+
+
+def index_filename(
+    filename: str,
+) -> str:
+    """
+    Return the path of the text span index stored next to an SVG file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the SVG file.
+
+    Returns
+    -------
+    str
+        Path to the index file.
+    """
+    return filename + '.idx.json'
+
+
+def build_index(
+    data: bytes,
+) -> dict[str, list[int]]:
+    """
+    Find the byte span of the text of every element that has an id.
+
+    The text of an element is the character data between its start tag and
+    its first child or end tag. Empty-element tags have no span, since their
+    text cannot be set without rewriting the tag.
+
+    Parameters
+    ----------
+    data : bytes
+        The UTF-8 encoded SVG document.
+
+    Returns
+    -------
+    dict[str, list[int]]
+        Element id to the [start, end) byte offsets of its text.
+
+    Raises
+    ------
+    expat.ExpatError
+        If the document cannot be parsed.
+    """
+    parser = expat.ParserCreate()
+    spans: dict[str, list[int]] = {}
+    # id and text offset of the element whose text is being read
+    current: list = [None, None]
+
+    def close_text(end_tag: bool) -> None:
+        element_id, text_start = current
+        end = parser.CurrentByteIndex
+        # an empty-element tag ends right where the next markup starts, not at a '</'
+        if element_id is not None and (not end_tag or data[end:end + 2] == b'</'):
+            spans[element_id] = [end if text_start is None else text_start, end]
+        current[0] = None
+
+    def start_element(name: str, attributes: dict[str, str]) -> None:
+        close_text(False)
+        if 'id' in attributes:
+            current[:] = [attributes['id'], None]
+
+    def character_data(text: str) -> None:
+        if current[0] is not None and current[1] is None:
+            current[1] = parser.CurrentByteIndex
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = lambda name: close_text(True)
+    parser.CharacterDataHandler = character_data
+    parser.Parse(data, True)
+    return spans
+
+
+def load_index(
+    filename: str,
+    data: bytes | None = None,
+) -> dict[str, list[int]]:
+    """
+    Return the text span index of an SVG file, parsing it only if the stored index is stale.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the SVG file.
+    data : bytes, optional
+        Contents of the SVG file, read if not given (default is None).
+
+    Returns
+    -------
+    dict[str, list[int]]
+        Element id to the [start, end) byte offsets of its text.
+
+    Raises
+    ------
+    expat.ExpatError
+        If the index is stale and the file cannot be parsed.
+    """
+    stat = os.stat(filename)
+    try:
+        with open(index_filename(filename), 'r') as f:
+            stored = json.load(f)
+        if (stored['version'], stored['size'], stored['mtime_ns']) == (INDEX_VERSION, stat.st_size, stat.st_mtime_ns):
+            return stored['spans']
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
 
-    justify_format(root, 'commit_data', commit_data, 22)
-    justify_format(root, 'age_data', age_data, 49)
-    justify_format(root, 'star_data', star_data, 14)
-    justify_format(root, 'repo_data', repo_data, 7)
-    justify_format(root, 'contrib_data', contrib_data)
-    justify_format(root, 'follower_data', follower_data, 10)
-    #justify_format(root, 'loc_data', loc_data[2], 9)
-    #justify_format(root, 'loc_add', loc_data[0])
-    #justify_format(root, 'loc_del', loc_data[1], 6)
+    if data is None:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    spans = build_index(data)
+    save_index(filename, spans)
+    return spans
 
-    tree.write(filename, encoding='utf-8', xml_declaration=True)
+
+def save_index(
+    filename: str,
+    spans: dict[str, list[int]],
+) -> None:
+    """
+    Store the text span index of an SVG file, stamped with the file's current state.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the SVG file.
+    spans : dict[str, list[int]]
+        Element id to the [start, end) byte offsets of its text.
+
+    Returns
+    -------
+    None
+    """
+    stat = os.stat(filename)
+    atomic_write(index_filename(filename), json.dumps({
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'spans': spans,
+    }))
+
+
+def patch_svg(
+    filename: str,
+    updates: dict[str, str],
+) -> int:
+    """
+    Replace the text of elements by id, rewriting only their byte spans.
+
+    The spans come from the index stored next to the file, so the document is
+    parsed only when the index is missing or stale. Ids that are not found are
+    ignored, as with `find_and_replace`.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the SVG file.
+    updates : dict[str, str]
+        Element id to its new text, which is escaped for XML.
+
+    Returns
+    -------
+    int
+        Number of elements whose text changed.
+
+    Raises
+    ------
+    expat.ExpatError
+        If the index is stale and the file cannot be parsed.
+    IOError
+        If there is an error reading or writing the files.
+    """
+    with locked(filename):
+        with open(filename, 'rb') as f:
+            data = bytearray(f.read())
+        spans = load_index(filename, bytes(data))
+
+        changes = []
+        for element_id, text in updates.items():
+            if element_id not in spans:
+                continue
+            start, end = spans[element_id]
+            encoded = escape(text).encode('utf-8')
+            if data[start:end] != encoded:
+                changes.append((start, end, encoded))
+        if not changes:
+            return 0
+
+        for start, end, encoded in sorted(changes, reverse=True):
+            data[start:end] = encoded
+
+        shifted = {}
+        for element_id, (start, end) in spans.items():
+            offset = sum(len(encoded) - (change_end - change_start)
+                         for change_start, change_end, encoded in changes if change_start < start)
+            change = next((encoded for change_start, _, encoded in changes if change_start == start), None)
+            length = end - start if change is None else len(change)
+            shifted[element_id] = [start + offset, start + offset + length]
+
+        atomic_write(filename, bytes(data))
+        save_index(filename, shifted)
+    return len(changes)
 
 
 def justify_format(
@@ -98,20 +348,8 @@ def justify_format(
     ValueError
         If the element with the specified ID is not found.
     """
-    if isinstance(new_text, int):
-        new_text = f"{new_text:,}"
-
-    new_text = str(new_text)
+    new_text, dot_string = justify_text(new_text, length)
     find_and_replace(root, element_id, new_text)
-
-    just_len = max(0, length - len(new_text))
-
-    if just_len <= 2:
-        dot_map = {0: '', 1: ' ', 2: '. '}
-        dot_string = dot_map[just_len]
-    else:
-        dot_string = ' ' + ('.' * just_len) + ' '
-
     find_and_replace(root, f"{element_id}_dots", dot_string)
 
 
@@ -0,0 +1,370 @@
+"""Compiled SVG templates, filled with values instead of laying out the document again."""
+
+import hashlib
+import io
+import os
+import pickle
+import re
+
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from style.themes import ColorScheme, Theme
+from svg.optimizer import OptimizationReport, optimize_svg
+from svg.svg_generator import SvgGenerator
+from utils import format
+from utils.fileio import atomic_write, locked
+
+# Bumped whenever the compiled representation changes, invalidating cached templates.
+TEMPLATE_VERSION = 2
+
+_VALUE = '\x00'     # wraps the name of a value placeholder
+_DOTS = '\x01'      # wraps the index of a dot leader placeholder
+_MARKER = re.compile('\x00([^\x00]*)\x00|\x01([0-9]+)\x01')
+_FIELD = re.compile('\x00([^\x00]*)\x00')
+
+
+def placeholder(
+    name: str,
+) -> str:
+    """
+    Return the marker standing for a value while a template is being compiled.
+
+    Parameters
+    ----------
+    name : str
+        Name of the value, as passed to `CompiledTemplate.render`
+
+    Returns
+    -------
+    str
+        The marker, to be used wherever the value is rendered
+    """
+    return _VALUE + name + _VALUE
+
+
+@dataclass
+class Placeholder:
+    """
+    A variable part of a compiled template.
+
+    Attributes
+    ----------
+    kind : str
+        'value' for a value filled in as is, 'dots' for the dot leader of a
+        line whose value changes
+    name : str
+        Name of the value, for 'value' placeholders
+    label : str
+        Label of the line, for 'dots' placeholders
+    pattern : str
+        Value of the line as a format string of value names, for 'dots'
+        placeholders
+    """
+
+    kind:       str
+    name:       str = ''
+    label:      str = ''
+    pattern:    str = ''
+
+    def names(self) -> frozenset[str]:
+        """Return the names of the values the placeholder depends on."""
+        if self.kind == 'value':
+            return frozenset([self.name])
+        return frozenset(_FIELD.findall(self.pattern))
+
+    def fill(
+        self,
+        values: dict[str, str],
+    ) -> bytes:
+        """Return the rendered placeholder for the given values."""
+        if self.kind == 'value':
+            return values[self.name].encode('utf-8')
+        value = _FIELD.sub(lambda match: values[match.group(1)], self.pattern)
+        return format.toDotLine(self.label, value)[2][0].encode('utf-8')
+
+
+@dataclass
+class CompiledTemplate:
+    """
+    A document split into constant byte segments and placeholders.
+
+    Rendering only concatenates precomputed bytes with the filled
+    placeholders. Placeholders whose values did not change since the previous
+    render are reused as they are, so only the dot leaders of changed lines are
+    laid out again.
+
+    Attributes
+    ----------
+    parts : list[bytes | Placeholder]
+        Constant segments and placeholders, in document order
+    key : str
+        Key the template was compiled for
+    report : OptimizationReport | None
+        Savings of the optimizer pass, None if the template was not optimized
+    """
+
+    parts:      list[bytes | Placeholder]
+    key:        str = ''
+    report:     OptimizationReport | None = None
+    _last:      dict[str, str] = field(default_factory=dict, init=False, repr=False)
+    _rendered:  list[bytes] = field(default_factory=list, init=False, repr=False)
+
+    def names(self) -> set[str]:
+        """
+        Return the names of every value the template needs.
+
+        Returns
+        -------
+        set[str]
+            Value names
+        """
+        return {name for part in self.parts if isinstance(part, Placeholder) for name in part.names()}
+
+    def render(
+        self,
+        values: dict[str, object],
+    ) -> bytes:
+        """
+        Fill the template with values.
+
+        Parameters
+        ----------
+        values : dict[str, object]
+            Value of every placeholder name; values are converted with str()
+
+        Returns
+        -------
+        bytes
+            The UTF-8 encoded document
+
+        Raises
+        ------
+        KeyError
+            If a placeholder has no value
+        """
+        values = {name: str(value) for name, value in values.items()}
+        changed = {name for name in values.keys() | self._last.keys() if values.get(name) != self._last.get(name)}
+        if not self._rendered:
+            self._rendered = [part if isinstance(part, bytes) else b'' for part in self.parts]
+            changed = self.names()
+
+        for i, part in enumerate(self.parts):
+            if isinstance(part, Placeholder) and part.names() & changed:
+                self._rendered[i] = part.fill(values)
+        self._last = values
+        return b''.join(self._rendered)
+
+    def save(
+        self,
+        filename: str,
+    ) -> None:
+        """
+        Store the compiled template.
+
+        Parameters
+        ----------
+        filename : str
+            Path of the template file
+
+        Returns
+        -------
+        None
+        """
+        atomic_write(filename, pickle.dumps((TEMPLATE_VERSION, self.key, self.parts, self.report)))
+
+    @classmethod
+    def load(
+        cls,
+        filename: str,
+        key: str,
+    ) -> 'CompiledTemplate | None':
+        """
+        Load a stored template if it was compiled for the given key.
+
+        Parameters
+        ----------
+        filename : str
+            Path of the template file
+        key : str
+            Expected template key
+
+        Returns
+        -------
+        CompiledTemplate | None
+            The template, or None if it is missing, stale or unreadable
+        """
+        try:
+            with open(filename, 'rb') as f:
+                version, stored_key, parts, report = pickle.load(f)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return None
+        if version != TEMPLATE_VERSION or stored_key != key:
+            return None
+        return cls(parts, key, report)
+
+
+class TemplateRecorder(SvgGenerator):
+    """
+    SVG generator recording a layout drawn with `placeholder` values.
+
+    Lines created by `create_colored_text` whose value holds placeholders get
+    their dot leader replaced by a 'dots' placeholder, so it can be laid out
+    again for the actual value.
+    """
+
+    def __init__(
+        self,
+        width: int = 1000,
+        height: int = 600,
+        theme: ColorScheme = Theme.CATPPUCCIN_MOCHA,
+        schemes: dict[str, ColorScheme] | None = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        width : int, optional
+            Width of the SVG canvas in pixels (default is 1000)
+        height : int, optional
+            Height of the SVG canvas in pixels (default is 600)
+        theme : ColorScheme, optional
+            Color scheme to use for styling (default is Theme.CATPPUCCIN_MOCHA)
+        schemes : dict[str, ColorScheme], optional
+            Color schemes selected by `prefers-color-scheme`, see
+            `SvgGenerator` (default is None)
+        """
+        self._buffer:   io.StringIO = io.StringIO()
+        self._leaders:  list[Placeholder] = []
+        super().__init__(width, height, theme, sink=self._buffer, schemes=schemes)
+
+    def create_colored_text(
+        self,
+        x: int | float,
+        y: int | float,
+        segments: list[tuple[str, str]],
+    ) -> str:
+        if any(_VALUE in text for text, _ in segments):
+            segments = list(segments)
+            for i, (text, class_name) in enumerate(segments):
+                if text and text.strip('.') == '' and i >= 1:
+                    label = segments[0][0]
+                    pattern = next(value for value, value_class in segments[i + 1:] if _VALUE in value)
+                    segments[i] = (_DOTS + str(len(self._leaders)) + _DOTS, class_name)
+                    self._leaders.append(Placeholder('dots', label=label, pattern=pattern))
+                    break
+        return super().create_colored_text(x, y, segments)
+
+    def compile(
+        self,
+        key: str = '',
+        optimize: bool = False,
+    ) -> CompiledTemplate:
+        """
+        Complete the recorded document and split it into a template.
+
+        Parameters
+        ----------
+        key : str, optional
+            Key the template is compiled for (default is '')
+        optimize : bool, optional
+            Run `optimize_svg` on the document before splitting it, so every
+            render is optimized for free (default is False)
+
+        Returns
+        -------
+        CompiledTemplate
+            The compiled template
+        """
+        self.close()
+        document = self._buffer.getvalue()
+        report = None
+        if optimize:
+            document, report = optimize_svg(document)
+        parts: list[bytes | Placeholder] = []
+        position = 0
+        for match in _MARKER.finditer(document):
+            parts.append(document[position:match.start()].encode('utf-8'))
+            if match.group(1) is not None:
+                parts.append(Placeholder('value', name=match.group(1)))
+            else:
+                parts.append(self._leaders[int(match.group(2))])
+            position = match.end()
+        parts.append(document[position:].encode('utf-8'))
+        return CompiledTemplate([part for part in parts if part != b''], key, report)
+
+
+def template_key(
+    *sources: str | bytes,
+) -> str:
+    """
+    Return the key of a template compiled from the given inputs.
+
+    Parameters
+    ----------
+    *sources : str | bytes
+        Everything the layout depends on, e.g. the configuration file, the
+        theme and the source of the layout code
+
+    Returns
+    -------
+    str
+        Hex digest identifying the inputs
+    """
+    digest = hashlib.sha256(str(TEMPLATE_VERSION).encode('utf-8'))
+    for source in sources:
+        data = source.encode('utf-8') if isinstance(source, str) else source
+        digest.update(len(data).to_bytes(8, 'little') + data)
+    return digest.hexdigest()
+
+
+def load_or_compile(
+    directory: str,
+    key: str,
+    layout: Callable[[TemplateRecorder], None],
+    width: int = 1000,
+    height: int = 600,
+    theme: ColorScheme = Theme.CATPPUCCIN_MOCHA,
+    optimize: bool = False,
+    schemes: dict[str, ColorScheme] | None = None,
+) -> CompiledTemplate:
+    """
+    Return the template stored for a key, compiling and storing it if needed.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the compiled templates
+    key : str
+        Key of the template, see `template_key`
+    layout : Callable[[TemplateRecorder], None]
+        Draws the document on the recorder, using `placeholder` values
+    width : int, optional
+        Width of the SVG canvas in pixels (default is 1000)
+    height : int, optional
+        Height of the SVG canvas in pixels (default is 600)
+    theme : ColorScheme, optional
+        Color scheme to use for styling (default is Theme.CATPPUCCIN_MOCHA)
+    optimize : bool, optional
+        Optimize the compiled document, see `TemplateRecorder.compile`
+        (default is False). It should be part of the key.
+    schemes : dict[str, ColorScheme], optional
+        Color schemes selected by `prefers-color-scheme`, see `SvgGenerator`
+        (default is None). They should be part of the key.
+
+    Returns
+    -------
+    CompiledTemplate
+        The template for the key
+    """
+    filename = os.path.join(directory, key + '.tpl')
+    template = CompiledTemplate.load(filename, key)
+    if template is not None:
+        return template
+
+    recorder = TemplateRecorder(width, height, theme, schemes)
+    layout(recorder)
+    template = recorder.compile(key, optimize)
+    os.makedirs(directory, exist_ok=True)
+    with locked(filename):
+        template.save(filename)
+    return template
@@ -0,0 +1,216 @@
+"""File utilities for sharing cache files safely between processes."""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of the same process are serialized
+    fcntl = None
+
+_registry_lock = threading.Lock()
+_thread_locks: dict[str, threading.RLock] = {}
+# lock file path -> [file descriptor, nesting depth]
+_held: dict[str, list[int]] = {}
+
+
+@contextmanager
+def locked(
+    path: str,
+    shared: bool = False,
+) -> Iterator[None]:
+    """
+    Hold an advisory lock on a file for the duration of the block.
+
+    The lock is taken on a `<path>.lock` sibling, so it survives the file being
+    replaced by `atomic_write`. It is reentrant within a process: nested blocks
+    on the same path only take the lock once, and threads of the process are
+    serialized with each other.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to lock.
+    shared : bool, optional
+        Take a shared (reader) lock instead of an exclusive one (default: False).
+        Ignored when the process already holds a lock on the path.
+
+    Returns
+    -------
+    Iterator[None]
+        Context manager holding the lock.
+    """
+    lock_path = os.path.abspath(path) + '.lock'
+    with _registry_lock:
+        thread_lock = _thread_locks.setdefault(lock_path, threading.RLock())
+
+    with thread_lock:
+        if lock_path not in _held:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            _held[lock_path] = [fd, 0]
+        _held[lock_path][1] += 1
+        try:
+            yield
+        finally:
+            _held[lock_path][1] -= 1
+            if _held[lock_path][1] == 0:
+                fd, _ = _held.pop(lock_path)
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+
+def atomic_write(
+    path: str,
+    data: str | bytes,
+) -> None:
+    """
+    Replace a file with new contents so readers never see a partial file.
+
+    The data is written and synced to a temporary file in the same directory,
+    which is then renamed over the target.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to write.
+    data : str | bytes
+        New contents; text is encoded as UTF-8.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    IOError
+        If the temporary file cannot be written or renamed.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def hash_filename(
+    path: str,
+) -> str:
+    """Return the path of the sidecar storing the content hash of a file."""
+    return path + '.sha256.json'
+
+
+def content_unchanged(
+    path: str,
+    digest: str,
+) -> bool:
+    """
+    Tell whether a file already holds contents with the given SHA-256.
+
+    The hash stored by `record_content_hash` is trusted while the size and
+    modification time of the file match it. Otherwise the file itself is hashed,
+    e.g. in a fresh checkout.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+    digest : str
+        Hex SHA-256 of the new contents.
+
+    Returns
+    -------
+    bool
+        True if the file exists with exactly these contents.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    try:
+        with open(hash_filename(path), 'r') as f:
+            stored = json.load(f)
+        if stored['size'] == stat.st_size and stored['mtime_ns'] == stat.st_mtime_ns:
+            return stored['sha256'] == digest
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        pass
+    with open(path, 'rb') as f:
+        current = hashlib.sha256(f.read()).hexdigest()
+    if current == digest:
+        record_content_hash(path, current)
+    return current == digest
+
+
+def record_content_hash(
+    path: str,
+    digest: str,
+) -> None:
+    """
+    Store the SHA-256 of a file that was just written, for `content_unchanged`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+    digest : str
+        Hex SHA-256 of its contents.
+
+    Returns
+    -------
+    None
+    """
+    stat = os.stat(path)
+    atomic_write(hash_filename(path), json.dumps(
+        {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    ))
+
+
+def write_if_changed(
+    path: str,
+    data: str | bytes,
+) -> bool:
+    """
+    Replace a file with `atomic_write`, unless it already holds the same bytes.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to write.
+    data : str | bytes
+        New contents; text is encoded as UTF-8.
+
+    Returns
+    -------
+    bool
+        True if the file was written, False if it was left untouched.
+
+    Raises
+    ------
+    IOError
+        If the file cannot be read or written.
+    """
+    data = data.encode('utf-8') if isinstance(data, str) else data
+    digest = hashlib.sha256(data).hexdigest()
+    if content_unchanged(path, digest):
+        return False
+    atomic_write(path, data)
+    record_content_hash(path, digest)
+    return True
@@ -1,7 +1,10 @@
 """Formatting utils, mainly for beautifying strings."""
 
 import datetime
-from dateutil import relativedelta
+
+from utils.lazy import lazy_import
+
+relativedelta = lazy_import('dateutil.relativedelta')
 
 def toPlural(
     unit: int
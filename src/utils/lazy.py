@@ -0,0 +1,44 @@
+"""Deferred imports, keeping heavy modules off the startup path until they are used."""
+
+import importlib.util
+import sys
+
+from types import ModuleType
+
+
+def lazy_import(
+    name: str,
+) -> ModuleType:
+    """
+    Return a module that is only executed when one of its attributes is first used.
+
+    The module is registered in `sys.modules` right away, so later imports of
+    the same name get the same object, and loading it completes on first
+    attribute access.
+
+    Parameters
+    ----------
+    name : str
+        Absolute name of the module, e.g. 'requests'.
+
+    Returns
+    -------
+    ModuleType
+        The module, loaded already or pending.
+
+    Raises
+    ------
+    ModuleNotFoundError
+        If the module cannot be found.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,271 @@
+"""Memory profiling with tracemalloc snapshots taken at stage boundaries."""
+
+import linecache
+import sys
+import threading
+import tracemalloc
+
+from dataclasses import dataclass, field
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is then not reported
+    resource = None
+
+_PROFILER: 'MemoryProfiler | None' = None
+# allocations made by the profiling machinery itself, left out of the reports
+_IGNORED = (
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+)
+
+
+def reset_peak_rss() -> bool:
+    """
+    Restart the peak RSS of this process from its current RSS.
+
+    Only Linux can do this, by writing 5 to /proc/self/clear_refs; the peak
+    is then read from VmHWM in /proc/self/status.
+
+    Returns
+    -------
+    bool
+        True if the peak was reset, False where it only ever grows
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as refs:
+            refs.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss() -> int | None:
+    """
+    Return the highest resident set size of this process since the last `reset_peak_rss`.
+
+    Without a successful reset, this is the peak of the whole process so far.
+
+    Returns
+    -------
+    int | None
+        Peak RSS in bytes, or None where neither /proc nor the resource
+        module is available
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@dataclass
+class StageMemory:
+    """
+    Memory use of a stage, the code run between two checkpoints.
+
+    Attributes
+    ----------
+    name : str
+        Name of the stage, given to the checkpoint ending it
+    current : int
+        Bytes traced at the end of the stage
+    peak : int
+        Most bytes traced at any time during the stage
+    peak_rss : int | None
+        Peak RSS of the process during the stage, in bytes, or since the
+        process started where the peak cannot be reset
+    top : list[tuple[str, int, int]]
+        Source lines that allocated the most during the stage: location, bytes
+        and blocks still allocated at its end, relative to its start
+    """
+
+    name:       str
+    current:    int
+    peak:       int
+    peak_rss:   int | None
+    top:        list[tuple[str, int, int]] = field(default_factory=list)
+
+
+class MemoryProfiler:
+    """
+    Traces Python allocations and records how every stage changed them.
+
+    Attributes
+    ----------
+    limit : int
+        Number of allocation sites kept per stage
+    stages : list[StageMemory]
+        Stages ended so far, in order
+    rss_per_stage : bool
+        Whether the peak RSS is reset at every stage, so each stage reports
+        its own peak rather than the process peak so far
+    """
+
+    def __init__(
+        self,
+        limit: int = 10,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        limit : int, optional
+            Number of allocation sites kept per stage (default is 10)
+        """
+        self.limit:     int = limit
+        self.stages:    list[StageMemory] = []
+        self.rss_per_stage: bool = False
+        self._lock:     threading.Lock = threading.Lock()
+        self._previous: tracemalloc.Snapshot | None = None
+
+    def start(
+        self,
+        frames: int = 1,
+    ) -> None:
+        """
+        Start tracing allocations; the first stage begins now.
+
+        Parameters
+        ----------
+        frames : int, optional
+            Frames stored per allocation (default is 1, the allocating line)
+        """
+        tracemalloc.start(frames)
+        self._previous = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        tracemalloc.reset_peak()
+        self.rss_per_stage = reset_peak_rss()
+
+    def checkpoint(
+        self,
+        name: str,
+    ) -> StageMemory:
+        """
+        End the current stage and begin the next one.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage that ends
+
+        Returns
+        -------
+        StageMemory
+            Memory use of the stage
+        """
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+            top = []
+            growth = sorted(snapshot.compare_to(self._previous, 'lineno'), key=lambda stat: -stat.size_diff)
+            for stat in growth[:self.limit]:
+                if stat.size_diff <= 0:
+                    break
+                frame = stat.traceback[0]
+                top.append((f'{frame.filename}:{frame.lineno}', stat.size_diff, stat.count_diff))
+            stage = StageMemory(name, current, peak, peak_rss(), top)
+            self.stages.append(stage)
+            self._previous = snapshot
+            tracemalloc.reset_peak()
+            if self.rss_per_stage:
+                reset_peak_rss()
+        return stage
+
+    def stop(self) -> None:
+        """Stop tracing allocations and free the traces."""
+        self._previous = None
+        tracemalloc.stop()
+
+    def report(self) -> str:
+        """
+        Return the memory use of every stage and its top allocation sites.
+
+        Returns
+        -------
+        str
+            A summary table of the stages, then the allocation sites of each
+        """
+        rss_label = 'peak RSS' if self.rss_per_stage else 'peak RSS so far'
+        width = max(10, len(rss_label))
+        lines = [f'{"traced":>10} {"peak":>10} {rss_label:>{width}}  stage']
+        for stage in self.stages:
+            rss = f'{stage.peak_rss / 2**20:>{width - 3}.1f} MB' if stage.peak_rss is not None else f'{"-":>{width}}'
+            lines.append(f'{stage.current / 2**20:>7.1f} MB {stage.peak / 2**20:>7.1f} MB {rss}  {stage.name}')
+        for stage in self.stages:
+            if stage.top:
+                lines.append(f'\n{stage.name}: largest allocations still held')
+                for location, size, count in stage.top:
+                    lines.append(f'{size / 1024:>10.1f} KB {count:>8} blocks  {location}')
+        return '\n'.join(lines)
+
+
+def checkpoint(
+    name: str,
+) -> StageMemory | None:
+    """
+    End the stage of the running memory profile, if any.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage that ends
+
+    Returns
+    -------
+    StageMemory | None
+        Memory use of the stage, or None if memory profiling is off
+    """
+    profiler = _PROFILER
+    if profiler is None:
+        return None
+    return profiler.checkpoint(name)
+
+
+def start_memory_profile(
+    limit: int = 10,
+    frames: int = 1,
+) -> MemoryProfiler:
+    """
+    Start tracing allocations in this process.
+
+    Parameters
+    ----------
+    limit : int, optional
+        Number of allocation sites kept per stage (default is 10)
+    frames : int, optional
+        Frames stored per allocation (default is 1)
+
+    Returns
+    -------
+    MemoryProfiler
+        The profiler the stages are recorded by
+    """
+    global _PROFILER
+    _PROFILER = MemoryProfiler(limit)
+    _PROFILER.start(frames)
+    return _PROFILER
+
+
+def stop_memory_profile() -> MemoryProfiler | None:
+    """
+    Stop tracing allocations.
+
+    Returns
+    -------
+    MemoryProfiler | None
+        The profiler holding every stage, None if profiling was not started
+    """
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
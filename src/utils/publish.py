@@ -0,0 +1,150 @@
+"""Output stage writing precompressed, content-addressed copies of the generated files."""
+
+import gzip
+import hashlib
+import json
+import os
+
+from utils import trace
+from utils.fileio import atomic_write, locked
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, the .br siblings are skipped without it
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+HASH_LENGTH: int = 12
+
+
+def compress_gzip(
+    data: bytes,
+) -> bytes:
+    """
+    Compress with gzip at maximum level, without a timestamp so output is reproducible.
+
+    Parameters
+    ----------
+    data : bytes
+        Data to compress.
+
+    Returns
+    -------
+    bytes
+        The gzip stream.
+    """
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(
+    data: bytes,
+) -> bytes | None:
+    """
+    Compress with brotli at maximum quality, in text mode.
+
+    Parameters
+    ----------
+    data : bytes
+        Data to compress.
+
+    Returns
+    -------
+    bytes | None
+        The brotli stream, or None if brotli is not installed.
+    """
+    if brotli is None:
+        return None
+    return brotli.compress(data, mode=brotli.MODE_TEXT, quality=11, lgwin=24)
+
+
+@trace.span('publish')
+def publish(
+    filename: str,
+    manifest: str | None = None,
+) -> dict[str, object]:
+    """
+    Write precompressed siblings and a content-addressed copy of a file.
+
+    Next to `name.ext` this writes `name.ext.gz` and `name.ext.br`, plus
+    `name.<hash>.ext` with its own `.gz` and `.br`. The hashed copies never
+    change, so they can be served with long-lived cache headers. The entry of
+    the file in the manifest records the hash, the sizes and the hashed copy
+    of the previous contents, which is kept until the next publish so pages
+    still referring to it keep working; older copies are removed. Without
+    brotli, `.br` siblings left by an earlier run are removed rather than
+    served with outdated contents. Nothing is recompressed when the file has
+    the hash recorded in the manifest.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the file to publish.
+    manifest : str, optional
+        Path of the JSON manifest, 'manifest.json' next to the file if None
+        (default: None).
+
+    Returns
+    -------
+    dict[str, object]
+        The manifest entry of the file.
+
+    Raises
+    ------
+    IOError
+        If a file cannot be read or written.
+    """
+    directory, name = os.path.split(filename)
+    manifest = manifest or os.path.join(directory, 'manifest.json')
+    stem, extension = os.path.splitext(name)
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    hashed = f'{stem}.{digest[:HASH_LENGTH]}{extension}'
+
+    with locked(manifest):
+        try:
+            with open(manifest, 'r') as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            entries = {}
+
+        previous = entries.get(name, {})
+        if previous.get('sha256') == digest and os.path.exists(os.path.join(directory, hashed)):
+            return previous
+
+        variants = {'': data, '.gz': compress_gzip(data)}
+        compressed = compress_brotli(data)
+        if compressed is not None:
+            variants['.br'] = compressed
+        for suffix, content in variants.items():
+            if suffix:
+                atomic_write(filename + suffix, content)
+            atomic_write(os.path.join(directory, hashed + suffix), content)
+        if compressed is None:
+            _remove(filename + '.br', os.path.join(directory, hashed + '.br'))
+
+        # one generation back stays published, the one before it goes
+        kept = previous.get('file') if previous.get('file') != hashed else previous.get('previous')
+        expired = previous.get('previous')
+        if expired and expired not in (hashed, kept):
+            _remove(*(os.path.join(directory, expired + suffix) for suffix in ('', '.gz', '.br')))
+
+        entries[name] = {
+            'sha256': digest,
+            'file': hashed,
+            'previous': kept,
+            'sizes': {suffix.lstrip('.') or 'identity': len(content) for suffix, content in variants.items()},
+        }
+        atomic_write(manifest, json.dumps(entries, indent=4, sort_keys=True))
+    return entries[name]
+
+
+def _remove(*paths: str) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,153 @@
+"""Startup cost measurements: per-module import times of a fresh interpreter."""
+
+import os
+import statistics
+import subprocess
+import sys
+
+from dataclasses import dataclass
+
+
+@dataclass
+class ImportTime:
+    """
+    Import cost of a module, as reported by `python -X importtime`.
+
+    Attributes
+    ----------
+    module : str
+        Name of the module
+    depth : int
+        Nesting level, 0 for modules imported by the measured one directly or
+        by the interpreter
+    self_us : int
+        Time spent executing the module itself, in microseconds
+    cumulative_us : int
+        Time including the modules it imported, in microseconds
+    """
+
+    module:         str
+    depth:          int
+    self_us:        int
+    cumulative_us:  int
+
+
+def import_times(
+    module: str,
+    path: str,
+) -> list[ImportTime]:
+    """
+    Import a module in a fresh interpreter and return the cost of every import.
+
+    Parameters
+    ----------
+    module : str
+        Name of the module to import
+    path : str
+        Directory prepended to the module search path
+
+    Returns
+    -------
+    list[ImportTime]
+        Every module imported, in the order their imports completed
+
+    Raises
+    ------
+    RuntimeError
+        If the import fails
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [path, env.get('PYTHONPATH')]))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{result.stderr.strip()}')
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue    # header line
+        indent = len(name) - len(name.lstrip(' '))
+        times.append(ImportTime(name.strip(), (indent - 1) // 2, int(self_us), int(cumulative_us)))
+    return times
+
+
+def startup_time(
+    module: str,
+    path: str,
+    runs: int = 5,
+) -> float:
+    """
+    Return the median time a fresh interpreter takes to import a module.
+
+    Interpreter startup itself (site, encodings, ...) is not included, only
+    the cumulative import time of the module.
+
+    Parameters
+    ----------
+    module : str
+        Name of the module to import
+    path : str
+        Directory prepended to the module search path
+    runs : int, optional
+        Number of interpreters started, the first one also compiles the
+        bytecode caches (default is 5)
+
+    Returns
+    -------
+    float
+        Median import time in seconds
+    """
+    samples = []
+    for _ in range(runs):
+        times = import_times(module, path)
+        samples.append(next(t.cumulative_us for t in reversed(times) if t.module == module) / 1e6)
+    return statistics.median(samples)
+
+
+def format_report(
+    times: list[ImportTime],
+    module: str,
+    limit: int = 20,
+) -> str:
+    """
+    Return the modules imported by a module that took the longest, as a table.
+
+    Parameters
+    ----------
+    times : list[ImportTime]
+        Import times, as returned by `import_times`
+    module : str
+        The measured module; imports done by interpreter startup are left out
+    limit : int, optional
+        Number of modules listed (default is 20)
+
+    Returns
+    -------
+    str
+        One line per module, slowest cumulative time first
+
+    Raises
+    ------
+    ValueError
+        If the module is not among the import times
+    """
+    # children complete right before their parent, so the module's imports are
+    # the deeper entries just before its own top-level entry
+    end = max(i for i, t in enumerate(times) if t.module == module and t.depth == 0)
+    start = end
+    while start > 0 and times[start - 1].depth > 0:
+        start -= 1
+    measured = times[start:end + 1]
+    total = times[end].cumulative_us
+    lines = [f'{"cumulative":>12} {"self":>10}  module']
+    for t in sorted(measured, key=lambda t: -t.cumulative_us)[:limit]:
+        lines.append(f'{t.cumulative_us / 1000:>9.1f} ms {t.self_us / 1000:>7.1f} ms  {"  " * t.depth}{t.module}')
+    lines.append(f'{module} imports in {total / 1000:.1f} ms, {len(measured)} modules')
+    return '\n'.join(lines)
+
@@ -4,6 +4,8 @@ import time
 from collections.abc import Callable
 from typing import Any
 
+from utils import trace
+
 def perf_counter(
     funct: Callable[..., Any],
     *args: tuple | None
@@ -13,6 +15,7 @@ def perf_counter(
 
     This function measures the time taken for a given function to execute with specified arguments.
     It returns a tuple containing the function's result and the time differential in seconds.
+    The call is also recorded as a span named after the function when tracing is on.
 
     Parameters
     ----------
@@ -38,6 +41,7 @@ def perf_counter(
     >>> print(f"Result: {result}, Time: {time_taken:.6f} seconds")
     Result: 3, Time: 0.000001 seconds
     """
-    start = time.perf_counter()
-    funct_return = funct(*args)
-    return funct_return, time.perf_counter() - start
+    with trace.span(getattr(funct, '__name__', repr(funct)), args=args):
+        start = time.perf_counter()
+        funct_return = funct(*args)
+        return funct_return, time.perf_counter() - start
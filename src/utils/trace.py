@@ -0,0 +1,362 @@
+"""Tracing of nested spans, exported as Chrome trace events or folded stacks."""
+
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any
+
+from utils.fileio import atomic_write
+
+_TRACER: 'Tracer | None' = None
+# spans open in the current context, innermost last; worker threads started
+# with a copied context continue the stack of the code that started them
+_OPEN: contextvars.ContextVar[tuple['Span', ...]] = contextvars.ContextVar('open_spans', default=())
+
+
+@dataclass
+class Span:
+    """
+    A timed region of the program.
+
+    Attributes
+    ----------
+    name : str
+        What the region does, e.g. 'graphql' or 'save_profile'
+    start_ns : int
+        Start, from `time.perf_counter_ns`
+    end_ns : int
+        End, from `time.perf_counter_ns`, equal to start_ns while open
+    thread : int
+        Native id of the thread that ran the region
+    parent : Span | None
+        Innermost span open when this one started
+    args : dict[str, Any]
+        Details shown with the span, e.g. the repository crawled
+    """
+
+    name:       str
+    start_ns:   int
+    end_ns:     int = 0
+    thread:     int = 0
+    parent:     'Span | None' = field(default=None, repr=False)
+    args:       dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration_ns(self) -> int:
+        return self.end_ns - self.start_ns
+
+    @property
+    def stack(self) -> tuple[str, ...]:
+        """Names of the enclosing spans, outermost first, ending with this one."""
+        names = []
+        span = self
+        while span is not None:
+            names.append(span.name)
+            span = span.parent
+        return tuple(reversed(names))
+
+
+class Sampler:
+    """
+    Statistical profiler recording the Python stack of every thread at an interval.
+
+    The stacks are read from `sys._current_frames` by a background thread, so
+    the profiled code is not instrumented and runs at full speed between
+    samples.
+
+    Attributes
+    ----------
+    interval : float
+        Seconds between samples
+    samples : collections.Counter[tuple[str, ...]]
+        Number of times each stack was seen, outermost frame first
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.005,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        interval : float, optional
+            Seconds between samples (default is 0.005)
+        """
+        self.interval:  float = interval
+        self.samples:   collections.Counter[tuple[str, ...]] = collections.Counter()
+        self._stop:     threading.Event = threading.Event()
+        self._thread:   threading.Thread | None = None
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    # leave out the wrappers of functions decorated with span()
+                    if frame.f_code.co_filename != contextlib.__file__:
+                        stack.append(self._frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[tuple(reversed(stack))] += 1
+
+    def start(self) -> None:
+        """Start sampling in a daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='trace-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the sampling thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class Tracer:
+    """
+    Collects the spans finished while it is active.
+
+    Attributes
+    ----------
+    spans : list[Span]
+        Finished spans, in the order they ended
+    sampler : Sampler | None
+        Sampling profiler running alongside, None if sampling is off
+    """
+
+    def __init__(
+        self,
+        sample_interval: float | None = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        sample_interval : float | None, optional
+            Seconds between stack samples, None to not sample (default is None)
+        """
+        self.spans:     list[Span] = []
+        self.sampler:   Sampler | None = Sampler(sample_interval) if sample_interval else None
+        self._lock:     threading.Lock = threading.Lock()
+        self._origin:   int = time.perf_counter_ns()
+        self._threads:  dict[int, str] = {}
+
+    def record(
+        self,
+        span: Span,
+    ) -> None:
+        """Add a finished span, from the thread that ran it."""
+        with self._lock:
+            self.spans.append(span)
+            self._threads[span.thread] = threading.current_thread().name
+
+    def chrome_trace(self) -> dict[str, Any]:
+        """
+        Return the spans in the Chrome trace event format.
+
+        The result loads in chrome://tracing, Perfetto or speedscope, with one
+        track per thread.
+
+        Returns
+        -------
+        dict[str, Any]
+            Complete ('X') events with microsecond timestamps, plus the thread
+            names as metadata events
+        """
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+            names = dict(self._threads)
+        events: list[dict[str, Any]] = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': names.get(tid, str(tid))}}
+            for tid in sorted({span.thread for span in spans})
+        ]
+        for span in sorted(spans, key=lambda s: s.start_ns):
+            events.append({
+                'name': span.name,
+                'ph': 'X',
+                'ts': (span.start_ns - self._origin) / 1000,
+                'dur': span.duration_ns / 1000,
+                'pid': pid,
+                'tid': span.thread,
+                'args': {key: str(value) for key, value in span.args.items()},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def folded(self) -> str:
+        """
+        Return folded stacks, the input of flamegraph.pl and speedscope.
+
+        With the sampler on, every line is a sampled Python stack and its
+        number of samples. Otherwise every line is a span stack and the time
+        spent in it outside of its child spans, in microseconds.
+
+        Returns
+        -------
+        str
+            One 'outer;inner count' line per stack, sorted by stack
+        """
+        if self.sampler is not None:
+            weights = self.sampler.samples
+        else:
+            with self._lock:
+                spans = list(self.spans)
+            weights = collections.Counter()
+            for span in spans:
+                weights[span.stack] += span.duration_ns
+            for span in spans:
+                # children running in another thread overlap their parent instead of nesting in it
+                if span.parent is not None and span.parent.thread == span.thread:
+                    weights[span.parent.stack] -= span.duration_ns
+            weights = collections.Counter({stack: ns // 1000 for stack, ns in weights.items() if ns >= 1000})
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(weights.items()))
+
+    def save(
+        self,
+        trace_file: str | None = None,
+        folded_file: str | None = None,
+    ) -> None:
+        """
+        Write the Chrome trace and the folded stacks.
+
+        Parameters
+        ----------
+        trace_file : str | None, optional
+            Path of the Chrome trace JSON, None to skip it (default is None)
+        folded_file : str | None, optional
+            Path of the folded stacks, None to skip them (default is None)
+
+        Returns
+        -------
+        None
+        """
+        for filename, render in ((trace_file, lambda: json.dumps(self.chrome_trace())), (folded_file, self.folded)):
+            if filename is not None:
+                os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+                atomic_write(filename, render())
+
+    def report(
+        self,
+        limit: int = 10,
+    ) -> str:
+        """
+        Return the span names that took the longest in total, as a table.
+
+        Parameters
+        ----------
+        limit : int, optional
+            Number of span names listed (default is 10)
+
+        Returns
+        -------
+        str
+            One line per span name with its count and total time
+        """
+        with self._lock:
+            spans = list(self.spans)
+        totals: dict[str, list[int]] = collections.defaultdict(lambda: [0, 0])
+        for span in spans:
+            totals[span.name][0] += 1
+            totals[span.name][1] += span.duration_ns
+        lines = [f'{"total":>12} {"count":>6}  span']
+        for name, (count, ns) in sorted(totals.items(), key=lambda item: -item[1][1])[:limit]:
+            lines.append(f'{ns / 1e6:>9.1f} ms {count:>6}  {name}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def span(
+    name: str,
+    **args: Any,
+) -> Iterator[Span | None]:
+    """
+    Time the enclosed code as a span, nested in the spans already open.
+
+    Also works as a decorator, timing every call of the function. Nothing is
+    recorded unless tracing was started with `start_tracing`.
+
+    Parameters
+    ----------
+    name : str
+        What the code does
+    **args : Any
+        Details shown with the span
+
+    Yields
+    ------
+    Span | None
+        The open span, to add details to its args, or None if tracing is off
+    """
+    tracer = _TRACER
+    if tracer is None:
+        yield None
+        return
+
+    stack = _OPEN.get()
+    current = Span(name, time.perf_counter_ns(), thread=threading.get_native_id(),
+                   parent=stack[-1] if stack else None, args=args)
+    token = _OPEN.set(stack + (current,))
+    try:
+        yield current
+    finally:
+        current.end_ns = time.perf_counter_ns()
+        _OPEN.reset(token)
+        tracer.record(current)
+
+
+def start_tracing(
+    sample_interval: float | None = None,
+) -> Tracer:
+    """
+    Start recording spans in this process.
+
+    Parameters
+    ----------
+    sample_interval : float | None, optional
+        Also sample the Python stacks every so many seconds (default is None,
+        no sampling)
+
+    Returns
+    -------
+    Tracer
+        The tracer the spans are recorded by
+    """
+    global _TRACER
+    _TRACER = Tracer(sample_interval)
+    if _TRACER.sampler is not None:
+        _TRACER.sampler.start()
+    return _TRACER
+
+
+def stop_tracing() -> Tracer | None:
+    """
+    Stop recording spans and sampling.
+
+    Returns
+    -------
+    Tracer | None
+        The tracer holding everything recorded, None if tracing was not started
+    """
+    global _TRACER
+    tracer, _TRACER = _TRACER, None
+    if tracer is not None and tracer.sampler is not None:
+        tracer.sampler.stop()
+    return tracer
@@ -0,0 +1,9 @@
+"""Makes the modules under src/ importable from the tests, as they are when running src/main.py."""
+
+import sys
+
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+
+sys.path.insert(0, str(SRC))
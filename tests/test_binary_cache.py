@@ -0,0 +1,132 @@
+"""Round trips and corruption of the memory-mapped binary cache."""
+
+import hashlib
+
+import pytest
+
+from cache.binary import HEADER, MAGIC, RECORD, BinaryCache, convert_text_cache
+from cache.totals import ARCHIVED
+from utils.fileio import atomic_write
+
+
+def digest(
+    name: str,
+) -> bytes:
+    return hashlib.sha256(name.encode('utf-8')).digest()
+
+
+def test_round_trip_after_reopen(tmp_path):
+    filename = str(tmp_path / 'cache.bin')
+    with BinaryCache(filename) as store:
+        store.update(digest('owner/b'), 10, 4, 300, 20)
+        store.update(digest('owner/a'), 5, 5, 100, 10, ARCHIVED)
+        store.update(digest('owner/c'), 1, 0, 0, 0)
+
+    with BinaryCache(filename) as store:
+        assert len(store) == 3
+        assert store.get(digest('owner/a')) == (5, 5, 100, 10, ARCHIVED)
+        assert store.get(digest('owner/b')) == (10, 4, 300, 20, 0)
+        assert store.get(digest('owner/missing')) is None
+        assert [row[0] for row in store.rows()] == sorted(digest(f'owner/{name}') for name in 'abc')
+        assert store.sum('added') == 400
+        assert store.sum('my_commits') == 9
+
+
+def test_update_in_place_and_remove(tmp_path):
+    filename = str(tmp_path / 'cache.bin')
+    with BinaryCache(filename) as store:
+        store.update(digest('owner/a'), 1, 1, 1, 1)
+        store.update(digest('owner/a'), 2, 2, 2, 2)
+        assert len(store) == 1
+        assert store.get(digest('owner/a')) == (2, 2, 2, 2, 0)
+        assert store.remove(digest('owner/a'))
+        assert not store.remove(digest('owner/a'))
+        assert len(store) == 0
+    assert (tmp_path / 'cache.bin').stat().st_size == HEADER.size
+
+
+def test_reconcile_keeps_archived_rows(tmp_path):
+    with BinaryCache(str(tmp_path / 'cache.bin')) as store:
+        store.update(digest('owner/kept'), 3, 3, 30, 3)
+        store.update(digest('owner/gone'), 1, 1, 10, 1)
+        store.update(digest('owner/archived'), 2, 2, 20, 2, ARCHIVED)
+
+        assert not store.reconcile([digest('owner/kept'), digest('owner/new')])
+        assert store.get(digest('owner/kept')) == (3, 3, 30, 3, 0)
+        assert store.get(digest('owner/new')) == (0, 0, 0, 0, 0)
+        assert store.get(digest('owner/gone')) is None
+        assert store.get(digest('owner/archived')) == (2, 2, 20, 2, ARCHIVED)
+        assert store.reconcile([digest('owner/kept'), digest('owner/new')])
+
+
+def test_convert_text_cache(tmp_path):
+    text = tmp_path / 'cache.txt'
+    lines = [f"{digest('owner/a').hex()} 7 3 50 5\n", f"{digest('owner/b').hex()} 1 1 2 1\n"]
+    text.write_text('comment\n' + ''.join(lines))
+    convert_text_cache(str(text), str(tmp_path / 'cache.bin'), 1)
+
+    with BinaryCache(str(tmp_path / 'cache.bin')) as store:
+        assert store.get(digest('owner/a')) == (7, 3, 50, 5, 0)
+        assert store.get(digest('owner/b')) == (1, 1, 2, 1, 0)
+
+
+@pytest.mark.parametrize('contents', [
+    b'',
+    b'LOCCA',
+    HEADER.pack(b'NOTCACHE', 1, 0),
+    HEADER.pack(MAGIC, 99, 0),
+], ids=['empty', 'short header', 'bad magic', 'unknown version'])
+def test_rejects_foreign_files(tmp_path, contents):
+    filename = tmp_path / 'cache.bin'
+    filename.write_bytes(contents)
+    with pytest.raises(ValueError):
+        BinaryCache(str(filename))
+
+
+@pytest.mark.parametrize('cut', [1, RECORD.size // 2, RECORD.size])
+def test_rejects_torn_records(tmp_path, cut):
+    filename = tmp_path / 'cache.bin'
+    with BinaryCache(str(filename)) as store:
+        store.update(digest('owner/a'), 1, 1, 1, 1)
+        store.update(digest('owner/b'), 2, 2, 2, 2)
+    filename.write_bytes(filename.read_bytes()[:-cut])
+    with pytest.raises(ValueError):
+        BinaryCache(str(filename))
+
+
+def test_update_many_inserts_in_one_rewrite(tmp_path, monkeypatch):
+    writes = []
+    monkeypatch.setattr('cache.binary.atomic_write', lambda *args: (writes.append(args[0]), atomic_write(*args)))
+    with BinaryCache(str(tmp_path / 'cache.bin')) as store:
+        store.update(digest('owner/a'), 1, 1, 1, 1)
+        store.update_many([(digest('owner/a'), 2, 2, 2, 2, 0), (digest('owner/b'), 3, 3, 3, 3, ARCHIVED),
+                           (digest('owner/c'), 4, 4, 4, 4, 0)])
+        assert [store.get(digest(f'owner/{name}')) for name in 'abc'] == [(2, 2, 2, 2, 0), (3, 3, 3, 3, ARCHIVED),
+                                                                         (4, 4, 4, 4, 0)]
+        assert [row[0] for row in store.rows()] == sorted(digest(f'owner/{name}') for name in 'abc')
+    # creation, the first insert, then the three rows at once
+    assert len(writes) == 3
+
+
+def test_interrupted_resize_keeps_the_previous_file(tmp_path, monkeypatch):
+    filename = tmp_path / 'cache.bin'
+    with BinaryCache(str(filename)) as store:
+        store.update(digest('owner/a'), 1, 1, 1, 1)
+    before = filename.read_bytes()
+
+    def crash(*args):
+        raise OSError('disk full')
+
+    monkeypatch.setattr('utils.fileio.os.replace', crash)
+    with BinaryCache(str(filename)) as store:
+        with pytest.raises(OSError):
+            store.update(digest('owner/b'), 2, 2, 2, 2)
+        # the store still maps the previous file
+        assert len(store) == 1
+    monkeypatch.undo()
+
+    assert filename.read_bytes() == before
+    assert [path.name for path in tmp_path.iterdir()] == ['cache.bin']
+    with BinaryCache(str(filename)) as store:
+        assert len(store) == 1
+        assert store.get(digest('owner/a')) == (1, 1, 1, 1, 0)
@@ -0,0 +1,53 @@
+"""Commits counted by the LOC crawl belong to the user of the current settings."""
+
+from graphql import github
+from config.environment import EnvConfig, override_settings
+
+COMMITS = [('alice-id', 10, 1), ('bob-id', 20, 2), ('alice-id', 30, 3), (None, 40, 4)]
+
+
+class Response:
+    status_code = 200
+
+    def __init__(
+        self,
+        payload: dict,
+    ) -> None:
+        self.payload = payload
+
+    def json(self) -> dict:
+        return self.payload
+
+
+class Requests:
+    """Serves the commit history two commits per page."""
+
+    def post(self, url, json, headers, timeout):
+        start = int(json['variables']['cursor'] or 0)
+        page = COMMITS[start:start + 2]
+        edges = [{'node': {'author': {'user': {'id': user} if user else None}, 'additions': added, 'deletions': deleted}}
+                 for user, added, deleted in page]
+        history = {'totalCount': len(COMMITS), 'edges': edges,
+                   'pageInfo': {'endCursor': str(start + 2), 'hasNextPage': start + 2 < len(COMMITS)}}
+        return Response({'data': {'repository': {'defaultBranchRef': {'target': {'history': history}}}}})
+
+
+def test_each_user_counts_their_own_commits(monkeypatch):
+    lookups = []
+
+    def user_getter(username):
+        lookups.append(username)
+        return {'id': username + '-id'}, '2020-01-01T00:00:00Z'
+
+    monkeypatch.setattr(github, 'requests', Requests())
+    monkeypatch.setattr(github, 'user_getter', user_getter)
+    monkeypatch.setattr(github, '_OWNER_IDS', {})
+
+    config = EnvConfig(ACCESS_TOKEN='token', USER_NAME='alice')
+    with override_settings(config):
+        assert github.recursive_loc('alice', 'repo', None, []) == (40, 4, 2)
+        with override_settings(USER_NAME='bob'):
+            assert github.recursive_loc('alice', 'repo', None, []) == (20, 2, 1)
+        assert github.recursive_loc('alice', 'repo', None, []) == (40, 4, 2)
+    # looked up once per user, not once per page or repository
+    assert lookups == ['alice', 'bob']
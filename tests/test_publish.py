@@ -0,0 +1,50 @@
+"""Generations of hashed copies and compressed siblings written by the publish stage."""
+
+import os
+
+from utils import publish as publisher
+
+
+def write(path, text: str) -> str:
+    path.write_text(text)
+    return publisher.publish(str(path))['file']
+
+
+def test_previous_generation_stays_until_the_next_publish(tmp_path):
+    profile = tmp_path / 'profile.svg'
+    first = write(profile, '<svg>1</svg>')
+    second = write(profile, '<svg>2</svg>')
+    assert (tmp_path / first).exists() and (tmp_path / f'{first}.gz').exists()
+    assert (tmp_path / second).exists()
+
+    third = write(profile, '<svg>3</svg>')
+    assert not (tmp_path / first).exists() and not (tmp_path / f'{first}.gz').exists()
+    assert (tmp_path / second).exists() and (tmp_path / third).exists()
+
+
+def test_republishing_older_contents_keeps_them(tmp_path):
+    profile = tmp_path / 'profile.svg'
+    first = write(profile, '<svg>1</svg>')
+    second = write(profile, '<svg>2</svg>')
+    assert write(profile, '<svg>1</svg>') == first
+    assert (tmp_path / first).exists() and (tmp_path / second).exists()
+
+
+def test_stale_brotli_siblings_are_removed_without_brotli(tmp_path, monkeypatch):
+    profile = tmp_path / 'profile.svg'
+    write(profile, '<svg>1</svg>')
+    assert (tmp_path / 'profile.svg.br').exists()
+
+    monkeypatch.setattr(publisher, 'brotli', None)
+    hashed = write(profile, '<svg>2</svg>')
+    assert not (tmp_path / 'profile.svg.br').exists()
+    assert not (tmp_path / f'{hashed}.br').exists()
+    assert (tmp_path / 'profile.svg.gz').exists()
+
+
+def test_unchanged_file_is_not_rewritten(tmp_path):
+    profile = tmp_path / 'profile.svg'
+    hashed = write(profile, '<svg>1</svg>')
+    written = os.stat(tmp_path / hashed).st_mtime_ns
+    assert write(profile, '<svg>1</svg>') == hashed
+    assert os.stat(tmp_path / hashed).st_mtime_ns == written
@@ -0,0 +1,80 @@
+"""Alignment of the cached rows with the repository list, by repository hash."""
+
+import hashlib
+
+from cache.binary import BinaryCache
+from cache.cache import reconcile_rows
+
+
+def edge(
+    name: str,
+) -> dict:
+    return {'node': {'nameWithOwner': name}}
+
+
+def repo_hash(
+    name: str,
+) -> str:
+    return hashlib.sha256(name.encode('utf-8')).hexdigest()
+
+
+def row(
+    name: str,
+    *counts: int,
+    tag: str = '',
+) -> str:
+    return ' '.join([repo_hash(name), *map(str, counts), *([tag] if tag else [])]) + '\n'
+
+
+def test_unchanged_repositories_are_reconciled():
+    rows = [row('me/a', 1, 1, 10, 1), row('me/b', 2, 2, 20, 2)]
+    aligned, reconciled = reconcile_rows([edge('me/a'), edge('me/b')], rows)
+    assert aligned == rows
+    assert reconciled
+
+
+def test_rows_follow_the_edges_not_their_position():
+    rows = [row('me/a', 1, 1, 10, 1), row('me/b', 2, 2, 20, 2)]
+    aligned, reconciled = reconcile_rows([edge('me/b'), edge('me/a')], rows)
+    assert aligned == [rows[1], rows[0]]
+    assert reconciled
+
+
+def test_new_and_removed_repositories():
+    rows = [row('me/a', 1, 1, 10, 1), row('me/gone', 3, 3, 30, 3), '\n']
+    aligned, reconciled = reconcile_rows([edge('me/new'), edge('me/a')], rows)
+    assert aligned == [row('me/new', 0, 0, 0, 0), rows[0]]
+    assert not reconciled
+
+    aligned, reconciled = reconcile_rows([edge('me/a')], rows[:1] + [row('me/new', 0, 0, 0, 0)])
+    assert aligned == rows[:1]
+    assert not reconciled
+
+
+def test_archived_rows_are_kept_and_never_duplicated():
+    archived = row('me/old', 5, 5, 50, 5, tag='archived')
+    unattributed = row('deleted', 0, 7, 70, 7, tag='archived-unattributed')
+    rows = [row('me/a', 1, 1, 10, 1), archived, unattributed]
+
+    aligned, reconciled = reconcile_rows([edge('me/a')], rows)
+    assert aligned == rows
+    assert reconciled
+
+    # a repository still listed keeps its archived row instead of getting a second one
+    aligned, reconciled = reconcile_rows([edge('me/old'), edge('me/a')], rows)
+    assert aligned == [archived, rows[0], unattributed]
+    assert reconciled
+
+
+def test_matches_the_binary_cache(tmp_path):
+    rows = [row('me/a', 1, 1, 10, 1), row('me/gone', 2, 2, 20, 2), row('me/old', 5, 5, 50, 5, tag='archived')]
+    edges = [edge('me/old'), edge('me/new'), edge('me/a')]
+
+    aligned, reconciled = reconcile_rows(edges, rows)
+    with BinaryCache(str(tmp_path / 'cache.bin')) as store:
+        store.update(bytes.fromhex(repo_hash('me/a')), 1, 1, 10, 1)
+        store.update(bytes.fromhex(repo_hash('me/gone')), 2, 2, 20, 2)
+        store.update(bytes.fromhex(repo_hash('me/old')), 5, 5, 50, 5, 1)
+        assert store.reconcile([bytes.fromhex(repo_hash(e['node']['nameWithOwner'])) for e in edges]) == reconciled
+        binary_rows = {digest.hex(): tuple(counts[:4]) for digest, *counts in store.rows()}
+    assert {line.split()[0]: tuple(map(int, line.split()[1:5])) for line in aligned} == binary_rows
@@ -0,0 +1,53 @@
+"""Background refresh of the statistics under a deadline."""
+
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+from cache import cache
+from conftest import SRC
+
+REFRESH = textwrap.dedent('''
+    import sys, time
+    import main
+    from cache.stats import StatsStore
+
+    main.github_queries = lambda cfg: {'fast': (lambda: 1,), 'slow': (time.sleep, 30)}
+    store = StatsStore(sys.argv[1])
+    print(main.collect_github_stats(main.refresh_github_stats(None, store), 0.5), store.values())
+''')
+
+
+def test_pending_refresh_does_not_delay_exit(tmp_path):
+    start = time.monotonic()
+    result = subprocess.run(
+        [sys.executable, '-c', REFRESH, str(tmp_path / 'stats.json')],
+        cwd=SRC.parent, env={'PYTHONPATH': str(SRC)}, capture_output=True, text=True, timeout=20,
+    )
+    assert result.returncode == 0, result.stderr
+    assert time.monotonic() - start < 10
+    assert result.stdout.strip() == "{'fast': 1} {'fast': 1}"
+
+
+def test_shared_cache_is_built_once(monkeypatch):
+    built = []
+
+    def build_cache(*args, **kwargs):
+        time.sleep(0.05)
+        built.append(object())
+        return built[-1]
+
+    monkeypatch.setattr(cache, '_SHARED_CACHE', None)
+    monkeypatch.setattr(cache.tiered, 'build_cache', build_cache)
+    monkeypatch.setenv('ACCESS_TOKEN', 'token')
+    monkeypatch.setenv('USER_NAME', 'me')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.shared_cache())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert all(result is built[0] for result in results)
@@ -0,0 +1,86 @@
+"""Round trips, checksum and path checks of the crawl state bundle."""
+
+import hashlib
+import os
+import zlib
+
+import pytest
+
+from cache.snapshot import ENTRY, HEADER, MAGIC, VERSION, export_snapshot, import_snapshot, read_snapshot
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory, since bundles hold paths relative to the working directory."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def bundle_of(
+    entries: list[tuple[str, bytes]],
+) -> bytes:
+    """Build a bundle with a valid checksum around arbitrary entries."""
+    raw = b''.join(ENTRY.pack(0, 0, len(path.encode()), len(data)) + path.encode() + data for path, data in entries)
+    payload = zlib.compress(raw)
+    return HEADER.pack(MAGIC, VERSION, hashlib.sha256(payload).digest(), len(payload)) + payload
+
+
+def test_round_trip(workdir):
+    (workdir / 'cache').mkdir()
+    (workdir / 'cache' / 'responses').mkdir()
+    (workdir / 'cache' / 'abc.txt').write_text('rows\n')
+    (workdir / 'cache' / 'responses' / 'entry').write_bytes(b'\x00\x01payload')
+    (workdir / 'cache' / 'responses' / 'entry.tmp').write_bytes(b'partial')
+    os.utime(workdir / 'cache' / 'abc.txt', ns=(1_600_000_000_000_000_000,) * 2)
+
+    assert export_snapshot('snapshot/state.bin', ['cache/abc.txt', 'cache/responses', 'cache/missing.txt']) == 2
+    original = read_snapshot('snapshot/state.bin')
+    assert set(original) == {os.path.join('cache', 'abc.txt'), os.path.join('cache', 'responses', 'entry')}
+
+    (workdir / 'cache' / 'abc.txt').write_text('changed\n')
+    (workdir / 'cache' / 'responses' / 'entry').unlink()
+    assert import_snapshot('snapshot/state.bin') == 2
+    assert (workdir / 'cache' / 'abc.txt').read_text() == 'rows\n'
+    assert (workdir / 'cache' / 'abc.txt').stat().st_mtime_ns == 1_600_000_000_000_000_000
+    assert (workdir / 'cache' / 'responses' / 'entry').read_bytes() == b'\x00\x01payload'
+
+
+@pytest.mark.parametrize('damage', [
+    lambda raw: raw[:-1],
+    lambda raw: raw[:HEADER.size - 1],
+    lambda raw: raw[:-1] + bytes([raw[-1] ^ 1]),
+    lambda raw: raw + b'\x00',
+], ids=['truncated', 'short header', 'flipped bit', 'trailing byte'])
+def test_rejects_corrupted_bundles(workdir, damage):
+    (workdir / 'state.txt').write_text('state\n')
+    export_snapshot('state.bin', ['state.txt'])
+    (workdir / 'state.bin').write_bytes(damage((workdir / 'state.bin').read_bytes()))
+    (workdir / 'state.txt').write_text('kept\n')
+
+    with pytest.raises(ValueError):
+        import_snapshot('state.bin')
+    assert (workdir / 'state.txt').read_text() == 'kept\n'
+
+
+def test_rejects_other_versions(workdir):
+    raw = bundle_of([('state.txt', b'state')])
+    (workdir / 'state.bin').write_bytes(HEADER.pack(MAGIC, VERSION + 1, *HEADER.unpack_from(raw)[2:]) + raw[HEADER.size:])
+    with pytest.raises(ValueError, match='version'):
+        read_snapshot('state.bin')
+
+
+@pytest.mark.parametrize('path', ['../escape', 'cache/../../escape', '/etc/escape', 'C:/escape', ''])
+def test_rejects_paths_outside_working_directory(workdir, path):
+    (workdir / 'state.bin').write_bytes(bundle_of([('kept.txt', b'kept'), (path, b'escaped')]))
+    with pytest.raises(ValueError):
+        import_snapshot('state.bin')
+    assert not (workdir / 'kept.txt').exists()
+    assert not (workdir.parent / 'escape').exists()
+
+
+def test_rejects_entries_past_the_payload(workdir):
+    raw = bundle_of([('state.txt', b'state')])
+    payload = zlib.compress(zlib.decompress(raw[HEADER.size:])[:-2])
+    (workdir / 'state.bin').write_bytes(HEADER.pack(MAGIC, VERSION, hashlib.sha256(payload).digest(), len(payload)) + payload)
+    with pytest.raises(ValueError):
+        read_snapshot('state.bin')
@@ -0,0 +1,46 @@
+"""Startup cost of main and the --startup-budget check."""
+
+import subprocess
+import sys
+
+from conftest import SRC
+from utils.startup import import_times, startup_time
+
+# Documented budget of the import of main; it takes about 70 ms, so the test
+# only fails on a real regression, not on a slow machine
+STARTUP_BUDGET_MS = 250
+# Imported on first use only, see utils.lazy
+DEFERRED = ('requests', 'urllib3', 'dateutil.relativedelta', 'yaml', 'fontTools', 'lxml', 'pydantic',
+            'pydantic_settings', 'multiprocessing.managers', 'concurrent.futures.process')
+
+
+def run_startup_check(
+    budget: str,
+) -> subprocess.CompletedProcess:
+    """Run `main.py --startup-budget` in a fresh interpreter, as the workflow does."""
+    return subprocess.run(
+        [sys.executable, str(SRC / 'main.py'), '--startup-budget', budget],
+        cwd=SRC.parent, capture_output=True, text=True, timeout=120,
+    )
+
+
+def test_within_budget_exits_zero():
+    result = run_startup_check('60000')
+    assert result.returncode == 0, result.stderr
+    assert 'Importing main takes' in result.stdout
+
+
+def test_over_budget_exits_one():
+    result = run_startup_check('0')
+    assert result.returncode == 1, result.stderr
+    assert '(budget 0 ms)' in result.stdout
+
+
+def test_heavy_modules_are_deferred():
+    imported = {entry.module for entry in import_times('main', str(SRC))}
+    assert [name for name in DEFERRED if name in imported] == []
+
+
+def test_import_within_budget():
+    elapsed = startup_time('main', str(SRC)) * 1000
+    assert elapsed <= STARTUP_BUDGET_MS, f'importing main takes {elapsed:.1f} ms'
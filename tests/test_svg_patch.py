@@ -0,0 +1,110 @@
+"""Byte span index and in-place text patching of SVG files."""
+
+import os
+
+from lxml import etree
+
+from svg.svg_modificator import build_index, index_filename, load_index, patch_svg, svg_overwrite
+
+DOCUMENT = (
+    '<svg xmlns="http://www.w3.org/2000/svg">'
+    '<text x="0"><tspan id="label">Café ☕</tspan>'
+    '<tspan id="star_data">1,234</tspan><tspan id="star_data_dots"> ........ </tspan></text>'
+    '<text id="mixed">head<tspan id="inner">x &amp; y</tspan>tail</text>'
+    '<tspan id="empty"></tspan><tspan id="closed"/>'
+    '<text><tspan id="commit_data">9</tspan><tspan id="commit_data_dots">. </tspan></text>'
+    '</svg>'
+).encode('utf-8')
+
+
+def texts(
+    data: bytes,
+) -> dict[str, str]:
+    """Return the text of every element with an id, as an XML parser sees it."""
+    root = etree.fromstring(data)
+    return {element.get('id'): element.text or '' for element in root.iter() if element.get('id')}
+
+
+def write_svg(
+    tmp_path,
+    data: bytes = DOCUMENT,
+) -> str:
+    filename = str(tmp_path / 'profile.svg')
+    with open(filename, 'wb') as f:
+        f.write(data)
+    return filename
+
+
+def test_index_spans_hold_element_text():
+    spans = build_index(DOCUMENT)
+    expected = texts(DOCUMENT)
+    for element_id, (start, end) in spans.items():
+        assert DOCUMENT[start:end] == expected[element_id].replace('&', '&amp;').encode('utf-8')
+    assert DOCUMENT[slice(*spans['mixed'])] == b'head'
+    assert spans['empty'][0] == spans['empty'][1]
+    # the text of an empty-element tag cannot be set without rewriting the tag
+    assert 'closed' not in spans
+
+
+def test_patch_matches_parsed_document(tmp_path):
+    filename = write_svg(tmp_path)
+    updates = {
+        'label': 'Ünïcode — longer than before',
+        'star_data': '12',
+        'inner': 'a < b & c',
+        'empty': 'filled',
+        'commit_data': '1,000,000',
+        'missing': 'ignored',
+    }
+    assert patch_svg(filename, updates) == 5
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+    expected = texts(DOCUMENT)
+    expected.update({key: value for key, value in updates.items() if key != 'missing'})
+    assert texts(data) == expected
+    # the shifted index is stored and matches a fresh parse
+    assert load_index(filename) == build_index(data)
+
+
+def test_repeated_patches_reuse_the_index(tmp_path):
+    filename = write_svg(tmp_path)
+    for value in ('1', '12,345,678', '', '42'):
+        patch_svg(filename, {'star_data': value, 'label': value * 3})
+        with open(filename, 'rb') as f:
+            data = f.read()
+        assert texts(data)['star_data'] == value
+        assert texts(data)['label'] == value * 3
+        assert load_index(filename) == build_index(data)
+    assert patch_svg(filename, {'star_data': '42'}) == 0
+
+
+def test_stale_or_corrupt_index_is_rebuilt(tmp_path):
+    filename = write_svg(tmp_path)
+    patch_svg(filename, {'star_data': '7'})
+
+    # rewritten by something else: the stored spans no longer apply
+    with open(filename, 'wb') as f:
+        f.write(b'<svg><desc>moved</desc>' + DOCUMENT[DOCUMENT.index(b'<text'):])
+    patch_svg(filename, {'star_data': '8'})
+    with open(filename, 'rb') as f:
+        assert texts(f.read())['star_data'] == '8'
+
+    with open(index_filename(filename), 'w') as f:
+        f.write('{"version": 1, "size"')
+    patch_svg(filename, {'star_data': '9'})
+    with open(filename, 'rb') as f:
+        data = f.read()
+    assert texts(data)['star_data'] == '9'
+    assert load_index(filename) == build_index(data)
+
+
+def test_svg_overwrite_justifies_values(tmp_path):
+    filename = write_svg(tmp_path)
+    svg_overwrite(filename, 1, 123456, 5, 1, 1, 1, [0, 0, 0])
+    with open(filename, 'rb') as f:
+        data = f.read()
+    values = texts(data)
+    assert values['star_data'] + values['star_data_dots'] == '5 ' + '.' * 13 + ' '
+    assert values['commit_data'] + values['commit_data_dots'] == '123,456 ' + '.' * 15 + ' '
+    assert os.path.exists(index_filename(filename))
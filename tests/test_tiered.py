@@ -0,0 +1,73 @@
+"""Failures of the disk and shared tiers are cache misses, not errors."""
+
+import json
+import socket
+import threading
+import time
+
+from multiprocessing import AuthenticationError
+
+import pytest
+
+from cache.tiered import DiskTier, SharedTier, serve_shared_cache
+
+
+@pytest.fixture(scope='module')
+def server_address():
+    """Start a shared cache server with the default authkey."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        address = probe.getsockname()
+    threading.Thread(target=serve_shared_cache, args=(address,), daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(address, timeout=1).close()
+            return address
+        except OSError:
+            time.sleep(0.05)
+    pytest.fail('shared cache server did not start')
+
+
+def test_shared_tier_round_trip(server_address):
+    tier = SharedTier(server_address)
+    tier.set('key', (time.time() + 60, {'value': 1}))
+    assert tier.get('key')[1] == {'value': 1}
+
+
+def test_wrong_authkey_disables_the_shared_tier(server_address, capsys):
+    tier = SharedTier(server_address, authkey=b'wrong')
+    assert tier.get('key') is None
+    tier.set('key', (time.time() + 60, 1))
+    assert 'AuthenticationError' in capsys.readouterr().out
+
+
+def test_authentication_error_during_a_call_disables_the_shared_tier():
+    class Store:
+        calls = 0
+
+        def get(self, key):
+            Store.calls += 1
+            raise AuthenticationError('digest sent was rejected')
+
+    tier = SharedTier(store=Store())
+    assert tier.get('key') is None
+    assert tier.get('key') is None
+    assert Store.calls == 1
+
+
+@pytest.mark.parametrize('stored', [
+    {'expires': 2e9, 'value': 1},
+    {'key': 'key', 'value': 1},
+    {'key': 'key', 'expires': 2e9},
+    {'key': 'key', 'expires': 'never', 'value': 1},
+    ['key', 2e9, 1],
+    'not an object',
+], ids=['no key', 'no expiry', 'no value', 'bad expiry', 'list', 'string'])
+def test_malformed_disk_entries_are_misses(tmp_path, stored):
+    tier = DiskTier(str(tmp_path))
+    tier.set('key', (2e9, 1))
+    with open(tier._path('key'), 'w') as f:
+        json.dump(stored, f)
+    assert tier.get('key') is None
+    assert tier.prune() == 1
+    assert list(tmp_path.iterdir()) == []
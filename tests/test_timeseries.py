@@ -0,0 +1,112 @@
+"""Encoding, round trips and torn frames of the statistics history."""
+
+import pytest
+
+from cache.timeseries import MAGIC, TimeSeriesStore, decode_varint, encode_varint, unzigzag, zigzag
+
+RUNS = [
+    (1_700_000_000, {'stars': 10, 'followers': 3}),
+    (1_700_086_400, {'stars': 12, 'followers': 2, 'repos': 7}),
+    (1_700_172_800, {'stars': 9, 'repos': 300}),
+    (1_700_259_200, {'stars': 9, 'followers': 5, 'repos': 301}),
+]
+
+
+def samples(
+    store: TimeSeriesStore,
+) -> dict[str, list[tuple[int, int]]]:
+    return {name: store.range(name) for name in store.series()}
+
+
+def write_history(
+    filename: str,
+) -> dict[str, list[tuple[int, int]]]:
+    store = TimeSeriesStore(filename)
+    for timestamp, values in RUNS:
+        store.append(values, timestamp)
+    return samples(store)
+
+
+@pytest.mark.parametrize('value', [0, 1, 127, 128, 300, 2**31, 2**63 - 1])
+def test_varint_round_trip(value):
+    data = b'\xff' + encode_varint(value)
+    assert decode_varint(data, 1) == (value, len(data))
+
+
+@pytest.mark.parametrize('value', [0, 1, -1, 2, -2, 1000, -1000])
+def test_zigzag_round_trip(value):
+    assert zigzag(value) >= 0
+    assert unzigzag(zigzag(value)) == value
+
+
+def test_varint_ends_mid_value():
+    with pytest.raises(IndexError):
+        decode_varint(encode_varint(300)[:-1], 0)
+
+
+def test_round_trip_after_reopen(tmp_path):
+    filename = str(tmp_path / 'history.ts')
+    written = write_history(filename)
+    assert written['stars'] == [(timestamp, values['stars']) for timestamp, values in RUNS]
+
+    reopened = TimeSeriesStore(filename)
+    assert reopened.series() == ['stars', 'followers', 'repos']
+    assert samples(reopened) == written
+    assert reopened.range('repos', 1_700_086_400, 1_700_172_800) == [(1_700_086_400, 7), (1_700_172_800, 300)]
+    assert reopened.range('missing') == []
+
+
+def test_skips_non_integer_values(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'history.ts'))
+    store.append({'stars': 1, 'loc': '1,234', 'ratio': 0.5, 'private': True}, 1)
+    assert store.series() == ['stars']
+
+
+def test_rejects_samples_out_of_order(tmp_path):
+    filename = str(tmp_path / 'history.ts')
+    store = TimeSeriesStore(filename)
+    store.append({'stars': 1}, 200)
+    store.append({'stars': 2}, 200)
+    with pytest.raises(ValueError):
+        TimeSeriesStore(filename).append({'stars': 3}, 100)
+    store.append({'stars': 4}, 300)
+    assert store.range('stars') == [(200, 1), (200, 2), (300, 4)]
+
+
+def test_downsample(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'history.ts'))
+    for hour, value in enumerate([5, 1, 9, 4]):
+        store.append({'stars': value}, hour * 3600 * 12)
+    assert store.downsample('stars', 86400) == [(0, 1), (86400, 4)]
+    assert store.downsample('stars', 86400, 'max') == [(0, 5), (86400, 9)]
+    assert store.downsample('stars', 86400, 'mean') == [(0, 3), (86400, 6)]
+
+
+def test_torn_frames_are_dropped_and_overwritten(tmp_path):
+    complete = tmp_path / 'complete.ts'
+    written = write_history(str(complete))
+    data = complete.read_bytes()
+
+    torn = tmp_path / 'torn.ts'
+    for size in range(len(MAGIC), len(data)):
+        torn.write_bytes(data[:size])
+        store = TimeSeriesStore(str(torn))
+        kept = samples(store)
+        # whole runs only: every series holds a prefix of what was written
+        assert all(kept[name] == written[name][:len(kept[name])] for name in kept)
+        times = {timestamp for series in kept.values() for timestamp, _ in series}
+        assert times == {timestamp for timestamp, _ in RUNS[:len(times)]}
+
+        store.append({'stars': 42, 'new': 1}, 1_800_000_000)
+        reopened = samples(TimeSeriesStore(str(torn)))
+        assert reopened['stars'][-1] == (1_800_000_000, 42)
+        assert reopened['new'] == [(1_800_000_000, 1)]
+        assert {name: series[:-1] if name in ('stars', 'new') else series for name, series in reopened.items()} \
+            == {**kept, 'stars': kept.get('stars', []), 'new': []}
+
+
+def test_rejects_foreign_files(tmp_path):
+    filename = tmp_path / 'history.ts'
+    filename.write_bytes(b'NOTSTATS\x00')
+    with pytest.raises(ValueError):
+        TimeSeriesStore(str(filename))
@@ -0,0 +1,75 @@
+"""Running totals read from the text and binary caches."""
+
+import hashlib
+import os
+
+from dataclasses import asdict
+
+import pytest
+
+from cache import cache
+from cache.binary import BinaryCache
+from cache.totals import ARCHIVED, UNATTRIBUTED, Totals
+from config.environment import EnvConfig, override_settings
+
+ROWS = [
+    ('me/a', (10, 4, 300, 20), ''),
+    ('me/b', (7, 7, 70, 7), ''),
+    ('me/old', (5, 5, 50, 5), 'archived'),
+    ('deleted', (0, 3, 30, 3), 'archived-unattributed'),
+]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory holding a text cache of `ROWS`."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'cache').mkdir()
+    with override_settings(EnvConfig(ACCESS_TOKEN='token', USER_NAME='me')):
+        lines = ['comment\n'] * 7
+        for name, counts, tag in ROWS:
+            lines.append(' '.join([hashlib.sha256(name.encode()).hexdigest(), *map(str, counts), tag]).strip() + '\n')
+        with open(cache.cache_filename(), 'w') as f:
+            f.write(''.join(lines))
+        yield tmp_path
+
+
+def totals_of(
+    cache_format: str,
+) -> Totals:
+    with override_settings(CACHE_FORMAT=cache_format):
+        running = asdict(cache.load_totals(7))
+    return {key: value for key, value in running.items() if not key.startswith('source_')}
+
+
+def test_binary_totals_match_the_text_cache(workdir):
+    text = totals_of('text')
+    assert text['my_commits'] == 11
+    assert text['archived_commits'] == 8
+    assert text['archived_repos'] == 1
+
+    # the first binary read converts the text cache instead of starting empty
+    assert totals_of('binary') == text
+    assert os.path.exists(cache.cache_filename('.bin'))
+    assert totals_of('binary') == text
+
+
+def test_reading_never_creates_an_empty_cache(workdir):
+    os.remove(cache.cache_filename())
+    assert totals_of('binary')['my_commits'] == 0
+    assert not os.path.exists(cache.cache_filename('.bin'))
+
+
+def test_unreadable_binary_cache_is_rebuilt(workdir):
+    with open(cache.cache_filename('.bin'), 'wb') as f:
+        f.write(b'LOCCACHE\x01\x00\x00\x00\x05\x00\x00\x00')
+    assert totals_of('binary') == totals_of('text')
+
+
+def test_binary_totals_sum_columns(tmp_path):
+    rows = [(hashlib.sha256(name.encode()).digest(), *counts, ARCHIVED | (UNATTRIBUTED if tag.endswith('unattributed') else 0)
+             if tag else 0) for name, counts, tag in ROWS]
+    with BinaryCache(str(tmp_path / 'cache.bin')) as store:
+        store.update_many(rows)
+        assert [row[0] for row in store.flagged(ARCHIVED)] == sorted(row[0] for row in rows if row[5])
+        assert cache.binary_totals(store) == Totals.from_rows([row[1:] for row in rows])